@@ -0,0 +1,412 @@
+# app/admission.py
+import os
+import json
+import math
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+from app.metrics import registry
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Control de admisión delante de /analyze (cada análisis cuesta tokens del
+#  LLM y minutos de CPU; el captcha de la UI no protege la API):
+#   - Token buckets por cliente (X-API-Key o IP) y uno global. Una petición
+#     cuesta 1 + tamaño/ADMISSION_BYTES_PER_TOKEN al entrar; al terminar se
+#     liquida por páginas leídas (o se devuelve lo cobrado si salió de caché).
+#     Sin saldo → 429 con el Retry-After exacto hasta que el bucket lo cubra.
+#   - Estado en memoria (por proceso) o en SQLite (ADMISSION_BACKEND=sqlite:
+#     sobrevive a reinicios y lo comparten los workers de uvicorn del host).
+#   - Reparto justo de ADMISSION_MAX_CONCURRENT análisis simultáneos:
+#     deficit round robin por cliente ponderado por coste, así un script con
+#     muchas peticiones en cola no retrasa a los demás clientes.
+#  Toda petición admitida se liquida una vez: por su resultado, con la
+#  devolución de una respuesta de error (solo paga la base) o, si se encola
+#  como job, en el worker que la ejecuta (que también pasa por la cola justa).
+#  Las API keys no se validan (no hay autenticación): rotar keys solo evita el
+#  límite por cliente; el bucket global sigue acotando el total. La UI de
+#  Streamlit envía su propia key (API_KEY), con cuota en ADMISSION_QUOTAS.
+# ─────────────────────────────────────────────────────────────────────────────
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory").strip().lower()
+ADMISSION_DB_PATH = os.getenv("ADMISSION_DB", os.path.join(".data", "admission.sqlite3"))
+# Tokens por segundo y capacidad de cada bucket
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "0.2"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "10"))
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", "2"))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "60"))
+# Coste: 1 token por petición + tamaño (al entrar) o páginas leídas (al liquidar)
+ADMISSION_BASE_COST = 1.0
+ADMISSION_BYTES_PER_TOKEN = int(os.getenv("ADMISSION_BYTES_PER_TOKEN", str(1024 * 1024)))
+ADMISSION_PAGES_PER_TOKEN = int(os.getenv("ADMISSION_PAGES_PER_TOKEN", "20"))
+# Cuotas propias por cliente: {"<api key>": {"rate": 1, "burst": 50}, "ip:10.0.0.5": {...}}
+ADMISSION_QUOTAS = json.loads(os.getenv("ADMISSION_QUOTAS", "{}") or "{}")
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "4"))  # en espera por cliente
+# Proxies de confianza delante de la API (Render: 1); con 0 se usa la IP del socket
+ADMISSION_PROXY_HOPS = int(os.getenv("ADMISSION_PROXY_HOPS", "0"))
+ADMISSION_MAX_CLIENTS = 100_000
+
+ADMISSIONS = registry.counter("admissions_total", "Decisiones del control de admisión.", ("result",))
+ADMISSION_WAIT_SECONDS = registry.histogram("admission_wait_seconds", "Espera en la cola justa hasta empezar el análisis.")
+ADMISSION_QUEUED = registry.gauge("admission_queued", "Peticiones esperando turno en la cola justa.")
+ADMISSION_ACTIVE = registry.gauge("admission_active", "Análisis en curso con turno asignado.")
+
+GLOBAL_KEY = "global"
+
+
+class RateLimited(Exception):
+    """Sin saldo o con la cola del cliente llena (la API lo devuelve como 429 con Retry-After)."""
+
+    def __init__(self, error_code: str, message: str, retry_after: float):
+        super().__init__(message)
+        self.error_code = error_code
+        self.message = message
+        self.retry_after = retry_after
+
+    def to_dict(self) -> dict:
+        return {"error_code": self.error_code, "message": self.message}
+
+
+class Ticket:
+    """Petición admitida: cliente y tokens cobrados (para liquidar y para la cola justa)."""
+
+    def __init__(self, client: str, cost: float):
+        self.client = client
+        self.cost = cost
+        self.settled = False
+
+    def handoff(self) -> dict:
+        """Traspasa la liquidación (a un job en segundo plano); esta petición ya no la hace."""
+        self.settled = True
+        return {"client": self.client, "cost": self.cost}
+
+
+def _hash_key(api_key: str) -> str:
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# Cuotas por id de cliente: "ip:<IP>" tal cual; cualquier otra clave es una API key
+_QUOTAS = {
+    (name if name.startswith("ip:") else _hash_key(name)):
+        (float(q.get("rate", ADMISSION_CLIENT_RATE)), float(q.get("burst", ADMISSION_CLIENT_BURST)))
+    for name, q in ADMISSION_QUOTAS.items()
+}
+
+
+def client_id(headers, peer: Optional[str]) -> str:
+    """key:<sha256 de X-API-Key> o ip:<IP>; la key en claro no se guarda en ningún sitio."""
+    api_key = (headers.get("x-api-key") or "").strip()
+    if api_key:
+        return _hash_key(api_key)
+    ip = peer or "unknown"
+    if ADMISSION_PROXY_HOPS > 0:
+        # Cada proxy añade al final la IP de quien le conectó: lo anterior lo controla el cliente
+        forwarded = [p.strip() for p in (headers.get("x-forwarded-for") or "").split(",") if p.strip()]
+        if len(forwarded) >= ADMISSION_PROXY_HOPS:
+            ip = forwarded[-ADMISSION_PROXY_HOPS]
+    return "ip:" + ip
+
+
+def request_cost(content_length: Optional[str]) -> float:
+    """Coste estimado al entrar (aún sin leer el archivo): 1 + bytes declarados / ADMISSION_BYTES_PER_TOKEN."""
+    try:
+        size = max(0, int(content_length or 0))
+    except ValueError:
+        size = 0
+    return ADMISSION_BASE_COST + size / ADMISSION_BYTES_PER_TOKEN
+
+
+def settled_cost(debug: dict) -> float:
+    """Coste real según el resultado: la caché y las traducciones solo pagan la base."""
+    if str(debug.get("cache", "")).startswith("hit") or debug.get("translated_from"):
+        return ADMISSION_BASE_COST
+    return ADMISSION_BASE_COST + (debug.get("pages_read") or 0) / ADMISSION_PAGES_PER_TOKEN
+
+
+def _refill(tokens: float, updated: float, now: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+def _take(buckets, now: float, cost: float):
+    """
+    buckets: [(clave, tokens, updated, rate, burst)]. Cobra `cost` de todos o de
+    ninguno. Devuelve (nuevos saldos | None, segundos hasta poder pagarlo,
+    bucket que lo impide).
+    """
+    levels, wait, blocked = [], 0.0, None
+    for key, tokens, updated, rate, burst in buckets:
+        level = _refill(tokens, updated, now, rate, burst)
+        need = min(cost, burst)  # una petición más cara que el bucket entero pasa con el bucket lleno
+        if level < need:
+            key_wait = (need - level) / rate if rate > 0 else math.inf
+            if key_wait > wait:
+                wait, blocked = key_wait, key
+        levels.append((key, level - need))
+    return (None if blocked else levels), wait, blocked
+
+
+class MemoryBuckets:
+    """Buckets en memoria del proceso; LRU acotado a ADMISSION_MAX_CLIENTS."""
+
+    def __init__(self, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._state: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, specs, cost: float) -> Tuple[bool, float, Optional[str]]:
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for key, rate, burst in specs:
+                tokens, updated = self._state.get(key, (burst, now))
+                rows.append((key, tokens, updated, rate, burst))
+            levels, wait, blocked = _take(rows, now, cost)
+            if levels is None:
+                return False, wait, blocked
+            for key, level in levels:
+                self._state[key] = (level, now)
+                self._state.move_to_end(key)
+            while len(self._state) > self.max_clients:
+                # El más antiguo ya se habrá rellenado: olvidarlo equivale a dejarlo lleno
+                self._state.popitem(last=False)
+        return True, 0.0, None
+
+    def adjust(self, specs, delta: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key, rate, burst in specs:
+                tokens, updated = self._state.get(key, (burst, now))
+                level = _refill(tokens, updated, now, rate, burst)
+                # La deuda se acota a un bucket entero: el cliente espera como mucho burst/rate
+                self._state[key] = (max(-burst, min(burst, level - delta)), now)
+
+
+class SQLiteBuckets:
+    """Buckets en SQLite (una conexión por operación, como SQLiteStore); reloj de pared."""
+
+    def __init__(self, path: str = ADMISSION_DB_PATH):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS buckets ("
+                            " key TEXT PRIMARY KEY,"
+                            " tokens REAL NOT NULL,"
+                            " updated REAL NOT NULL)"
+                        )
+                    self._ready = True
+        # isolation_level=None: la transacción la abre BEGIN IMMEDIATE (lectura y escritura atómicas)
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _rows(self, conn, specs, now: float):
+        keys = [key for key, _, _ in specs]
+        stored = dict((k, (t, u)) for k, t, u in conn.execute(
+            f"SELECT key, tokens, updated FROM buckets WHERE key IN ({','.join('?' * len(keys))})", keys))
+        return [(key, *stored.get(key, (burst, now)), rate, burst) for key, rate, burst in specs]
+
+    def take(self, specs, cost: float) -> Tuple[bool, float, Optional[str]]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = self._rows(conn, specs, now)
+            levels, wait, blocked = _take(rows, now, cost)
+            if levels is not None:
+                conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                                 [(key, level, now) for key, level in levels])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return levels is not None, wait, blocked
+
+    def adjust(self, specs, delta: float) -> None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, max(-burst, min(burst, _refill(tokens, updated, now, rate, burst) - delta)), now)
+                 for key, tokens, updated, rate, burst in self._rows(conn, specs, now)],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+class FairQueue:
+    """
+    Turnos para ADMISSION_MAX_CONCURRENT análisis simultáneos. Los que esperan
+    se sirven por deficit round robin entre clientes: en cada vuelta un
+    cliente gana `quantum` tokens de crédito y pasa su siguiente petición si
+    el crédito cubre su coste.
+    """
+
+    def __init__(self, slots: int = ADMISSION_MAX_CONCURRENT, max_queued: int = ADMISSION_MAX_QUEUED,
+                 quantum: float = 2.0):
+        self.slots = slots
+        self.max_queued = max_queued
+        self.quantum = quantum
+        self._active = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._deficit: Dict[str, float] = {}
+        self._waiting = 0
+        # Media móvil de la duración de un turno, para el Retry-After de la cola llena
+        self._avg_hold_s = 0.0
+
+    def _publish(self) -> None:
+        ADMISSION_ACTIVE.set(self._active)
+        ADMISSION_QUEUED.set(self._waiting)
+
+    def _retry_after(self) -> float:
+        return max(1.0, self._avg_hold_s * (self._waiting + 1) / max(1, self.slots))
+
+    async def acquire(self, ticket: Ticket, bounded: bool = True) -> None:
+        """bounded=False (jobs ya aceptados): espera sin el límite de max_queued por cliente."""
+        if self._active < self.slots and not self._waiting:
+            self._active += 1
+            self._publish()
+            ADMISSION_WAIT_SECONDS.observe(0.0)
+            return
+        queue = self._queues.get(ticket.client)
+        if bounded and queue is not None and len(queue) >= self.max_queued:
+            ADMISSIONS.inc(result="queue_full")
+            raise RateLimited(
+                "too_many_queued",
+                f"Ya tienes {len(queue)} análisis esperando turno; reintenta cuando terminen",
+                retry_after=math.ceil(self._retry_after()),
+            )
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, ticket.cost)
+        if queue is None:
+            queue = self._queues[ticket.client] = deque()
+            self._deficit.setdefault(ticket.client, 0.0)
+        queue.append(entry)
+        self._waiting += 1
+        self._publish()
+        t0 = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # El turno llegó a la vez que la cancelación: se pasa al siguiente
+                self._hand_off()
+            else:
+                self._forget(ticket.client, entry)
+            raise
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - t0)
+
+    def _forget(self, client: str, entry) -> None:
+        queue = self._queues.get(client)
+        if queue is not None and entry in queue:
+            queue.remove(entry)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[client]
+                self._deficit.pop(client, None)
+        self._publish()
+
+    def release(self, held_s: float) -> None:
+        self._avg_hold_s = held_s if not self._avg_hold_s else 0.9 * self._avg_hold_s + 0.1 * held_s
+        self._hand_off()
+
+    def _hand_off(self) -> None:
+        self._active -= 1
+        while self._active < self.slots and self._waiting:
+            self._dispatch()
+        self._publish()
+
+    def _dispatch(self) -> None:
+        # Deficit round robin: el cliente en cabeza acumula crédito hasta cubrir su siguiente petición
+        while True:
+            client, queue = next(iter(self._queues.items()))
+            waiter, cost = queue[0]
+            if self._deficit[client] + self.quantum >= cost or waiter.done():
+                break
+            self._deficit[client] += self.quantum
+            self._queues.move_to_end(client)
+        queue.popleft()
+        self._waiting -= 1
+        self._deficit[client] = max(0.0, self._deficit[client] + self.quantum - cost)
+        if queue:
+            self._queues.move_to_end(client)
+        else:
+            del self._queues[client]
+            self._deficit.pop(client, None)
+        if waiter.done():
+            return  # cancelada mientras esperaba: el turno no se consume
+        self._active += 1
+        waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, ticket: Optional[Ticket], bounded: bool = True):
+        """Turno justo para `ticket` (sin ticket, admisión desactivada: no espera)."""
+        if ticket is None:
+            yield
+            return
+        await self.acquire(ticket, bounded)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - t0)
+
+
+class AdmissionController:
+    def __init__(self, buckets=None):
+        self.buckets = buckets or (SQLiteBuckets() if ADMISSION_BACKEND == "sqlite" else MemoryBuckets())
+
+    def _specs(self, client: str):
+        rate, burst = _QUOTAS.get(client, (ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST))
+        return [(client, rate, burst), (GLOBAL_KEY, ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST)]
+
+    def admit(self, client: str, cost: float) -> Ticket:
+        """Cobra `cost` al cliente y al bucket global o lanza RateLimited."""
+        ok, wait, blocked = self.buckets.take(self._specs(client), cost)
+        if not ok:
+            scope = "global" if blocked == GLOBAL_KEY else "client"
+            ADMISSIONS.inc(result=f"rate_limited_{scope}")
+            message = ("El servicio está al límite de análisis; reintenta más tarde" if scope == "global"
+                       else "Has superado tu cuota de análisis; reintenta más tarde")
+            # Con rate=0 el bucket no se rellena: se sugiere reintentar en una hora
+            raise RateLimited("rate_limited", message, retry_after=math.ceil(min(wait, 3600)))
+        ADMISSIONS.inc(result="admitted")
+        return Ticket(client, cost)
+
+    def settle(self, ticket: Optional[Ticket], debug: dict) -> None:
+        """Ajusta lo cobrado al coste real (páginas leídas, caché): devuelve o cobra la diferencia."""
+        if ticket is None or ticket.settled:
+            return
+        ticket.settled = True
+        delta = settled_cost(debug) - ticket.cost
+        if abs(delta) >= 1e-6:
+            self.buckets.adjust(self._specs(ticket.client), delta)
+
+    def refund(self, ticket: Optional[Ticket]) -> None:
+        """Petición sin resultado (error, cola llena, cliente desconectado): solo paga la base."""
+        self.settle(ticket, {})
+
+
+admission = AdmissionController()
+fair_queue = FairQueue()
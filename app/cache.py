@@ -0,0 +1,186 @@
+# app/cache.py
+import os
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Caché de resultados de /analyze direccionada por contenido:
+#   - Nivel 1: LRU en memoria (por proceso) con límite de tamaño y TTL.
+#   - Nivel 2: SQLite en disco, sobrevive a reinicios del servicio.
+#  La clave es un hash de (bytes del archivo, context, lang, modelo, versión
+#  del prompt), de modo que cualquier cambio relevante invalida la entrada.
+#  El nivel en memoria guarda una copia profunda: lo que la petición añada
+#  después al resultado (_debug de la petición) no altera la entrada.
+# ─────────────────────────────────────────────────────────────────────────────
+
+CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") != "0"
+CACHE_MAX_ITEMS = int(os.getenv("RESULT_CACHE_MAX_ITEMS", "256"))
+CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", str(7 * 24 * 3600)))
+CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB", os.path.join(".data", "result_cache.sqlite3"))
+
+
+def file_digest(source) -> str:
+    """SHA-256 hex del contenido del archivo subido (bytes o ruta en disco)."""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(file_sha256: str, context: str, lang: str, model: str, prompt_version: str, **options) -> str:
+    """
+    Construye la clave de caché. Se serializa como JSON para que no haya
+    ambigüedad entre campos (p. ej. un context que contenga separadores).
+    `options` recoge parámetros que cambian el resultado (p. ej. el modo).
+    """
+    payload = json.dumps(
+        [file_sha256, context or "", lang, model, prompt_version, sorted(options.items())],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """LRU en memoria con TTL. Thread-safe (uvicorn puede usar threads)."""
+
+    def __init__(self, max_items: int, ttl_s: float):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.time() - stored_at > self.ttl_s:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, stored_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (stored_at or time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Nivel persistente. Una conexión por operación: simple y seguro entre threads."""
+
+    def __init__(self, path: str, ttl_s: float):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS results ("
+                            " key TEXT PRIMARY KEY,"
+                            " value TEXT NOT NULL,"
+                            " stored_at REAL NOT NULL)"
+                        )
+                    self._ready = True
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key: str) -> Optional[Tuple[float, dict]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, stored_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, stored_at = row
+            if time.time() - stored_at > self.ttl_s:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+        return stored_at, json.loads(value)
+
+    def set(self, key: str, value: dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+
+class ResultCache:
+    """
+    Caché de dos niveles. get() devuelve (resultado, nivel) donde nivel es
+    "memory", "disk" o None si no hay entrada válida.
+    """
+
+    def __init__(self, max_items: int = CACHE_MAX_ITEMS, ttl_s: float = CACHE_TTL_S,
+                 db_path: str = CACHE_DB_PATH, enabled: bool = CACHE_ENABLED):
+        self.enabled = enabled
+        self.memory = MemoryLRU(max_items, ttl_s)
+        self.disk = SQLiteStore(db_path, ttl_s)
+
+    def get(self, key: str) -> Tuple[Optional[dict], Optional[str]]:
+        if not self.enabled:
+            return None, None
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        try:
+            hit = self.disk.get(key)
+        except sqlite3.Error as e:
+            print(f"[cache] disk get failed: {e}")
+            hit = None
+        if hit is None:
+            return None, None
+        stored_at, value = hit
+        # Promociona al nivel en memoria conservando la antigüedad original (TTL)
+        self.memory.set(key, value, stored_at=stored_at)
+        return value, "disk"
+
+    def set(self, key: str, value: dict) -> None:
+        if not self.enabled:
+            return
+        self.memory.set(key, copy.deepcopy(value))
+        try:
+            self.disk.set(key, value)
+        except sqlite3.Error as e:
+            print(f"[cache] disk set failed: {e}")
+
+    def invalidate(self, key: str) -> None:
+        self.memory.delete(key)
+        try:
+            self.disk.delete(key)
+        except sqlite3.Error as e:
+            print(f"[cache] disk delete failed: {e}")
+
+
+result_cache = ResultCache()
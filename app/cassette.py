@@ -0,0 +1,272 @@
+# app/cassette.py
+import os
+import gzip
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from app.metrics import registry
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Cassettes de llamadas al LLM (grabar y reproducir, sin red):
+#   - LLM_CASSETTE_MODE=record: las llamadas van a la API real y cada par
+#     petición/respuesta se añade al cassette (JSONL comprimido con gzip):
+#     hash del prompt, contenido, usage, latencia y, en streaming, los trozos
+#     con su instante. Los errores de la API también se graban.
+#   - LLM_CASSETTE_MODE=replay: las respuestas salen del cassette con la
+#     latencia grabada multiplicada por LLM_CASSETTE_LATENCY (0 = inmediato);
+#     no hace falta OPENAI_API_KEY ni red. Un prompt no grabado es un error.
+#  La clave es el SHA-256 de modelo + mensajes + parámetros: cualquier cambio
+#  de prompt (PROMPT_VERSION, documento, contexto) es otra entrada. Si un
+#  prompt se grabó varias veces (reintentos) se reproduce en el mismo orden y
+#  después se repite la última respuesta.
+#  Cada entrada se escribe como un miembro gzip completo: un proceso que muere
+#  o una segunda sesión que graba en el mismo archivo no dejan un miembro a
+#  medias delante de las entradas siguientes.
+#  Se interpone en los clientes del SDK nuevo (chat.completions.create), así
+#  que transporte, reintentos, streaming y métricas funcionan igual que en vivo.
+# ─────────────────────────────────────────────────────────────────────────────
+
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").strip().lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE", os.path.join(".data", "cassettes", "llm.jsonl.gz"))
+# "recorded" (= 1) reproduce la latencia grabada; un número la escala
+_latency = os.getenv("LLM_CASSETTE_LATENCY", "recorded").strip().lower()
+LLM_CASSETTE_LATENCY = 1.0 if _latency == "recorded" else float(_latency)
+
+CASSETTE_CALLS = registry.counter("llm_cassette_calls_total", "Llamadas servidas o grabadas por el cassette.", ("result",))
+
+# Parámetros que no cambian la respuesta y no entran en la clave
+_KEY_IGNORED = ("timeout", "stream_options")
+
+
+class CassetteMiss(Exception):
+    """Prompt sin respuesta grabada en modo replay (no se reintenta)."""
+
+
+class ReplayedAPIError(Exception):
+    """Error de la API grabado en el cassette; transport.classify lo trata como el original."""
+
+    def __init__(self, message: str, reason: str, retryable: bool, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.cassette_reason = reason
+        self.cassette_retryable = retryable
+        self.status_code = status_code
+
+
+def cassette_key(kwargs: dict) -> str:
+    payload = {k: v for k, v in kwargs.items() if k not in _KEY_IGNORED}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _usage_dict(usage) -> Optional[Dict[str, int]]:
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+def _response(content: str, usage: Optional[dict]):
+    # Mismos atributos que usa risk_engine de un ChatCompletion del SDK nuevo
+    message = SimpleNamespace(content=content, role="assistant")
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message, finish_reason="stop", index=0)],
+        usage=SimpleNamespace(**usage) if usage else None,
+    )
+
+
+def _chunk(text: Optional[str] = None, usage: Optional[dict] = None):
+    choices = [] if text is None else [SimpleNamespace(delta=SimpleNamespace(content=text), index=0)]
+    return SimpleNamespace(choices=choices, usage=SimpleNamespace(**usage) if usage else None)
+
+
+def _error_entry(exc) -> dict:
+    from app.transport import classify
+
+    retryable, reason = classify(exc)
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return {"reason": reason, "retryable": retryable, "status": status, "message": str(exc)[:500]}
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class CassetteClient:
+    """Imita client.chat.completions.create (sync o async) del SDK nuevo."""
+
+    def __init__(self, create):
+        self.chat = SimpleNamespace(completions=_Completions(create))
+
+
+class Cassette:
+    """Un archivo de cassette: índice en memoria por clave y escritura en modo append."""
+
+    def __init__(self, path: str = LLM_CASSETTE_PATH, latency_scale: float = LLM_CASSETTE_LATENCY):
+        self.path = path
+        self.latency_scale = latency_scale
+        self._entries: Optional[Dict[str, List[dict]]] = None
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._out = None
+
+    # ── almacenamiento ───────────────────────────────────────────────────────
+    def _load(self) -> Dict[str, List[dict]]:
+        if self._entries is None:
+            entries: Dict[str, List[dict]] = {}
+            if os.path.exists(self.path):
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    try:
+                        for line in f:
+                            if line.strip():
+                                entry = json.loads(line)
+                                entries.setdefault(entry["key"], []).append(entry)
+                    except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError) as e:
+                        # Grabación interrumpida: lo leído hasta ahí es válido
+                        print(f"[cassette] {self.path}: truncated after {sum(map(len, entries.values()))} entries ({e})")
+                        pass
+            self._entries = entries
+        return self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._load().values())
+
+    def append(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        member = gzip.compress(line.encode("utf-8"))
+        with self._lock:
+            if self._out is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._out = open(self.path, "ab")
+            self._out.write(member)
+            self._out.flush()
+            if self._entries is not None:
+                self._entries.setdefault(entry["key"], []).append(entry)
+        CASSETTE_CALLS.inc(result="recorded")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+
+    def lookup(self, kwargs: dict) -> dict:
+        key = cassette_key(kwargs)
+        with self._lock:
+            recorded = self._load().get(key)
+            if not recorded:
+                CASSETTE_CALLS.inc(result="miss")
+                raise CassetteMiss(f"Sin respuesta grabada para el prompt {key[:12]} en {self.path}")
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+        CASSETTE_CALLS.inc(result="hit")
+        return recorded[min(i, len(recorded) - 1)]
+
+    # ── grabación ────────────────────────────────────────────────────────────
+    def _entry(self, kwargs: dict, started: float, **fields) -> dict:
+        return {
+            "key": cassette_key(kwargs),
+            "model": kwargs.get("model"),
+            "stream": bool(kwargs.get("stream")),
+            "prompt_chars": sum(len(str(m.get("content", ""))) for m in kwargs.get("messages", [])),
+            "latency_s": round(time.perf_counter() - started, 4),
+            **fields,
+        }
+
+    def recording(self, real) -> CassetteClient:
+        def create(**kwargs):
+            t0 = time.perf_counter()
+            try:
+                resp = real.chat.completions.create(**kwargs)
+            except Exception as e:
+                self.append(self._entry(kwargs, t0, error=_error_entry(e)))
+                raise
+            self.append(self._entry(kwargs, t0, content=resp.choices[0].message.content,
+                                    usage=_usage_dict(resp.usage)))
+            return resp
+
+        return CassetteClient(create)
+
+    def recording_async(self, real) -> CassetteClient:
+        async def create(**kwargs):
+            t0 = time.perf_counter()
+            try:
+                resp = await real.chat.completions.create(**kwargs)
+            except asyncio.CancelledError:
+                raise  # timeout del transporte o hedging perdedor: no es una respuesta de la API
+            except Exception as e:
+                self.append(self._entry(kwargs, t0, error=_error_entry(e)))
+                raise
+            if kwargs.get("stream"):
+                return self._record_stream(kwargs, t0, resp)
+            self.append(self._entry(kwargs, t0, content=resp.choices[0].message.content,
+                                    usage=_usage_dict(resp.usage)))
+            return resp
+
+        return CassetteClient(create)
+
+    async def _record_stream(self, kwargs: dict, started: float, stream):
+        chunks, usage = [], None
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append([round(time.perf_counter() - started, 4), chunk.choices[0].delta.content])
+            yield chunk
+        # Solo streams completos: uno abandonado no sirve para reproducir
+        self.append(self._entry(kwargs, started, content="".join(c[1] for c in chunks),
+                                chunks=chunks, usage=_usage_dict(usage)))
+
+    # ── reproducción ─────────────────────────────────────────────────────────
+    @staticmethod
+    def _raise_if_error(entry: dict) -> None:
+        error = entry.get("error")
+        if error:
+            raise ReplayedAPIError(error["message"], error["reason"], error["retryable"], error.get("status"))
+
+    def replay(self) -> CassetteClient:
+        def create(**kwargs):
+            entry = self.lookup(kwargs)
+            time.sleep(entry["latency_s"] * self.latency_scale)
+            self._raise_if_error(entry)
+            return _response(entry["content"], entry.get("usage"))
+
+        return CassetteClient(create)
+
+    def replay_async(self) -> CassetteClient:
+        async def create(**kwargs):
+            entry = self.lookup(kwargs)
+            if kwargs.get("stream") and entry.get("chunks") is not None:
+                self._raise_if_error(entry)
+                return self._replay_stream(entry)
+            await asyncio.sleep(entry["latency_s"] * self.latency_scale)
+            self._raise_if_error(entry)
+            if kwargs.get("stream"):
+                return self._replay_stream({**entry, "chunks": [[0, entry["content"]]], "latency_s": 0})
+            return _response(entry["content"], entry.get("usage"))
+
+        return CassetteClient(create)
+
+    async def _replay_stream(self, entry: dict):
+        elapsed = 0.0
+        for at, text in entry["chunks"]:
+            delay = (at - elapsed) * self.latency_scale
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elapsed = at
+            yield _chunk(text)
+        tail = (entry["latency_s"] - elapsed) * self.latency_scale
+        if tail > 0:
+            await asyncio.sleep(tail)
+        yield _chunk(usage=entry.get("usage"))
+
+
+cassette = Cassette() if LLM_CASSETTE_MODE in ("record", "replay") else None
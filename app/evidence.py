@@ -0,0 +1,185 @@
+# app/evidence.py
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from app.metrics import registry
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Verificación de `evidence` / `page` contra el texto extraído:
+#   - Un índice de trigramas de palabras por petición: el hash de cada trigrama
+#     y su posición (página, palabra) en dos arrays NumPy ordenados por hash.
+#   - Localizar una cita = buscar sus trigramas (searchsorted) y votar por
+#     diagonal (posición en el documento − posición en la cita); la diagonal
+#     con más votos, sumando las vecinas (palabras añadidas u omitidas), da
+#     la página, los offsets y una puntuación (trigramas de la cita que casan).
+#  Construir el índice es O(palabras del documento); cada cita cuesta
+#  O(trigramas de la cita + ocurrencias), independiente del nº de páginas.
+# ─────────────────────────────────────────────────────────────────────────────
+
+EVIDENCE_CHECK = os.getenv("EVIDENCE_CHECK", "1") != "0"
+EVIDENCE_MIN_SCORE = float(os.getenv("EVIDENCE_MIN_SCORE", "0.5"))
+# Trigramas más frecuentes que esto (boilerplate, cabeceras) no votan
+EVIDENCE_MAX_POSTINGS = int(os.getenv("EVIDENCE_MAX_POSTINGS", "1000"))
+# Palabras de holgura a cada lado de la diagonal (citas no literales)
+EVIDENCE_SLACK = 3
+
+NGRAM = 3
+_PAGE_SHIFT = 32
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+EVIDENCE_CHECKS = registry.counter("evidence_checks_total", "Verificación de citas de los riesgos.", ("result",))
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall((text or "").lower())
+
+
+def _page_of(diagonal):
+    # Una cita que empieza antes de la primera palabra deja la diagonal
+    # ligeramente por debajo de i << 32: se redondea a la página más cercana
+    return (diagonal + (1 << (_PAGE_SHIFT - 1))) >> _PAGE_SHIFT
+
+
+# Un trigrama se codifica en un int64 con los ids de sus palabras (21 bits cada uno)
+_ID_BITS = 21
+
+
+class EvidenceIndex:
+    """Índice de trigramas de un documento (lista de {"page", "text"})."""
+
+    def __init__(self, pages: List[Dict]):
+        import numpy as np
+
+        self._np = np
+        self.pages = pages
+        self._vocab = {}
+        self._words = [_words(p.get("text")) for p in pages]
+        lengths = np.array([len(w) for w in self._words], dtype=np.int64)
+        ids = np.fromiter(
+            (self._vocab.setdefault(w, len(self._vocab)) for words in self._words for w in words),
+            dtype=np.int64, count=int(lengths.sum()),
+        ) & ((1 << _ID_BITS) - 1)
+        keys = self._gram_keys(ids)
+        # Posición de cada trigrama (página, palabra); fuera los que cruzan de página
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)[:len(keys)]
+        page_idx = np.repeat(np.arange(len(pages), dtype=np.int64), lengths)[:len(keys)]
+        pos = np.arange(len(keys), dtype=np.int64) - starts
+        inside = pos <= lengths[page_idx] - NGRAM
+        keys, locs = keys[inside], (page_idx[inside] << _PAGE_SHIFT) + pos[inside]
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._locs = locs[order]
+
+    def _gram_keys(self, ids):
+        if len(ids) < NGRAM:
+            return ids[:0]
+        return (ids[:-2] << (2 * _ID_BITS)) | (ids[1:-1] << _ID_BITS) | ids[2:]
+
+    def locate(self, quote: str, prefer_page: Optional[int] = None) -> Optional[Dict]:
+        """
+        Mejor aparición aproximada de `quote`: {"page", "score", "start", "end"}
+        con offsets de carácter dentro del texto de esa página, o None si
+        ningún trigrama de la cita aparece (o la cita tiene menos de 3 palabras).
+        """
+        np = self._np
+        words = _words(quote)
+        mask = (1 << _ID_BITS) - 1
+        ids = [self._vocab[w] & mask if w in self._vocab else -1 for w in words]
+        # Trigramas con palabras que no están en el documento no pueden casar
+        hashes = [
+            (a << (2 * _ID_BITS)) | (b << _ID_BITS) | c if min(a, b, c) >= 0 else -1
+            for a, b, c in zip(ids, ids[1:], ids[2:])
+        ]
+        if not hashes or not len(self._keys):
+            return None
+        q = np.array(hashes, dtype=np.int64)
+        lo = np.searchsorted(self._keys, q, side="left")
+        hi = np.searchsorted(self._keys, q, side="right")
+        diagonals = [
+            self._locs[a:b] - j
+            for j, (a, b) in enumerate(zip(lo.tolist(), hi.tolist()))
+            if 0 < b - a <= EVIDENCE_MAX_POSTINGS
+        ]
+        if not diagonals:
+            return None
+        diag, votes = np.unique(np.concatenate(diagonals), return_counts=True)
+        # Votos en la ventana [d - SLACK, d + SLACK] de cada diagonal
+        cum = np.concatenate(([0], np.cumsum(votes)))
+        window = (cum[np.searchsorted(diag, diag + EVIDENCE_SLACK, side="right")]
+                  - cum[np.searchsorted(diag, diag - EVIDENCE_SLACK, side="left")])
+        best = window.max()
+        candidates = diag[window == best]
+        pages_idx = _page_of(candidates)
+        chosen = candidates[0]
+        if prefer_page is not None:
+            preferred = [c for c, i in zip(candidates.tolist(), pages_idx.tolist())
+                         if self.pages[i]["page"] == prefer_page]
+            if preferred:
+                chosen = preferred[0]
+        page_idx = int(_page_of(chosen))
+        start_word = max(0, int(chosen) - (page_idx << _PAGE_SHIFT))
+        end_word = min(len(self._words[page_idx]), start_word + len(words)) - 1
+        start, end = self._char_span(page_idx, start_word, end_word)
+        return {
+            "page": self.pages[page_idx]["page"],
+            "score": round(min(1.0, float(best) / len(hashes)), 3),
+            "start": start,
+            "end": end,
+        }
+
+    def _char_span(self, page_idx: int, start_word: int, end_word: int) -> Tuple[int, int]:
+        start = end = 0
+        for n, m in enumerate(_WORD_RE.finditer((self.pages[page_idx].get("text") or "").lower())):
+            if n == start_word:
+                start = m.start()
+            if n == end_word:
+                end = m.end()
+                break
+        return start, end
+
+    def verify(self, risk: Dict) -> str:
+        """
+        Comprueba la cita de un riesgo: corrige `page` si la cita está en otra
+        página (la declarada queda en `page_reported`) y añade `evidence_match`
+        con score y offsets. Devuelve el resultado (verified, page_corrected,
+        not_found o too_short).
+        """
+        quote = str(risk.get("evidence") or "")
+        if len(_words(quote)) < NGRAM:
+            outcome = "too_short"
+        else:
+            try:
+                reported = int(risk.get("page"))
+            except (TypeError, ValueError):
+                reported = None
+            match = self.locate(quote, prefer_page=reported)
+            if match is None or match["score"] < EVIDENCE_MIN_SCORE:
+                risk["evidence_match"] = {"score": match["score"] if match else 0.0}
+                outcome = "not_found"
+            else:
+                risk["evidence_match"] = {k: match[k] for k in ("score", "start", "end")}
+                if match["page"] != reported:
+                    risk["page_reported"] = risk.get("page")
+                    risk["page"] = match["page"]
+                    outcome = "page_corrected"
+                else:
+                    outcome = "verified"
+        return outcome
+
+
+def verify_risk(index: EvidenceIndex, risk: Dict, summary: Dict[str, int]) -> str:
+    """Verifica un riesgo in situ y suma su resultado a `summary` (streaming: de uno en uno)."""
+    outcome = index.verify(risk)
+    summary[outcome] = summary.get(outcome, 0) + 1
+    EVIDENCE_CHECKS.inc(result=outcome)
+    return outcome
+
+
+def verify_risks(index: EvidenceIndex, data: Dict, lists: Tuple[str, ...]) -> Dict[str, int]:
+    """Verifica todos los riesgos de `data` in situ; devuelve el recuento por resultado."""
+    summary = {}
+    for list_name in lists:
+        for risk in data.get(list_name, []):
+            verify_risk(index, risk, summary)
+    return summary
@@ -0,0 +1,285 @@
+# app/fingerprints.py
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from itertools import zip_longest
+from typing import Dict, List, Optional, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Huellas por página para re-analizar solo lo que cambia entre revisiones:
+#   - Cada página extraída lleva un digest exacto (texto normalizado) y un
+#     SimHash de 64 bits sobre shingles de 3 palabras: dos páginas con unas
+#     pocas palabras distintas quedan a poca distancia de Hamming.
+#   - Un índice SQLite guarda, por variante de análisis (context, idioma,
+#     modelo, prompt, modo...), las huellas de cada documento analizado y sus
+#     riesgos. Una subida nueva se compara con la versión previa más parecida
+#     (emparejando páginas por contenido, no por número: insertar una página
+#     no invalida las siguientes).
+#  SimHash y distancias de Hamming vectorizados con NumPy (importado al primer uso).
+# ─────────────────────────────────────────────────────────────────────────────
+
+INCREMENTAL_ENABLED = os.getenv("INCREMENTAL_ENABLED", "1") != "0"
+FINGERPRINT_DB_PATH = os.getenv("FINGERPRINT_DB", os.path.join(".data", "fingerprints.sqlite3"))
+# Bits distintos (de 64) para considerar una página "sin cambios"
+FINGERPRINT_MAX_DISTANCE = int(os.getenv("FINGERPRINT_MAX_DISTANCE", "3"))
+# Fracción mínima de páginas compartidas para tratar un documento como versión previa
+FINGERPRINT_MIN_OVERLAP = float(os.getenv("FINGERPRINT_MIN_OVERLAP", "0.5"))
+FINGERPRINT_MAX_CANDIDATES = int(os.getenv("FINGERPRINT_MAX_CANDIDATES", "200"))
+FINGERPRINT_MAX_DOCS = int(os.getenv("FINGERPRINT_MAX_DOCS", "5000"))
+
+SHINGLE_WORDS = 3
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize(text: str) -> List[str]:
+    return _WORD_RE.findall((text or "").lower())
+
+
+def simhash(words: List[str]) -> int:
+    """SimHash de 64 bits (entero sin signo) sobre shingles de SHINGLE_WORDS palabras."""
+    import numpy as np
+
+    if len(words) < SHINGLE_WORDS:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    if not shingles:
+        return 0
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    # Voto por bit: más unos que ceros → 1
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+
+def page_fingerprint(text: str) -> Tuple[int, str]:
+    words = _normalize(text)
+    return simhash(words), hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+
+
+def fingerprint_pages(pages: List[Dict]) -> List[Dict]:
+    """[{"page", "simhash", "digest"}] en el orden de las páginas."""
+    out = []
+    for p in pages:
+        sh, digest = page_fingerprint(p.get("text") or "")
+        out.append({"page": p["page"], "simhash": sh, "digest": digest})
+    return out
+
+
+def _to_signed(value: int) -> int:
+    # SQLite guarda INTEGER de 64 bits con signo
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+# Bits a uno de cada byte: popcount vectorizado sin depender de numpy>=2 (bitwise_count)
+_POPCOUNT = None
+# Filas por bloque de la matriz de distancias (filas × columnas × 8 bytes)
+_MATCH_BLOCK_ROWS = 256
+
+
+def _hamming(new_hashes, old_hashes):
+    """Matriz de distancias de Hamming entre dos vectores uint64."""
+    import numpy as np
+
+    global _POPCOUNT
+    if _POPCOUNT is None:
+        _POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+    xor = np.bitwise_xor(new_hashes[:, None], old_hashes[None, :])
+    return _POPCOUNT[xor.view(np.uint8)].reshape(*xor.shape, 8).sum(axis=2, dtype=np.int16)
+
+
+def match_pages(new: List[Dict], old: List[Dict], max_distance: int = FINGERPRINT_MAX_DISTANCE) -> Dict[int, Tuple[int, bool]]:
+    """
+    Empareja páginas nuevas con páginas previas por contenido.
+    Devuelve {página_nueva: (página_previa, idéntica)}; cada página previa se
+    usa una sola vez y se prefiere la coincidencia exacta a la aproximada.
+    Las aproximadas se asignan en orden de página nueva, a la previa libre
+    más cercana (la primera en caso de empate).
+    """
+    import numpy as np
+
+    by_digest = {}
+    for fp in old:
+        by_digest.setdefault(fp["digest"], []).append(fp["page"])
+    used, matches = set(), {}
+    for fp in new:
+        for page in by_digest.get(fp["digest"], []):
+            if page not in used:
+                used.add(page)
+                matches[fp["page"]] = (page, True)
+                break
+    rows = [fp for fp in new if fp["page"] not in matches and fp["simhash"]]
+    cols = [o for o in old if o["page"] not in used and o["simhash"]]
+    if not rows or not cols:
+        return matches
+    old_hashes = np.array([o["simhash"] for o in cols], dtype=np.uint64)
+    free = np.ones(len(cols), dtype=bool)
+    for start in range(0, len(rows), _MATCH_BLOCK_ROWS):
+        block = rows[start:start + _MATCH_BLOCK_ROWS]
+        distances = _hamming(np.array([fp["simhash"] for fp in block], dtype=np.uint64), old_hashes)
+        # Solo las filas con algún candidato bajo el umbral pasan al reparto secuencial
+        for i in np.flatnonzero(distances.min(axis=1) <= max_distance):
+            row = np.where(free, distances[i], max_distance + 1)
+            j = int(row.argmin())
+            if row[j] <= max_distance:
+                free[j] = False
+                matches[block[i]["page"]] = (cols[j]["page"], False)
+    return matches
+
+
+class FingerprintIndex:
+    """Índice local (SQLite) de documentos analizados. Una conexión por operación, como SQLiteStore."""
+
+    def __init__(self, path: str = FINGERPRINT_DB_PATH, max_docs: int = FINGERPRINT_MAX_DOCS):
+        self.path = path
+        self.max_docs = max_docs
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS documents ("
+                            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                            " variant TEXT NOT NULL,"
+                            " file_sha256 TEXT NOT NULL,"
+                            " filename TEXT,"
+                            " risks TEXT NOT NULL,"
+                            " stored_at REAL NOT NULL,"
+                            " UNIQUE (variant, file_sha256))"
+                        )
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS pages ("
+                            " doc_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,"
+                            " page INTEGER NOT NULL,"
+                            " simhash INTEGER NOT NULL,"
+                            " digest TEXT NOT NULL)"
+                        )
+                        conn.execute("CREATE INDEX IF NOT EXISTS pages_doc ON pages (doc_id)")
+                        conn.execute("CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest)")
+                        conn.execute("CREATE INDEX IF NOT EXISTS documents_variant ON documents (variant, stored_at)")
+                    self._ready = True
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def closest(self, variant: str, file_sha256: str, fingerprints: List[Dict],
+                min_overlap: float = FINGERPRINT_MIN_OVERLAP) -> Optional[Dict]:
+        """
+        Versión previa más parecida de la misma variante (excluido el propio
+        archivo). Candidatos: los FINGERPRINT_MAX_CANDIDATES documentos que
+        comparten más páginas exactas; uno sin ninguna en común no se compara.
+        Bloquea (SQLite + NumPy): desde async, llamar con asyncio.to_thread.
+        """
+        if not fingerprints:
+            return None
+        digests = list({fp["digest"] for fp in fingerprints})
+        with self._connect() as conn:
+            shared = {}
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                for doc_id, count in conn.execute(
+                    "SELECT d.id, COUNT(DISTINCT p.digest) FROM pages p JOIN documents d ON d.id = p.doc_id"
+                    f" WHERE d.variant = ? AND d.file_sha256 != ? AND p.digest IN ({','.join('?' * len(chunk))})"
+                    " GROUP BY d.id",
+                    (variant, file_sha256, *chunk),
+                ):
+                    shared[doc_id] = shared.get(doc_id, 0) + count
+            ids = sorted(shared, key=shared.get, reverse=True)[:FINGERPRINT_MAX_CANDIDATES]
+            best = None
+            for doc_id in ids:
+                old = [
+                    {"page": page, "simhash": sh & ((1 << 64) - 1), "digest": digest}
+                    for page, sh, digest in conn.execute(
+                        "SELECT page, simhash, digest FROM pages WHERE doc_id = ?", (doc_id,))
+                ]
+                matches = match_pages(fingerprints, old)
+                overlap = len(matches) / len(fingerprints)
+                if overlap >= min_overlap and (best is None or overlap > best["overlap"]):
+                    best = {"doc_id": doc_id, "overlap": overlap, "matches": matches}
+            if best is None:
+                return None
+            file_sha, filename, risks = conn.execute(
+                "SELECT file_sha256, filename, risks FROM documents WHERE id = ?", (best["doc_id"],)
+            ).fetchone()
+        best.update(file_sha256=file_sha, filename=filename, risks=json.loads(risks))
+        return best
+
+    def add(self, variant: str, file_sha256: str, filename: str, fingerprints: List[Dict], risks: Dict) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE variant = ? AND file_sha256 = ?", (variant, file_sha256))
+            cur = conn.execute(
+                "INSERT INTO documents (variant, file_sha256, filename, risks, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (variant, file_sha256, filename, json.dumps(risks, ensure_ascii=False), time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO pages (doc_id, page, simhash, digest) VALUES (?, ?, ?, ?)",
+                [(cur.lastrowid, fp["page"], _to_signed(fp["simhash"]), fp["digest"]) for fp in fingerprints],
+            )
+            # Retención: solo los max_docs documentos más recientes
+            conn.execute(
+                "DELETE FROM documents WHERE id NOT IN (SELECT id FROM documents ORDER BY stored_at DESC LIMIT ?)",
+                (self.max_docs,),
+            )
+
+
+fingerprint_index = FingerprintIndex()
+
+
+def _squash(text: str) -> str:
+    return " ".join(_normalize(text))
+
+
+def plan_reuse(base: Dict, pages: List[Dict], lists: Tuple[str, ...]) -> Tuple[Dict[str, List[Dict]], List[Dict]]:
+    """
+    A partir de la versión previa (FingerprintIndex.closest) devuelve
+    (riesgos reutilizables por lista, páginas nuevas o cambiadas).
+    Un riesgo previo se reutiliza si su página sigue en el documento idéntica,
+    o casi idéntica y con la cita de `evidence` todavía presente; su número de
+    página se traslada al de la versión nueva. Las páginas casi idénticas
+    también se vuelven a analizar: una edición pequeña puede traer un riesgo.
+    """
+    old_to_new = {old: (new, exact) for new, (old, exact) in base["matches"].items()}
+    text_by_page = {p["page"]: p.get("text") or "" for p in pages}
+    reused = {}
+    for list_name in lists:
+        reused[list_name] = []
+        for risk in base["risks"].get(list_name, []):
+            try:
+                new_page, exact = old_to_new[int(risk.get("page"))]
+            except (KeyError, TypeError, ValueError):
+                continue
+            evidence = _squash(str(risk.get("evidence") or ""))
+            if exact or (evidence and evidence in _squash(text_by_page.get(new_page, ""))):
+                reused[list_name].append({**risk, "page": new_page, "origin": "reused"})
+    changed = [p for p in pages if not base["matches"].get(p["page"], (None, False))[1]]
+    return reused, changed
+
+
+def incremental_candidates(reused: Dict[str, List[Dict]], fresh: Optional[Dict],
+                           lists: Tuple[str, ...]) -> Dict[str, List[Dict]]:
+    """
+    Candidatos por lista para el ranking: reutilizados y nuevos (origin="new")
+    intercalados, sin títulos repetidos. Si el ranking falla, este orden
+    decide: ni los previos tapan siempre a los nuevos ni al revés.
+    """
+    candidates = {}
+    for list_name in lists:
+        new = [{**r, "origin": "new"} for r in (fresh or {}).get(list_name, [])]
+        items, seen = [], set()
+        for risk in (r for pair in zip_longest(reused.get(list_name, []), new) for r in pair if r is not None):
+            title = str(risk.get("risk", "")).strip().lower()
+            if title not in seen:
+                items.append(risk)
+                seen.add(title)
+        candidates[list_name] = items
+    return candidates
@@ -0,0 +1,426 @@
+# app/jobs.py
+import os
+import json
+import time
+import uuid
+import random
+import shutil
+import asyncio
+import sqlite3
+import logging
+import threading
+import traceback
+from typing import Optional
+
+from app.pipeline import run_analysis, AnalysisError
+from app.admission import admission, fair_queue, Ticket
+from app.metrics import begin_request, record_error
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Cola de jobs persistente para análisis largos:
+#   - Estado en SQLite (sobrevive a reinicios); el archivo subido se guarda
+#     en JOBS_DIR hasta que el job termina.
+#   - Workers async dentro del proceso de la API (JOB_WORKERS) o en un proceso
+#     aparte con `python -m app.jobs` (JOB_PROCESS_WORKERS; JOB_WORKERS=0 en la API).
+#   - Reintentos con backoff exponencial + jitter; los errores de entrada
+#     (AnalysisError) fallan directamente sin reintentar.
+#   - Un job encolado con control de admisión trae su ticket en params: espera
+#     turno en la cola justa y se liquida al terminar (o se devuelve si falla).
+#   - Cada job 'running' tiene un lease (lease_until) que su worker renueva
+#     con un heartbeat. Solo los leases vencidos (proceso caído o colgado)
+#     vuelven a la cola: varios procesos pueden compartir la base sin robarse
+#     jobs. `attempts` hace de token: un worker que perdió el lease ya no
+#     puede escribir el resultado.
+#   - Los jobs terminados (done/failed) se borran pasado JOB_RETENTION_S.
+# ─────────────────────────────────────────────────────────────────────────────
+
+logger = logging.getLogger("uvicorn.error")
+
+JOBS_DB_PATH = os.getenv("JOBS_DB", os.path.join(".data", "jobs.sqlite3"))
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(".data", "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_BACKOFF_S = float(os.getenv("JOB_BACKOFF_S", "5"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "0.5"))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "60"))
+JOB_HEARTBEAT_S = float(os.getenv("JOB_HEARTBEAT_S", str(JOB_LEASE_S / 3)))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(7 * 24 * 3600)))
+JOB_MAINTENANCE_S = float(os.getenv("JOB_MAINTENANCE_S", "30"))
+
+_COLUMNS = (
+    "id", "status", "stage", "progress", "params", "file_path", "result",
+    "error", "attempts", "max_attempts", "next_run_at", "created_at", "updated_at",
+    "lease_until",
+)
+
+
+class JobStore:
+    """Acceso a la tabla de jobs. Una conexión por operación (thread-safe)."""
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, files_dir: str = JOBS_DIR):
+        self.db_path = db_path
+        self.files_dir = files_dir
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                    os.makedirs(self.files_dir, exist_ok=True)
+                    with sqlite3.connect(self.db_path) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS jobs ("
+                            " id TEXT PRIMARY KEY,"
+                            " status TEXT NOT NULL,"          # queued | running | done | failed
+                            " stage TEXT,"
+                            " progress TEXT NOT NULL DEFAULT '{}',"
+                            " params TEXT NOT NULL,"
+                            " file_path TEXT,"
+                            " result TEXT,"
+                            " error TEXT,"
+                            " attempts INTEGER NOT NULL DEFAULT 0,"
+                            " max_attempts INTEGER NOT NULL,"
+                            " next_run_at REAL NOT NULL,"
+                            " created_at REAL NOT NULL,"
+                            " updated_at REAL NOT NULL,"
+                            " lease_until REAL)"               # solo mientras está running
+                        )
+                        # Bases creadas antes de los leases
+                        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                        if "lease_until" not in columns:
+                            conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+                        conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, next_run_at)")
+                    self._ready = True
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    @staticmethod
+    def _row_to_job(row) -> dict:
+        job = dict(zip(_COLUMNS, row))
+        job["progress"] = json.loads(job["progress"] or "{}")
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["error"] = json.loads(job["error"]) if job["error"] else None
+        return job
+
+    def create(self, upload_path: str, params: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        """Mueve el archivo subido (ya en disco) al directorio de jobs y encola."""
+        self._connect().close()  # garantiza que existen tabla y directorio
+        job_id = uuid.uuid4().hex
+        file_path = os.path.join(self.files_dir, f"{job_id}.bin")
+        shutil.move(upload_path, file_path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, stage, params, file_path, max_attempts,"
+                " next_run_at, created_at, updated_at) VALUES (?, 'queued', 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), file_path, max_attempts, now, now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def claim_next(self, lease_s: float = JOB_LEASE_S) -> Optional[dict]:
+        """Marca como running el siguiente job listo (atómico entre workers y procesos)."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ?"
+                " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND next_run_at <= ?"
+                "             ORDER BY next_run_at LIMIT 1)"
+                f" RETURNING {', '.join(_COLUMNS)}",
+                (now + lease_s, now, now),
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def heartbeat(self, job_id: str, attempt: int, lease_s: float = JOB_LEASE_S) -> bool:
+        """Renueva el lease. False si el job ya no es de este intento (lease perdido)."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (time.time() + lease_s, job_id, attempt),
+            )
+            return cur.rowcount == 1
+
+    def set_progress(self, job_id: str, stage: str, progress: dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+                (stage, json.dumps(progress, ensure_ascii=False), time.time(), job_id),
+            )
+
+    # complete/fail/release solo escriben si el job sigue siendo de este intento:
+    # devuelven False cuando otro worker lo reclamó tras vencer el lease.
+
+    def complete(self, job_id: str, attempt: int, result: dict) -> bool:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'done', stage = 'done', result = ?, error = NULL,"
+                " file_path = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND status = 'running' AND attempts = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, attempt),
+            )
+        if cur.rowcount == 1:
+            self._remove_file(job_id)
+        return cur.rowcount == 1
+
+    def fail(self, job_id: str, attempt: int, error: dict, retry_at: Optional[float] = None) -> bool:
+        """Sin retry_at el fallo es definitivo; con retry_at vuelve a la cola."""
+        with self._connect() as conn:
+            if retry_at is None:
+                cur = conn.execute(
+                    "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?,"
+                    " file_path = NULL, lease_until = NULL, updated_at = ?"
+                    " WHERE id = ? AND status = 'running' AND attempts = ?",
+                    (json.dumps(error, ensure_ascii=False), time.time(), job_id, attempt),
+                )
+            else:
+                cur = conn.execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'retry_wait', error = ?,"
+                    " next_run_at = ?, lease_until = NULL, updated_at = ?"
+                    " WHERE id = ? AND status = 'running' AND attempts = ?",
+                    (json.dumps(error, ensure_ascii=False), retry_at, time.time(), job_id, attempt),
+                )
+        if retry_at is None and cur.rowcount == 1:
+            self._remove_file(job_id)
+        return cur.rowcount == 1
+
+    def release(self, job_id: str, attempt: int) -> bool:
+        """Parada ordenada: el job vuelve a la cola sin gastar el intento."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', attempts = attempts - 1,"
+                " next_run_at = ?, lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND status = 'running' AND attempts = ?",
+                (time.time(), time.time(), job_id, attempt),
+            )
+            return cur.rowcount == 1
+
+    def requeue_expired(self) -> tuple:
+        """
+        Jobs 'running' con el lease vencido (su proceso cayó o se colgó): vuelven
+        a la cola, o fallan si ya agotaron los intentos. Devuelve
+        (n_reencolados, jobs_fallidos) para que el llamador devuelva sus tickets.
+        Los leases vigentes de otros procesos no se tocan.
+        """
+        now = time.time()
+        error = json.dumps({"error_code": "lease_expired",
+                            "message": "El worker dejó de renovar el lease del job."})
+        with self._connect() as conn:
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?,"
+                " file_path = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)"
+                " AND attempts >= max_attempts"
+                f" RETURNING {', '.join(_COLUMNS)}",
+                (error, now, now),
+            ).fetchall()
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', next_run_at = ?,"
+                " lease_until = NULL, updated_at = ?"
+                " WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (now, now, now),
+            )
+        failed = [self._row_to_job(row) for row in failed]
+        for job in failed:
+            self._remove_file(job["id"])
+        return cur.rowcount, failed
+
+    def purge_finished(self, retention_s: float = JOB_RETENTION_S) -> int:
+        """Borra los jobs done/failed sin cambios desde hace más de retention_s."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ? RETURNING id",
+                (time.time() - retention_s,),
+            ).fetchall()
+        for (job_id,) in rows:
+            self._remove_file(job_id)
+        return len(rows)
+
+    def _remove_file(self, job_id: str) -> None:
+        try:
+            os.remove(os.path.join(self.files_dir, f"{job_id}.bin"))
+        except FileNotFoundError:
+            pass
+
+
+def backoff_delay(attempt: int, base_s: float = JOB_BACKOFF_S) -> float:
+    """Backoff exponencial con jitter completo: U(0, base · 2^(attempt-1))."""
+    return random.uniform(0, base_s * (2 ** max(0, attempt - 1)))
+
+
+def public_view(job: dict) -> dict:
+    """Lo que devuelve GET /jobs/{id}: sin rutas internas ni parámetros crudos."""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
+async def _heartbeat(store: JobStore, job: dict, lost: asyncio.Event, task: asyncio.Task) -> None:
+    """Renueva el lease mientras el job corre; si lo pierde, cancela el intento."""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_S)
+        if not await asyncio.to_thread(store.heartbeat, job["id"], job["attempts"]):
+            lost.set()
+            task.cancel()
+            return
+
+
+async def process_job(store: JobStore, job: dict) -> None:
+    job_id, attempt = job["id"], job["attempts"]
+    progress = dict(job["progress"])
+    begin_request()  # desglose de tiempos propio de este intento
+
+    # El progreso se escribe en un thread sin parar el análisis: un único
+    # escritor por job guarda la última instantánea pendiente (las intermedias
+    # se descartan si el disco va más lento que las etapas)
+    pending, writer = [], None
+
+    async def write_progress():
+        while pending:
+            stage, snapshot = pending.pop()
+            pending.clear()
+            await asyncio.to_thread(store.set_progress, job_id, stage, snapshot)
+
+    def report(stage: str, **info):
+        nonlocal writer
+        progress[stage] = {"at": round(time.time(), 3), **info}
+        pending.append((stage, dict(progress)))
+        if writer is None or writer.done():
+            writer = asyncio.create_task(write_progress())
+
+    async def progress_written():
+        # Antes de cerrar el job: una escritura de progreso tardía no debe pisar su estado final
+        if writer is not None:
+            await asyncio.gather(writer, return_exceptions=True)
+
+    params = dict(job["params"])
+    ticket = Ticket(**params.pop("admission")) if "admission" in params else None
+    lost = asyncio.Event()
+    current = asyncio.current_task()
+    heartbeat = asyncio.create_task(_heartbeat(store, job, lost, current))
+    try:
+        async with fair_queue.slot(ticket, bounded=False):
+            result = await run_analysis(job["file_path"], progress=report, **params)
+        heartbeat.cancel()
+        await progress_written()
+        if await asyncio.to_thread(store.complete, job_id, attempt, result):
+            admission.settle(ticket, result["_debug"])
+            logger.info(f"[jobs] {job_id} done (attempt {attempt})")
+    except asyncio.CancelledError:
+        if not lost.is_set():
+            # Parada del pool: el job vuelve a la cola para otro proceso
+            await progress_written()
+            await asyncio.to_thread(store.release, job_id, attempt)
+            raise
+        current.uncancel()
+        logger.warning(f"[jobs] {job_id} attempt {attempt} lost its lease; abandoned")
+    except AnalysisError as e:
+        record_error(e.error_code)
+        await progress_written()
+        if await asyncio.to_thread(store.fail, job_id, attempt, e.to_dict()):
+            admission.refund(ticket)
+    except Exception as e:
+        # LLMTransportError y ParserBusy traen su propio código (llm_unavailable,
+        # parser_busy, ...) y retry_after, que acota el siguiente intento
+        error_code = getattr(e, "error_code", "internal_error")
+        record_error(error_code)
+        logger.error(f"[jobs] {job_id} attempt {attempt} failed: {e}")
+        logger.error(traceback.format_exc())
+        error = {"error_code": error_code, "message": str(e)}
+        await progress_written()
+        if attempt < job["max_attempts"]:
+            delay = max(backoff_delay(attempt), getattr(e, "retry_after", None) or 0)
+            await asyncio.to_thread(store.fail, job_id, attempt, error, time.time() + delay)
+        elif await asyncio.to_thread(store.fail, job_id, attempt, error):
+            admission.refund(ticket)
+    finally:
+        heartbeat.cancel()
+
+
+async def worker_loop(store: JobStore, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        job = await asyncio.to_thread(store.claim_next)
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), JOB_POLL_S)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await process_job(store, job)
+
+
+def maintain(store: JobStore) -> None:
+    """Reencola leases vencidos y purga jobs viejos. Seguro en varios procesos a la vez."""
+    requeued, failed = store.requeue_expired()
+    if requeued:
+        logger.info(f"[jobs] requeued {requeued} job(s) with an expired lease")
+    for job in failed:
+        logger.warning(f"[jobs] {job['id']} failed: lease expired on its last attempt")
+        if "admission" in job["params"]:
+            admission.refund(Ticket(**job["params"]["admission"]))
+    purged = store.purge_finished()
+    if purged:
+        logger.info(f"[jobs] purged {purged} finished job(s) older than {JOB_RETENTION_S:.0f}s")
+
+
+async def maintenance_loop(store: JobStore, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            await asyncio.to_thread(maintain, store)
+        except Exception as e:
+            logger.error(f"[jobs] maintenance failed: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), JOB_MAINTENANCE_S)
+        except asyncio.TimeoutError:
+            pass
+
+
+class JobWorkerPool:
+    """Arranca/para N workers async en el event loop actual."""
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._stop = asyncio.Event()
+        self._tasks = []
+
+    def start(self) -> None:
+        if self.workers <= 0:
+            return
+        self._tasks = [asyncio.create_task(maintenance_loop(self.store, self._stop))]
+        self._tasks += [asyncio.create_task(worker_loop(self.store, self._stop)) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        self._stop.set()
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+job_store = JobStore()
+
+
+if __name__ == "__main__":
+    # Worker en proceso separado: python -m app.jobs
+    async def _main():
+        pool = JobWorkerPool(job_store, workers=int(os.getenv("JOB_PROCESS_WORKERS", "2")))
+        pool.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(_main())
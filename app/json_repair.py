@@ -0,0 +1,169 @@
+# app/json_repair.py
+import re
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.metrics import registry
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Reparación local de la salida JSON del modelo antes de darla por mala:
+#   - bloques ```json ... ``` y texto antes/después del objeto
+#   - comas colgantes (", }" / ", ]")
+#   - respuestas truncadas (max_tokens): se cierra lo abierto y, si hace falta,
+#     se descarta el último elemento a medias
+#  y validación por elemento de las listas de riesgos: los que están bien se
+#  quedan; los que faltan o están incompletos se piden aparte (re-ask) en
+#  lugar de repetir el análisis entero.
+# ─────────────────────────────────────────────────────────────────────────────
+
+REPAIRS = registry.counter("json_repairs_total", "Reparaciones locales aplicadas a la salida del LLM.", ("kind",))
+INVALID_ITEMS = registry.counter("invalid_risk_items_total", "Riesgos descartados por incompletos o inválidos.", ("list",))
+REASKS = registry.counter("reasks_total", "Peticiones de seguimiento para completar riesgos.", ("outcome",))
+
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?|\n?\s*```\s*$")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _scan(text: str) -> Tuple[str, list, bool, list, List[str]]:
+    """
+    Recorre el JSON respetando strings. Devuelve (texto sin comas colgantes ni
+    basura final, pila abierta, string abierta, puntos de corte seguros,
+    reparaciones). Un punto seguro es justo tras cerrar un objeto/lista
+    interno: ahí se puede cortar y cerrar lo que quede abierto.
+    """
+    out, stack, safe, repairs = [], [], [], []
+    in_string = escape = False
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif c in "{[":
+            stack.append(c)
+            out.append(c)
+        elif c in "}]":
+            if stack and _CLOSERS[stack[-1]] == c:
+                stack.pop()
+                out.append(c)
+                if not stack:
+                    # fin del objeto raíz: lo que siga es texto sobrante
+                    if text[i + 1:].strip():
+                        repairs.append("trailing_text")
+                    break
+                safe.append((len(out), list(stack)))
+        elif c == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j < n and text[j] in "}]":
+                if "trailing_comma" not in repairs:
+                    repairs.append("trailing_comma")
+            else:
+                out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out), stack, in_string, safe, repairs
+
+
+def repair_json(content: str) -> Tuple[Any, List[str]]:
+    """Devuelve (objeto, reparaciones aplicadas). Lanza ValueError si no hay arreglo posible."""
+    try:
+        return json.loads(content), []
+    except (TypeError, ValueError):
+        pass
+
+    repairs = []
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = _FENCE_RE.sub("", text)
+        repairs.append("code_fence")
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("La respuesta no contiene ningún objeto JSON")
+    if start > 0:
+        text = text[start:]
+        repairs.append("leading_text")
+
+    fixed, stack, in_string, safe, scan_repairs = _scan(text)
+    repairs += scan_repairs
+
+    candidates = [fixed]
+    if stack:
+        repairs.append("truncated")
+        candidates = []
+        # Primero se corta tras el último elemento completo (el que quedó a
+        # medias se pedirá en el re-ask); si no hay, se cierra lo abierto.
+        if safe:
+            pos, open_stack = safe[-1]
+            candidates.append(fixed[:pos] + "".join(_CLOSERS[c] for c in reversed(open_stack)))
+        candidates.append(fixed + ('"' if in_string else "") + "".join(_CLOSERS[c] for c in reversed(stack)))
+
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        for kind in repairs:
+            REPAIRS.inc(kind=kind)
+        return data, repairs
+    raise ValueError("No se pudo reparar el JSON")
+
+
+def _coerce_page(value):
+    """'S. 12' / '12' → 12. Devuelve (valor, se_corrigió)."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value, False
+    match = re.search(r"\d+", str(value or ""))
+    if match:
+        return int(match.group()), True
+    return value, False
+
+
+def valid_risk(item: Any, required_keys: List[str]) -> Optional[Dict]:
+    """El riesgo (con page corregida si hacía falta) o None si está incompleto."""
+    if not (isinstance(item, dict) and all(k in item for k in required_keys) and str(item.get("risk") or "").strip()):
+        return None
+    if "page" in item:
+        page, coerced = _coerce_page(item["page"])
+        if coerced:
+            item = {**item, "page": page}  # copia: validate_risks la cuenta como reparación
+    return item
+
+
+def validate_risks(data: Any, lists: Tuple[str, ...], required_keys: List[str],
+                   expected: int = 5) -> Tuple[Dict, Dict]:
+    """
+    Separa los riesgos válidos de los que faltan o están incompletos.
+    Devuelve (datos solo con elementos válidos, problemas) donde problemas es
+    {lista: {"missing": n, "invalid": [elementos]}} solo para listas cortas.
+    """
+    data = dict(data) if isinstance(data, dict) else {}
+    problems = {}
+    for list_name in lists:
+        items = data.get(list_name)
+        items = items if isinstance(items, list) else []
+        valid, invalid = [], []
+        for item in items:
+            checked = valid_risk(item, required_keys)
+            if checked is not None:
+                if checked is not item:
+                    REPAIRS.inc(kind="page_coerced")
+                valid.append(checked)
+            else:
+                invalid.append(item)
+                INVALID_ITEMS.inc(list=list_name)
+        data[list_name] = valid
+        missing = max(0, expected - len(valid))
+        if missing:
+            problems[list_name] = {"missing": missing, "invalid": invalid}
+    return data, problems
@@ -0,0 +1,81 @@
+# app/json_stream.py
+import json
+from typing import List, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Parser incremental para la respuesta en streaming del modelo:
+#    {"intuitive_risks": [ {...}, {...} ], "counterintuitive_risks": [ ... ]}
+#  Se alimenta con los fragmentos de texto según llegan y devuelve cada objeto
+#  de riesgo en cuanto se cierra su llave, sin esperar al JSON completo.
+# ─────────────────────────────────────────────────────────────────────────────
+
+RISK_LISTS = ("intuitive_risks", "counterintuitive_risks")
+
+
+class RiskStreamParser:
+    """
+    Escáner de un solo paso: lleva la profundidad de anidamiento y el estado
+    de strings/escapes, y recuerda la última clave vista en el nivel raíz.
+    Un objeto que abre a profundidad 3 (objeto raíz = 1, lista = 2) dentro de
+    una de RISK_LISTS es un riesgo. Se devuelve tal cual: validarlo y acotar
+    cuántos se emiten es cosa de quien consume (risk_engine.astream_risks).
+    """
+
+    def __init__(self):
+        self.buffer = []          # texto completo recibido (para el parseo final)
+        self._pos = 0             # offset absoluto del siguiente carácter
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars = []
+        self._last_string = None
+        self._root_key = None
+        self._item_start = None
+        self._item_chars = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self.buffer)
+
+    def feed(self, chunk: str) -> List[Tuple[str, dict]]:
+        """Procesa un fragmento y devuelve los riesgos completados: [(lista, objeto)]."""
+        done = []
+        self.buffer.append(chunk)
+        for ch in chunk:
+            if self._item_start is not None:
+                self._item_chars.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = "".join(self._string_chars)
+                elif self._depth == 1:
+                    self._string_chars.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                self._string_chars = []
+            elif ch == ":" and self._depth == 1:
+                self._root_key = self._last_string
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "{" and self._depth == 3 and self._root_key in RISK_LISTS:
+                    self._item_start = self._pos
+                    self._item_chars = ["{"]
+            elif ch in "}]":
+                if ch == "}" and self._depth == 3 and self._item_start is not None:
+                    try:
+                        obj = json.loads("".join(self._item_chars))
+                        if isinstance(obj, dict):
+                            done.append((self._root_key, obj))
+                    except ValueError:
+                        pass  # objeto mal formado: lo resolverá el parseo final
+                    self._item_start = None
+                    self._item_chars = []
+                self._depth -= 1
+            self._pos += 1
+        return done
@@ -1,18 +1,189 @@
 # app/main.py
+import json
+import math
+import time
 import logging
 import traceback
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from typing import Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 
-from app.parsers import (
-    extract_text_from_pdf,
-    extract_text_from_docx,
-    extract_text_from_txt,
+from app.risk_engine import astream_risks, RISK_LISTS
+from app.cache import result_cache
+from app.uploads import receive_form, InvalidForm, UploadTooLarge, content_length_exceeds, MAX_UPLOAD_BYTES
+from app.pipeline import (
+    AnalysisError,
+    run_analysis,
+    normalize_mode,
+    normalize_lang,
+    normalize_pdf_engine,
+    check_format,
+    aread_document,
+    prompt_pages,
+    cached_result,
+    analysis_keys,
+    translate_cached,
+    translate_analysis,
+    PASSAGE_SELECTION,
+)
+from app.jobs import job_store, JobWorkerPool, public_view
+from app.transport import LLMTransportError
+from app.parse_pool import ParserBusy, parse_pool
+from app.risk_library import risk_library, library_record, RISK_LIBRARY_ENABLED, SEARCH_MAX_LIMIT
+from app.portfolio import portfolio, PORTFOLIO_ENABLED, KINDS
+from app.admission import admission, fair_queue, client_id, request_cost, RateLimited, ADMISSION_ENABLED
+from app.evidence import EvidenceIndex, verify_risk, EVIDENCE_CHECK
+from app.cassette import cassette
+from app.metrics import (
+    begin_request,
+    current_request,
+    stage,
+    record_error,
+    render_metrics,
+    REQUESTS,
+    REQUEST_SECONDS,
+    UPLOAD_BYTES,
 )
-from app.risk_engine import generate_risks
 
 logger = logging.getLogger("uvicorn.error")
-app = FastAPI(debug=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers de jobs en segundo plano dentro del proceso (JOB_WORKERS=0 los desactiva)
+    pool = JobWorkerPool(job_store)
+    pool.start()
+    yield
+    await pool.stop()
+    parse_pool.shutdown()
+    # Lo que quede en cola de la biblioteca de riesgos se escribe antes de salir
+    risk_library.flush()
+    if cassette is not None:
+        cassette.close()
+
+
+app = FastAPI(debug=True, lifespan=lifespan)
+
+
+def _error_response(e: AnalysisError) -> JSONResponse:
+    record_error(e.error_code)
+    return JSONResponse(content=e.to_dict(), status_code=e.status_code)
+
+
+def _unavailable_response(e) -> JSONResponse:
+    """
+    503 cuando el LLM no está disponible tras reintentos (o con el circuito
+    abierto) o cuando la cola de extracción está llena (ParserBusy).
+    """
+    record_error(e.error_code)
+    headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+    return JSONResponse(content=e.to_dict(), status_code=503, headers=headers)
+
+
+def _rate_limited_response(e: RateLimited) -> JSONResponse:
+    record_error(e.error_code)
+    return JSONResponse(content=e.to_dict(), status_code=429, headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+async def _receive(request: Request):
+    """
+    Formulario de /analyze y /analyze/stream: (campos, archivo en disco).
+    El cuerpo se lee en streaming (app/uploads.py): 400 si el formato no está
+    soportado (antes de leer el archivo), 413 en cuanto supera MAX_UPLOAD_BYTES.
+    """
+    try:
+        with stage("upload"):
+            form, upload = await receive_form(request, max_bytes=MAX_UPLOAD_BYTES,
+                                              on_file=lambda name: check_format(name.lower()))
+    except UploadTooLarge as e:
+        raise AnalysisError("file_too_large", str(e), 413)
+    except InvalidForm as e:
+        raise AnalysisError("invalid_form", str(e), 422)
+    if upload is None:
+        raise AnalysisError("missing_file", "Falta el archivo (campo file del formulario)", 422)
+    UPLOAD_BYTES.observe(upload.size)
+    return form, upload
+
+
+_FORM_TRUE = ("1", "true", "yes", "on", "y", "t")
+_FORM_FALSE = ("", "0", "false", "no", "off", "n", "f")
+
+
+def _form_flag(form: dict, name: str) -> bool:
+    value = form.get(name, "").strip().lower()
+    if value not in _FORM_TRUE + _FORM_FALSE:
+        raise AnalysisError("invalid_form", f"{name} debe ser true o false", 422)
+    return value in _FORM_TRUE
+
+
+def _form_openapi(**fields) -> dict:
+    """Esquema del formulario para /docs (el cuerpo no lo lee FastAPI, ver _receive)."""
+    schema = {
+        "type": "object",
+        "required": ["file"],
+        "properties": {"file": {"type": "string", "format": "binary"},
+                       **{name: {"type": kind} for name, kind in fields.items()}},
+    }
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+
+# Rutas que consumen LLM: pasan por el control de admisión (ver app/admission.py)
+ADMITTED_PATHS = ("/analyze", "/analyze/stream", "/translate")
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Se cobra antes de leer el cuerpo (coste estimado por Content-Length); el
+    # ticket queda en request.state para la cola justa y la liquidación final
+    if ADMISSION_ENABLED and request.method == "POST" and request.url.path in ADMITTED_PATHS:
+        client = client_id(request.headers, request.client.host if request.client else None)
+        try:
+            ticket = request.state.admission = admission.admit(client, request_cost(request.headers.get("content-length")))
+        except RateLimited as e:
+            return _rate_limited_response(e)
+        try:
+            response = await call_next(request)
+        except BaseException:
+            admission.refund(ticket)
+            raise
+        # Respuestas de error (400/413/422/429/500/503): se devuelve lo cobrado por encima de la base.
+        # Un stream (200) se liquida dentro de su generador.
+        if response.status_code >= 400:
+            admission.refund(ticket)
+        return response
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    # Si el cliente declara Content-Length, se rechaza antes de leer el cuerpo
+    if request.method == "POST" and request.url.path.startswith("/analyze"):
+        if content_length_exceeds(request.headers.get("content-length")):
+            err = AnalysisError("file_too_large", str(UploadTooLarge(MAX_UPLOAD_BYTES)), 413)
+            return _error_response(err)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # Abre el desglose por petición y mide la latencia hasta la cabecera de respuesta.
+    # Se etiqueta con la plantilla de la ruta (/jobs/{job_id}) para acotar la cardinalidad.
+    begin_request()
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, path=path, method=request.method)
+    REQUESTS.inc(path=path, method=request.method, status=response.status_code)
+    return response
+
+
+@app.get("/metrics")
+def metrics():
+    """Métricas del proceso en formato de exposición de Prometheus."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 
 @app.get("/health")
 def health():
@@ -22,60 +193,79 @@ def health():
 def root():
     return {"message": "AI Risk Radar API is running"}
 
-@app.post("/analyze")
-async def analyze_document(
-    file: UploadFile = File(...),
-    context: str = Form(""),
-    lang: str = Form("es"),
-):
+@app.post("/analyze", openapi_extra=_form_openapi(
+    context="string", lang="string", no_cache="boolean", invalidate="boolean",
+    mode="string", background="boolean", pdf_engine="string"))
+async def analyze_document(request: Request):
+    """
+    Formulario multipart: file + context, lang (es), no_cache, invalidate,
+    mode (auto), background, pdf_engine.
+    no_cache=True   → ignora la caché (ni lee ni escribe).
+    invalidate=True → borra la entrada existente, recalcula y vuelve a guardar.
+    mode="single"   → una sola llamada con el documento truncado a MAX_PROMPT_CHARS.
+    mode="chunked"  → análisis por ventanas en paralelo sobre el documento completo.
+    mode="auto"     → chunked solo si el documento no cabe en una llamada.
+    background=True → encola un job y responde 202 con su id (consultar GET /jobs/{id}).
+    pdf_engine      → auto (PyPDF2 + pdfplumber en páginas dudosas), pypdf o pdfplumber;
+                      vacío = PDF_ENGINE del servidor.
+    Con el control de admisión activo: 429 + Retry-After sin cuota, y los
+    análisis esperan turno en una cola justa entre clientes.
+    """
+    ticket = getattr(request.state, "admission", None)
     try:
-        filename = (file.filename or "").lower()
-        file_bytes = await file.read()
-
-        # Detectar tipo por extensión y procesar
-        if filename.endswith(".pdf"):
-            text_per_page = extract_text_from_pdf(file_bytes)
-            joined_text = "\n---\n".join([f"[Página {p['page']}]\n{p['text']}" for p in text_per_page])
-        elif filename.endswith(".docx"):
-            joined_text = extract_text_from_docx(file_bytes)
-        elif filename.endswith(".txt"):
-            joined_text = extract_text_from_txt(file_bytes)
-        else:
-            return JSONResponse(
-                content={
-                    "error_code": "unsupported_format",
-                    "message": "Formato no soportado (usa .txt, .pdf o .docx)",
-                },
-                status_code=400,
-            )
-
-        # Validación mínima para detectar parser vacío
-        if not joined_text or len(joined_text) < 100:
-            return JSONResponse(
-                content={
-                    "error_code": "empty_or_too_short",
-                    "message": "El archivo se leyó vacío o muy corto. Revisa el parser o prueba otro archivo.",
-                },
-                status_code=422,
-            )
-
-        # 🔹 Normaliza y registra el idioma
-        lang_norm = (lang or "es").strip().lower()
-        logger.info(f"[/analyze] incoming lang={lang!r} -> norm={lang_norm}")
-
-        # Generar riesgos con GPT
-        result = generate_risks(joined_text, context=context, lang=lang_norm)
-
-        # Añadir metadatos internos para debugging (visible en la UI si lo muestras)
-        result["_debug"] = {
-            "filename": filename,
-            "chars": len(joined_text),
-            "lang": lang_norm,
-        }
+        form, upload = await _receive(request)
+        with upload:
+            filename = upload.filename.lower()
+            context, lang = form.get("context", ""), form.get("lang", "es")
+            mode, pdf_engine = form.get("mode", "auto"), form.get("pdf_engine", "")
+            no_cache, invalidate = _form_flag(form, "no_cache"), _form_flag(form, "invalidate")
+            if _form_flag(form, "background"):
+                params = {
+                    "filename": filename,
+                    "context": context,
+                    "lang": normalize_lang(lang),
+                    "mode": normalize_mode(mode),
+                    "pdf_engine": normalize_pdf_engine(pdf_engine),
+                    "no_cache": no_cache,
+                    "invalidate": invalidate,
+                    "file_sha256": upload.sha256,
+                }
+                if ticket is not None:
+                    # El worker del job liquida (y espera turno en la cola justa) al ejecutarlo
+                    params["admission"] = ticket.handoff()
+                # El job se queda con el archivo (se mueve); el with ya no tiene nada que borrar
+                job_id = job_store.create(upload.path, params)
+                logger.info(f"[/analyze] queued job {job_id} file={filename}")
+                return JSONResponse(
+                    content={"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+                    status_code=202,
+                )
 
+            async with fair_queue.slot(ticket):
+                result = await run_analysis(
+                    upload.path,
+                    filename,
+                    context=context,
+                    lang=lang,
+                    mode=mode,
+                    no_cache=no_cache,
+                    invalidate=invalidate,
+                    file_sha256=upload.sha256,
+                    pdf_engine=pdf_engine,
+                )
+        admission.settle(ticket, result["_debug"])
+        result["_debug"]["upload_bytes"] = upload.size
         return JSONResponse(content=result)
 
+    except AnalysisError as e:
+        return _error_response(e)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+    except (LLMTransportError, ParserBusy) as e:
+        logger.error(f"Error en /analyze: {e.error_code}: {e.message}")
+        return _unavailable_response(e)
     except Exception as e:
+        record_error("internal_error")
         logger.error(f"Error en /analyze: {str(e)}")
         logger.error(traceback.format_exc())
         return JSONResponse(
@@ -86,3 +276,237 @@ async def analyze_document(
             status_code=500,
         )
 
+
+@app.post("/translate")
+async def translate(request: Request, analysis_key: str = Form(...), lang: str = Form("es")):
+    """
+    Devuelve un análisis ya hecho en otro idioma sin volver a analizar el documento.
+    analysis_key → _debug.analysis_key de una respuesta de /analyze o /analyze/stream.
+    Solo se traducen risk/justification/countermeasure; page y evidence se conservan.
+    Cada idioma queda cacheado (y /analyze con ese idioma lo reutiliza).
+    """
+    try:
+        ticket = getattr(request.state, "admission", None)
+        async with fair_queue.slot(ticket):
+            result = await translate_analysis(analysis_key, lang)
+        admission.settle(ticket, result.get("_debug", {}))
+        return JSONResponse(content=result)
+    except AnalysisError as e:
+        return _error_response(e)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+    except LLMTransportError as e:
+        logger.error(f"Error en /translate: {e.error_code}: {e.message}")
+        return _unavailable_response(e)
+    except Exception as e:
+        record_error("internal_error")
+        logger.error(f"Error en /translate: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse(content={"error_code": "internal_error", "message": str(e)}, status_code=500)
+
+
+@app.get("/risks/search")
+def search_risks(q: str = "", lang: str = "", kind: str = "", file_sha256: str = "", limit: int = 20, offset: int = 0):
+    """
+    Busca entre los riesgos de todos los análisis anteriores (texto completo
+    sobre risk, justification, countermeasure y evidence).
+    q     → palabras (todas deben aparecer; la última vale como prefijo).
+    lang, kind (intuitive|counterintuitive), file_sha256 → filtros opcionales.
+    limit (máx. 100) / offset → paginación; la respuesta trae el total.
+    """
+    if not RISK_LIBRARY_ENABLED:
+        return JSONResponse(
+            content={"error_code": "risk_library_disabled", "message": "La biblioteca de riesgos está desactivada"},
+            status_code=503,
+        )
+    if kind and kind not in ("intuitive", "counterintuitive"):
+        return JSONResponse(
+            content={"error_code": "invalid_kind", "message": "kind debe ser intuitive o counterintuitive"},
+            status_code=400,
+        )
+    t0 = time.perf_counter()
+    try:
+        found = risk_library.search(q, lang=lang, kind=kind, file_sha256=file_sha256, limit=limit, offset=offset)
+    except ValueError as e:
+        return JSONResponse(content={"error_code": "invalid_query", "message": str(e)}, status_code=400)
+    return JSONResponse(content={
+        "query": q,
+        "total": found["total"],
+        "limit": max(1, min(SEARCH_MAX_LIMIT, limit)),
+        "offset": max(0, offset),
+        "items": found["items"],
+        "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+    })
+
+
+@app.get("/portfolio/stats")
+def portfolio_stats(lang: str = "", kind: str = "", since: Optional[float] = None, top: int = 20):
+    """
+    Agregados sobre todos los análisis guardados (sin traducciones):
+    riesgos por tema y tipo, por idioma, densidad por página, contramedidas
+    recurrentes y mapa de calor documentos × temas.
+    lang, kind (intuitive|counterintuitive), since (epoch s) → filtros.
+    top → contramedidas y documentos del mapa de calor (máx. 200).
+    Un análisis aparece aquí con el retraso del escritor de la biblioteca.
+    """
+    if not (PORTFOLIO_ENABLED and RISK_LIBRARY_ENABLED):
+        return JSONResponse(
+            content={"error_code": "portfolio_disabled", "message": "La cartera de análisis está desactivada"},
+            status_code=503,
+        )
+    if kind and kind not in KINDS:
+        return JSONResponse(
+            content={"error_code": "invalid_kind", "message": "kind debe ser intuitive o counterintuitive"},
+            status_code=400,
+        )
+    t0 = time.perf_counter()
+    stats = portfolio.stats(lang=lang or None, kind=kind or None, since=since, top=top)
+    stats["took_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return JSONResponse(content=stats)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Estado, progreso por etapa y resultado final de un job encolado con background=True."""
+    job = job_store.get(job_id)
+    if job is None:
+        return JSONResponse(
+            content={"error_code": "job_not_found", "message": f"Job {job_id} no existe"},
+            status_code=404,
+        )
+    return JSONResponse(content=public_view(job))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/analyze/stream", openapi_extra=_form_openapi(
+    context="string", lang="string", no_cache="boolean", invalidate="boolean", pdf_engine="string"))
+async def analyze_document_stream(request: Request):
+    """
+    Igual que /analyze (modo single) pero responde con Server-Sent Events:
+      event: risk   → {"kind": "intuitive"|"counterintuitive", "item": {...}}
+      event: done   → resultado completo con _debug
+      event: error  → {"error_code", "message"}
+    Los errores previos al stream se devuelven como JSON, igual que en /analyze:
+    entrada (400/413/422), cola de extracción llena o LLM caído al traducir (503), 500;
+    la espera de turno en la cola justa ocurre ya dentro del stream.
+    """
+    request_metrics = current_request() or begin_request()
+    ticket = getattr(request.state, "admission", None)
+    try:
+        form, upload = await _receive(request)
+        with upload:
+            filename = upload.filename.lower()
+            context, lang = form.get("context", ""), form.get("lang", "es")
+            no_cache, invalidate = _form_flag(form, "no_cache"), _form_flag(form, "invalidate")
+            lang_norm = normalize_lang(lang)
+            engine_norm = normalize_pdf_engine(form.get("pdf_engine", ""))
+            # Mismo resultado que mode=single: comparte entrada de caché con /analyze
+            analysis_key, cache_key = analysis_keys(upload.sha256, context, lang_norm, mode="single",
+                                                    selection=PASSAGE_SELECTION, pdf_engine=engine_norm)
+            cached, cache_status = cached_result(cache_key, no_cache, invalidate)
+            if cached is None and cache_status == "miss":
+                # Ya analizado en otro idioma: se traduce (una llamada corta) y se emite igual que la caché
+                cached = await translate_cached(analysis_key, lang_norm)
+                if cached is not None:
+                    cache_status = "translated"
+            if cached is None:
+                with stage("extract"):
+                    raw_pages, extract_info = await aread_document(filename, upload.path, "single", engine_norm)
+                    text_per_page, joined_text = prompt_pages(raw_pages, "single", context, extract_info)
+    except AnalysisError as e:
+        return _error_response(e)
+    except (LLMTransportError, ParserBusy) as e:
+        # LLMTransportError: la traducción desde otro idioma (translate_cached) falló
+        logger.error(f"Error en /analyze/stream: {e.error_code}: {e.message}")
+        return _unavailable_response(e)
+    except Exception as e:
+        record_error("internal_error")
+        logger.error(f"Error en /analyze/stream: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse(content={"error_code": "internal_error", "message": str(e)}, status_code=500)
+
+    async def events():
+        try:
+            if cached is not None:
+                result = cached
+                for list_name in ("intuitive_risks", "counterintuitive_risks"):
+                    for item in result.get(list_name, []):
+                        yield _sse("risk", {"kind": list_name.replace("_risks", ""), "item": item})
+            else:
+                async with fair_queue.slot(ticket):
+                    logger.info(f"[/analyze/stream] incoming lang={lang!r} -> norm={lang_norm}")
+                    result = evidence_index = None
+                    evidence, verified = {}, set()
+                    if EVIDENCE_CHECK:
+                        with stage("verify"):
+                            evidence_index = EvidenceIndex(raw_pages)
+                    async for ev in astream_risks(joined_text, context=context, lang=lang_norm):
+                        if ev["event"] == "risk":
+                            # Cada riesgo sale ya con la página verificada contra el texto
+                            if evidence_index is not None:
+                                verify_risk(evidence_index, ev["item"], evidence)
+                                verified.add(id(ev["item"]))
+                            yield _sse("risk", {"kind": ev["kind"], "item": ev["item"]})
+                        else:
+                            result = ev["data"]
+                    if evidence_index is not None:
+                        # Una sola verificación por riesgo: el recuento es el de la emisión
+                        # (con las páginas corregidas); solo se verifica lo que no se emitió
+                        with stage("verify"):
+                            for list_name in RISK_LISTS:
+                                for item in result.get(list_name, []):
+                                    if id(item) not in verified:
+                                        verify_risk(evidence_index, item, evidence)
+                        extract_info["evidence"] = evidence
+                    result["_debug"] = {
+                        "filename": filename,
+                        "file_sha256": upload.sha256,
+                        "chars": len(joined_text),
+                        "lang": lang_norm,
+                        "mode": "single",
+                        "chunks": 1,
+                        **({"repair": result.pop("_repair")} if "_repair" in result else {}),
+                        **extract_info,
+                    }
+                    # Un resultado incompleto (faltan riesgos tras el re-ask) no se cachea
+                    if cache_status != "bypass" and "missing" not in result["_debug"].get("repair", {}):
+                        result_cache.set(cache_key, result)
+                        result_cache.set(analysis_key, result)
+                        if RISK_LIBRARY_ENABLED:
+                            risk_library.submit(library_record(cache_key, analysis_key, result, context))
+
+            result["_debug"] = {
+                **result.get("_debug", {}),
+                "filename": filename,
+                "lang": lang_norm,
+                "cache": cache_status,
+                "cache_key": cache_key,
+                "analysis_key": analysis_key,
+                "timings": request_metrics.summary(),
+            }
+            admission.settle(ticket, result["_debug"])
+            yield _sse("done", result)
+        except RateLimited as e:
+            record_error(e.error_code)
+            yield _sse("error", {**e.to_dict(), "retry_after": e.retry_after})
+        except LLMTransportError as e:
+            record_error(e.error_code)
+            logger.error(f"Error en /analyze/stream: {e.error_code}: {e.message}")
+            yield _sse("error", {**e.to_dict(), "retry_after": e.retry_after})
+        except Exception as e:
+            record_error("internal_error")
+            logger.error(f"Error en /analyze/stream: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield _sse("error", {"error_code": "internal_error", "message": str(e)})
+        finally:
+            # Error dentro del stream o cliente desconectado: no llegó a "done"
+            admission.refund(ticket)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
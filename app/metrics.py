@@ -0,0 +1,288 @@
+# app/metrics.py
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Instrumentación ligera (sin dependencias) con exposición Prometheus:
+#   - Métricas globales del proceso (contadores e histogramas con etiquetas)
+#     que se sirven en texto plano en GET /metrics.
+#   - Desglose por petición (etapas, llamadas al LLM, tokens) en una
+#     ContextVar: las tareas hijas de asyncio comparten el mismo objeto, así
+#     que las ventanas del modo chunked suman en la petición que las lanzó.
+#  Cada observación es un bisect + un par de sumas bajo un lock: se puede
+#  dejar activo en producción. Con varios workers de uvicorn cada proceso
+#  expone sus propias series (Prometheus las agrega por instancia).
+# ─────────────────────────────────────────────────────────────────────────────
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_PREFIX = "risk_radar_"
+
+# Buckets en segundos: de operaciones locales (ms) a llamadas largas al LLM
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+BYTES_BUCKETS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 25_000_000, 50_000_000)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+CHARS_BUCKETS = (1_000, 2_500, 5_000, 10_000, 18_000, 25_000, 50_000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}")
+        return lines
+
+
+class Gauge:
+    """Valor instantáneo (colas, trabajos en curso) que sube y baja."""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # por serie: [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, [list(s[0]), s[1], s[2]]) for k, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(METRICS_PREFIX + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(METRICS_PREFIX + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(METRICS_PREFIX + name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter("http_requests_total", "Peticiones HTTP por ruta y status.", ("path", "method", "status"))
+REQUEST_SECONDS = registry.histogram("http_request_seconds", "Latencia HTTP (hasta la cabecera de respuesta).", ("path", "method"))
+STAGE_SECONDS = registry.histogram("stage_seconds", "Duración de cada etapa del pipeline.", ("stage",))
+ERRORS = registry.counter("errors_total", "Errores devueltos por código.", ("error_code",))
+UPLOAD_BYTES = registry.histogram("upload_bytes", "Tamaño de los archivos subidos.", buckets=BYTES_BUCKETS)
+DOCUMENT_PAGES = registry.histogram("document_pages", "Páginas/secciones leídas por documento.", buckets=COUNT_BUCKETS)
+PROMPT_CHARS = registry.histogram("prompt_chars", "Caracteres de documento enviados por llamada al LLM.", buckets=CHARS_BUCKETS)
+LLM_CALLS = registry.counter("llm_calls_total", "Llamadas al LLM por resultado.", ("outcome",))
+LLM_TOKENS = registry.counter("llm_tokens_total", "Tokens consumidos según el campo usage de la API.", ("kind",))
+CACHE_LOOKUPS = registry.counter("cache_lookups_total", "Consultas a la caché de resultados.", ("result",))
+ANALYSES = registry.counter("analyses_total", "Análisis por rol en single-flight (leader ejecuta, follower se une).", ("role",))
+TRANSLATIONS = registry.counter("translations_total", "Resultados traducidos desde otro idioma en lugar de re-analizar.", ("lang",))
+
+
+def render_metrics() -> str:
+    return registry.render()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Desglose por petición
+# ─────────────────────────────────────────────────────────────────────────────
+
+class RequestMetrics:
+    """Acumulador de una petición (o job). Lo que acaba en _debug.timings."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.llm_calls = 0
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["completion"] += completion_tokens
+
+    def summary(self) -> dict:
+        """
+        Segundos por etapa (las llamadas concurrentes del modo chunked se suman,
+        así que llm puede superar a total) más llamadas, tokens y caracteres.
+        """
+        return {
+            "total_s": round(time.perf_counter() - self.started, 4),
+            "stages_s": {k: round(v, 4) for k, v in self.stages.items()},
+            "llm_calls": self.llm_calls,
+            "tokens": dict(self.tokens),
+            "prompt_chars": self.prompt_chars,
+        }
+
+
+_current: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar("request_metrics", default=None)
+
+
+def begin_request() -> RequestMetrics:
+    """Abre un acumulador nuevo para el contexto actual (middleware HTTP o job)."""
+    current = RequestMetrics()
+    _current.set(current)
+    return current
+
+
+def current_request() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mide una etapa: histograma global + desglose de la petición en curso.
+    También sirve como decorador (@stage("parse")).
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        current = _current.get()
+        if current is not None:
+            current.add_stage(name, elapsed)
+
+
+def record_llm_call(usage=None, outcome: str = "ok") -> None:
+    """
+    Cuenta una llamada al LLM y sus tokens. `usage` puede ser el objeto del
+    SDK nuevo (atributos) o el dict del SDK viejo; si falta, solo se cuenta.
+    """
+    LLM_CALLS.inc(outcome=outcome)
+    current = _current.get()
+    if current is not None:
+        with current._lock:
+            current.llm_calls += 1
+    if usage is None:
+        return
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+    else:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, kind="completion")
+    if current is not None:
+        current.add_usage(prompt_tokens, completion_tokens)
+
+
+def record_prompt_chars(chars: int) -> None:
+    PROMPT_CHARS.observe(chars)
+    current = _current.get()
+    if current is not None:
+        with current._lock:
+            current.prompt_chars += chars
+
+
+def record_error(error_code: str) -> None:
+    ERRORS.inc(error_code=error_code)
@@ -0,0 +1,165 @@
+# app/parse_pool.py
+import os
+import math
+import time
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from app.metrics import registry
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Pool acotado de procesos para la extracción de texto (CPU-bound):
+#   - PyPDF2, pdfplumber y el XML del docx no liberan el GIL; ejecutados en el
+#     event loop bloquean al resto de peticiones (incluidas /health y los
+#     eventos SSE) mientras dura cada extracción.
+#   - PARSE_WORKERS procesos y como mucho PARSE_QUEUE_DEPTH documentos
+#     esperando turno. Con la cola llena se rechaza al momento (ParserBusy →
+#     503 con Retry-After) en lugar de acumular trabajo que llegaría tarde.
+#   - Profundidad de cola, trabajos en curso y espera hasta empezar se exponen
+#     en /metrics para escalar por carga de parseo.
+#  Los documentos de menos de PARSE_INLINE_MAX_BYTES se extraen en el propio
+#  proceso: cuesta menos que el viaje al worker y no esperan detrás de los
+#  grandes. PARSE_WORKERS=0 extrae todo en el proceso (comportamiento previo).
+#  Dentro de un worker los PDF grandes se extraen en serie: el paralelismo ya
+#  lo da el pool, y un pool de PDF_WORKERS procesos por worker multiplicaría
+#  los procesos (PARSE_WORKERS × PDF_WORKERS) compitiendo por los mismos núcleos.
+# ─────────────────────────────────────────────────────────────────────────────
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_QUEUE_DEPTH = int(os.getenv("PARSE_QUEUE_DEPTH", str(max(1, PARSE_WORKERS) * 4)))
+# Mínimo de Retry-After; con cola se estima por el tiempo medio de extracción
+PARSE_RETRY_AFTER_S = float(os.getenv("PARSE_RETRY_AFTER_S", "1"))
+PARSE_INLINE_MAX_BYTES = int(os.getenv("PARSE_INLINE_MAX_BYTES", str(64 * 1024)))
+
+PARSE_QUEUED = registry.gauge("parse_queue_depth", "Documentos esperando un worker de extracción.")
+PARSE_IN_FLIGHT = registry.gauge("parse_in_flight", "Documentos aceptados por el pool de extracción (en curso + en cola).")
+PARSE_WAIT_SECONDS = registry.histogram("parse_wait_seconds", "Espera en cola hasta que un worker empieza a extraer.")
+PARSE_REJECTIONS = registry.counter("parse_rejections_total", "Extracciones rechazadas con la cola llena.")
+
+
+class ParserBusy(Exception):
+    """Cola de extracción llena (la API lo devuelve como 503 con Retry-After)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.error_code = "parser_busy"
+        self.message = message
+        self.retry_after = retry_after
+
+    def to_dict(self) -> dict:
+        return {"error_code": self.error_code, "message": self.message}
+
+
+def _init_worker() -> None:
+    # Se ejecuta al arrancar cada proceso del pool
+    from app import parsers
+
+    parsers.PDF_WORKERS = 1
+
+
+def _timed_call(fn: Callable, args: tuple):
+    # Se ejecuta en el worker: devuelve cuándo empezó para medir la espera en cola
+    started = time.time()
+    return started, fn(*args)
+
+
+class ParsePool:
+    """ProcessPoolExecutor con admisión acotada. Se crea al primer uso."""
+
+    def __init__(self, workers: int = PARSE_WORKERS, queue_depth: int = PARSE_QUEUE_DEPTH,
+                 inline_max_bytes: int = PARSE_INLINE_MAX_BYTES):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.inline_max_bytes = inline_max_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Media móvil (EWMA) de la duración de una extracción, para Retry-After
+        self._avg_s: Optional[float] = None
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        return self._executor
+
+    def _publish(self) -> None:
+        PARSE_IN_FLIGHT.set(self._in_flight)
+        PARSE_QUEUED.set(max(0, self._in_flight - self.workers))
+
+    def retry_after(self) -> float:
+        """Segundos hasta que previsiblemente se libere un hueco en la cola."""
+        if not self._avg_s:
+            return PARSE_RETRY_AFTER_S
+        waves = max(1, self._in_flight - self.workers + 1) / self.workers
+        return max(PARSE_RETRY_AFTER_S, waves * self._avg_s)
+
+    def _release(self, future) -> None:
+        # Callback del concurrent.future (thread del executor): también cuenta
+        # los trabajos cuya petición se canceló mientras esperaban
+        with self._lock:
+            self._in_flight -= 1
+            self._publish()
+            if not future.cancelled() and future.exception() is None:
+                started, _ = future.result()
+                elapsed = time.time() - started
+                self._avg_s = elapsed if self._avg_s is None else 0.8 * self._avg_s + 0.2 * elapsed
+
+    async def run(self, fn: Callable, *args, size: Optional[int] = None):
+        """
+        Ejecuta fn(*args) en un worker. `fn` y sus argumentos deben poder
+        enviarse a otro proceso (función de módulo, rutas o bytes).
+        Con `size` (bytes del documento) por debajo de inline_max_bytes se
+        ejecuta aquí mismo. Lanza ParserBusy si ya hay `capacity` documentos aceptados.
+        """
+        if self.workers <= 0 or (size is not None and size <= self.inline_max_bytes):
+            return fn(*args)
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                PARSE_REJECTIONS.inc()
+                raise ParserBusy(
+                    f"Cola de extracción llena ({self.queue_depth} documentos en espera); reintenta más tarde",
+                    retry_after=math.ceil(self.retry_after()),
+                )
+            self._in_flight += 1
+            self._publish()
+            executor = self._get_executor()
+        enqueued = time.time()
+        try:
+            future = executor.submit(_timed_call, fn, args)
+        except BrokenProcessPool:
+            with self._lock:
+                self._in_flight -= 1
+                self._publish()
+            self._discard(executor)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            started, result = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        PARSE_WAIT_SECONDS.observe(max(0.0, started - enqueued))
+        return result
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        # Un worker murió (OOM, señal): el siguiente documento crea un pool nuevo
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+parse_pool = ParsePool()
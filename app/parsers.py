@@ -1,63 +1,525 @@
 # app/parsers.py
-from io import BytesIO
-from typing import Union, List, Dict
+import os
 import re
+import codecs
+import shutil
+import tempfile
+import zipfile
+from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, List, Dict, Optional, Iterator, Iterable
+
+# Los parsers aceptan bytes, un objeto tipo archivo o la ruta de un archivo en
+# disco. Con ruta no se copia nada en memoria (es lo que usa la API).
+Source = Union[bytes, BytesIO, str, os.PathLike]
+
+
+def _as_source(source: Source):
+    """bytes → BytesIO; ruta → str; objeto tipo archivo → tal cual."""
+    if isinstance(source, bytes):
+        return BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return source
+
+# 1) PDF: registro de motores de extracción
+#    - "pypdf": capa de texto con PyPDF2, sin análisis de layout (rápido).
+#    - "pdfplumber": análisis de layout, preciso pero lento.
+#    - "auto" (por defecto): PyPDF2 y, solo en las páginas cuya salida parece
+#      vacía o corrupta, pdfplumber. Cada página indica qué motor la extrajo.
+#    Con documentos grandes las páginas se reparten en rangos entre procesos
+#    (la extracción es CPU-bound y no libera el GIL). Cada worker abre el PDF
+#    desde un archivo temporal compartido, así no se copian bytes entre procesos.
+#    En los workers de app/parse_pool.py PDF_WORKERS vale 1 (sin pools anidados).
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_ENGINE = os.getenv("PDF_ENGINE", "auto").strip().lower()
+# Por debajo de este número de caracteres útiles la página se considera vacía
+PDF_MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "20"))
+
+
+def _clean_page_text(page_text: str) -> str:
+    page_text = re.sub(r"[ \t]+", " ", page_text)
+    return re.sub(r"\n{3,}", "\n\n", page_text).strip()
+
+
+@contextmanager
+def _unreadable_pdf(errors: tuple):
+    # Errores propios del motor (PDF dañado, sin xref, no es un PDF) → ValueError (422 en la API)
+    try:
+        yield
+    except errors as e:
+        raise ValueError(f"El archivo .pdf no es un PDF válido o está dañado: {e}") from None
+
+
+class PdfPlumberEngine:
+    name = "pdfplumber"
+
+    def __init__(self, src):
+        try:
+            import pdfplumber
+            from pdfminer.psparser import PSException
+            from pdfplumber.utils.exceptions import PdfminerException
+        except ImportError:
+            raise ImportError("Falta pdfplumber. Instala con: pip install pdfplumber")
+        self._errors = (PdfminerException, PSException)
+        with _unreadable_pdf(self._errors):
+            self._pdf = pdfplumber.open(src)
+
+    def __len__(self) -> int:
+        with _unreadable_pdf(self._errors):
+            return len(self._pdf.pages)
+
+    def extract(self, i: int) -> str:
+        with _unreadable_pdf(self._errors):
+            page = self._pdf.pages[i]
+            page_text = page.extract_text(x_tolerance=1.5, y_tolerance=1.5) or ""
+        page.close()  # libera la caché de objetos de la página
+        return _clean_page_text(page_text)
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+class PyPdfEngine:
+    name = "pypdf"
+
+    def __init__(self, src):
+        try:
+            from PyPDF2 import PdfReader
+            from PyPDF2.errors import PyPdfError
+        except ImportError:
+            raise ImportError("Falta PyPDF2. Instala con: pip install PyPDF2")
+        self._errors = (PyPdfError,)
+        # Con una ruta PdfReader cargaría el archivo entero en memoria; con el
+        # handle abierto lee solo los objetos que necesita cada página
+        self._fh = open(src, "rb") if isinstance(src, str) else None
+        try:
+            with _unreadable_pdf(self._errors):
+                self._reader = PdfReader(self._fh or src)
+        except ValueError:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        with _unreadable_pdf(self._errors):
+            return len(self._reader.pages)
+
+    def extract(self, i: int) -> str:
+        with _unreadable_pdf(self._errors):
+            return _clean_page_text(self._reader.pages[i].extract_text() or "")
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+
 
-# 1) PDF: usa pdfplumber
-def extract_text_from_pdf(file_bytes: Union[bytes, BytesIO]) -> List[Dict]:
+PDF_ENGINES = {
+    PyPdfEngine.name: PyPdfEngine,
+    PdfPlumberEngine.name: PdfPlumberEngine,
+}
+PDF_ENGINE_CHOICES = ("auto", *PDF_ENGINES)
+
+
+def looks_garbled(text: str, min_chars: int = PDF_MIN_PAGE_CHARS) -> bool:
     """
-    Devuelve una lista de dicts: { "page": n, "text": "..." }
-    Útil para trazabilidad de riesgos por página.
+    Heurística para decidir si la salida rápida no sirve: página (casi) vacía,
+    glifos sin mapear "(cid:N)" o caracteres de reemplazo, poca proporción de
+    letras, o palabras anormalmente largas (espacios perdidos al extraer).
     """
+    stripped = text.strip()
+    if len(stripped) < min_chars:
+        return True
+    if "(cid:" in stripped or stripped.count("\ufffd") > len(stripped) * 0.01:
+        return True
+    visible = [c for c in stripped if not c.isspace()]
+    letters = sum(c.isalpha() for c in visible)
+    if letters < len(visible) * 0.5:
+        return True
+    words = stripped.split()
+    return sum(len(w) for w in words) / len(words) > 25
+
+
+class AutoEngine:
+    """PyPDF2 por defecto; pdfplumber (abierto solo si hace falta) para páginas dudosas."""
+    name = "auto"
+
+    def __init__(self, src):
+        self._src = src
+        self._fast = PyPdfEngine(src)
+        self._slow = None
+
+    def __len__(self) -> int:
+        return len(self._fast)
+
+    def extract_with_engine(self, i: int):
+        text = self._fast.extract(i)
+        if not looks_garbled(text):
+            return text, PyPdfEngine.name
+        if self._slow is None:
+            # Stream propio para que ambos motores no se pisen la posición de lectura
+            src = self._src
+            if not isinstance(src, str):
+                src.seek(0)
+                src = BytesIO(src.read())
+            self._slow = PdfPlumberEngine(src)
+        slow_text = self._slow.extract(i)
+        # Si pdfplumber tampoco saca nada mejor, se queda la salida rápida
+        if len(slow_text.strip()) >= len(text.strip()):
+            return slow_text, PdfPlumberEngine.name
+        return text, PyPdfEngine.name
+
+    def close(self) -> None:
+        self._fast.close()
+        if self._slow is not None:
+            self._slow.close()
+
+
+def _open_pdf_engine(src, engine: str):
+    if engine == "auto":
+        return AutoEngine(src)
+    if engine not in PDF_ENGINES:
+        raise ValueError(f"Motor PDF desconocido: {engine!r} (usa {', '.join(PDF_ENGINE_CHOICES)})")
+    return PDF_ENGINES[engine](src)
+
+
+def _iter_engine_pages(pdf, start: int, end: int) -> Iterator[Dict]:
+    for i in range(start, end):
+        if isinstance(pdf, AutoEngine):
+            text, used = pdf.extract_with_engine(i)
+        else:
+            text, used = pdf.extract(i), pdf.name
+        yield {"page": i + 1, "text": text, "engine": used}
+
+
+def _extract_pdf_range(path: str, start: int, end: int, engine: str = PDF_ENGINE) -> List[Dict]:
+    """Worker: extrae las páginas [start, end) (índices base 0) de un PDF en disco."""
+    pdf = _open_pdf_engine(path, engine)
     try:
-        import pdfplumber
-    except ImportError:
-        raise ImportError("Falta pdfplumber. Instala con: pip install pdfplumber")
+        return list(_iter_engine_pages(pdf, start, end))
+    finally:
+        pdf.close()
 
-    bio = BytesIO(file_bytes) if isinstance(file_bytes, bytes) else file_bytes
-    pages = []
 
-    with pdfplumber.open(bio) as pdf:
-        for i, page in enumerate(pdf.pages):
-            page_text = page.extract_text(x_tolerance=1.5, y_tolerance=1.5) or ""
-            page_text = re.sub(r"[ \t]+", " ", page_text)
-            page_text = re.sub(r"\n{3,}", "\n\n", page_text).strip()
-            pages.append({"page": i + 1, "text": page_text})
+def iter_pdf_pages(
+    source: Source,
+    workers: Optional[int] = None,
+    min_pages: Optional[int] = None,
+    serial_head: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> Iterator[Dict]:
+    """
+    Generador perezoso de páginas { "page": n, "text": "...", "engine": ... }:
+    solo se extrae lo que el consumidor pide. En documentos grandes las
+    primeras `serial_head` páginas salen en serie (por defecto min_pages) y, si
+    el consumidor sigue pidiendo, el resto se extrae en paralelo y en orden.
+    `engine` es un nombre de PDF_ENGINE_CHOICES (por defecto PDF_ENGINE).
+    """
+    workers = PDF_WORKERS if workers is None else workers
+    min_pages = PDF_PARALLEL_MIN_PAGES if min_pages is None else min_pages
+    engine = (engine or PDF_ENGINE).strip().lower()
+
+    src = _as_source(source)
+
+    pdf = _open_pdf_engine(src, engine)
+    try:
+        n_pages = len(pdf)
+        parallel = workers > 1 and n_pages >= min_pages
+        head = n_pages if not parallel else min(n_pages, min_pages if serial_head is None else serial_head)
+        yield from _iter_engine_pages(pdf, 0, head)
+    finally:
+        pdf.close()
+
+    if head < n_pages:
+        yield from _iter_pdf_parallel(src, head, n_pages, workers, engine)
 
-    return pages
+
+def extract_text_from_pdf(
+    source: Source,
+    workers: Optional[int] = None,
+    min_pages: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Devuelve una lista de dicts: { "page": n, "text": "...", "engine": "..." }
+    Útil para trazabilidad de riesgos por página.
+    workers / min_pages / engine sobrescriben PDF_WORKERS / PDF_PARALLEL_MIN_PAGES / PDF_ENGINE.
+    """
+    return list(iter_pdf_pages(source, workers=workers, min_pages=min_pages, serial_head=0, engine=engine))
+
+
+def _iter_pdf_parallel(src, first: int, n_pages: int, workers: int, engine: str) -> Iterator[Dict]:
+    # Rangos más pequeños que páginas/workers para equilibrar páginas lentas (tablas, OCR)
+    remaining = n_pages - first
+    n_ranges = min(remaining, workers * 4)
+    step = -(-remaining // n_ranges)
+    ranges = [(s, min(s + step, n_pages)) for s in range(first, n_pages, step)]
+
+    # Con ruta en disco los workers la abren directamente; si no, temporal compartido
+    if isinstance(src, str):
+        path, owns_path = src, False
+    else:
+        src.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            shutil.copyfileobj(src, tmp)
+            path, owns_path = tmp.name, True
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(ranges)))
+    try:
+        futures = [pool.submit(_extract_pdf_range, path, s, e, engine) for s, e in ranges]
+        for f in futures:
+            yield from f.result()
+    finally:
+        # Si el consumidor se detiene antes, se cancelan los rangos pendientes
+        pool.shutdown(wait=True, cancel_futures=True)
+        if owns_path:
+            os.remove(path)
 
 
 # 2) DOCX
-def extract_text_from_docx(file_bytes: Union[bytes, BytesIO]) -> str:
+#    Sin python-docx: word/document.xml se lee en streaming directamente del
+#    zip con iterparse y cada bloque del cuerpo se libera en cuanto se procesa,
+#    así la memoria no crece con el tamaño del documento. Se emiten párrafos y
+#    filas de tabla (celdas separadas por " | ") en orden. Los títulos
+#    (estilos Heading/Title o con nivel de esquema) abren una sección nueva;
+#    las secciones hacen de pseudo-páginas y se parten si superan
+#    ~DOCX_SECTION_CHARS caracteres.
+DOCX_SECTION_CHARS = int(os.getenv("DOCX_SECTION_CHARS", "3000"))
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Respaldo si no hay styles.xml: ids de estilo típicos (Word en en/de/es/fr)
+_HEADING_STYLE_RE = re.compile(r"^(heading|berschrift|ttulo|titre|title|titel)\s*\d*$", re.IGNORECASE)
+
+
+def _group_sections(blocks: Iterable[str], section_chars: int) -> Iterator[Dict]:
+    section, size, n = [], 0, 0
+    for block in blocks:
+        section.append(block)
+        size += len(block) + 1
+        if size >= section_chars:
+            n += 1
+            yield {"page": n, "text": "\n".join(section)}
+            section, size = [], 0
+    if section:
+        yield {"page": n + 1, "text": "\n".join(section)}
+
+
+def _docx_heading_styles(zf: zipfile.ZipFile) -> set:
+    """styleIds de títulos según word/styles.xml (nombre "heading N"/"title" o outlineLvl)."""
+    import xml.etree.ElementTree as ET
+
+    try:
+        with zf.open("word/styles.xml") as f:
+            root = ET.parse(f).getroot()
+    except KeyError:
+        return set()
+    heading = set()
+    for style in root.iter(f"{_W}style"):
+        style_id = style.get(f"{_W}styleId")
+        name = style.find(f"{_W}name")
+        name = (name.get(f"{_W}val") if name is not None else "") or ""
+        if name.lower().startswith(("heading", "title")) or style.find(f"{_W}pPr/{_W}outlineLvl") is not None:
+            heading.add(style_id)
+    return heading
+
+
+def _iter_docx_blocks(source: Source) -> Iterator[tuple]:
+    """Genera ("heading" | "paragraph" | "row", texto) en orden de documento."""
+    import xml.etree.ElementTree as ET
+
+    with zipfile.ZipFile(_as_source(source)) as zf:
+        heading_styles = _docx_heading_styles(zf)
+        with zf.open("word/document.xml") as f:
+            body = None
+            table_depth = 0
+            runs = []         # texto del párrafo en curso
+            cells = []        # pila de listas de celdas (tablas anidadas)
+            cell_parts = []   # pila de párrafos de la celda en curso
+            is_heading = False
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if tag == f"{_W}body":
+                        body = elem
+                    elif tag == f"{_W}tbl":
+                        table_depth += 1
+                    elif tag == f"{_W}tr":
+                        cells.append([])
+                    elif tag == f"{_W}tc":
+                        cell_parts.append([])
+                    elif tag == f"{_W}p":
+                        runs, is_heading = [], False
+                    continue
+
+                if tag == f"{_W}t":
+                    runs.append(elem.text or "")
+                elif tag == f"{_W}tab":
+                    runs.append("\t")
+                elif tag in (f"{_W}br", f"{_W}cr"):
+                    runs.append("\n")
+                elif tag == f"{_W}pStyle":
+                    style = elem.get(f"{_W}val") or ""
+                    is_heading = style in heading_styles or bool(_HEADING_STYLE_RE.match(style))
+                elif tag == f"{_W}outlineLvl":
+                    is_heading = True
+                elif tag == f"{_W}p":
+                    text = "".join(runs).strip()
+                    if table_depth and cell_parts:
+                        if text:
+                            cell_parts[-1].append(text)
+                    elif text:
+                        yield ("heading" if is_heading else "paragraph", text)
+                elif tag == f"{_W}tc":
+                    parts = cell_parts.pop() if cell_parts else []
+                    if cells:
+                        cells[-1].append(" ".join(parts))
+                elif tag == f"{_W}tr":
+                    row = cells.pop() if cells else []
+                    if any(c.strip() for c in row):
+                        row_text = " | ".join(c.strip() for c in row)
+                        # Fila de una tabla anidada: queda dentro de la celda que la contiene
+                        if cell_parts:
+                            cell_parts[-1].append(row_text)
+                        else:
+                            yield ("row", row_text)
+                elif tag == f"{_W}tbl":
+                    table_depth -= 1
+
+                # Bloque de primer nivel ya procesado: se suelta para no acumular el árbol
+                if body is not None and table_depth == 0 and tag in (f"{_W}p", f"{_W}tbl", f"{_W}sdt"):
+                    body.clear()
+
+
+def iter_docx_sections(source: Source, section_chars: int = DOCX_SECTION_CHARS) -> Iterator[Dict]:
     """
-    Extrae texto plano de documentos .docx (Word).
+    Generador perezoso de secciones { "page": n, "text": "...", "section": título }
+    de un .docx. Cada título abre sección; las secciones largas se parten.
     """
+    from xml.etree.ElementTree import ParseError
+
+    n, title, section, size = 0, None, [], 0
+
+    def flush():
+        nonlocal n, section, size
+        n += 1
+        page = {"page": n, "text": "\n".join(section), "section": title}
+        section, size = [], 0
+        return page
+
     try:
-        from docx import Document
-    except ImportError:
-        raise ImportError("Falta python-docx. Instala con: pip install python-docx")
+        for kind, text in _iter_docx_blocks(source):
+            if kind == "heading" and section:
+                yield flush()
+            if kind == "heading":
+                title = text
+            section.append(text)
+            size += len(text) + 1
+            if size >= section_chars:
+                yield flush()
+    except (zipfile.BadZipFile, KeyError, ParseError):
+        # ParseError: zip correcto con document.xml (o styles.xml) mal formado
+        raise ValueError("El archivo .docx no es un documento Word válido")
+    if section:
+        yield flush()
 
-    bio = BytesIO(file_bytes) if isinstance(file_bytes, bytes) else file_bytes
-    doc = Document(bio)
-    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-    return "\n".join(paragraphs).strip()
+
+def extract_text_from_docx(source: Source) -> str:
+    """
+    Extrae texto plano de documentos .docx (Word).
+    """
+    return "\n".join(s["text"] for s in iter_docx_sections(source)).strip()
 
 
 # 3) TXT
-def extract_text_from_txt(file_bytes: Union[bytes, BytesIO]) -> str:
+#    Se lee por bloques de TXT_CHUNK_BYTES con un decodificador incremental:
+#    una primera pasada solo valida UTF-8 (sin guardar nada) y la segunda
+#    decodifica con la codificación elegida (UTF-8 o, si no lo es, latin-1) y
+#    corta en líneas en blanco aunque caigan entre dos bloques. La memoria
+#    depende del bloque y de la sección más larga, no del tamaño del archivo.
+TXT_SECTION_CHARS = int(os.getenv("TXT_SECTION_CHARS", "3000"))
+TXT_CHUNK_BYTES = int(os.getenv("TXT_CHUNK_BYTES", str(64 * 1024)))
+
+_BLANK_LINE_RE = re.compile(r"\n\s*\n")
+
+
+@contextmanager
+def _open_binary(source: Source):
+    src = _as_source(source)
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            yield f
+    else:
+        yield src
+
+
+def _iter_chunks(f) -> Iterator[bytes]:
+    while True:
+        chunk = f.read(TXT_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _decode_txt(source: Source) -> str:
+    with _open_binary(source) as f:
+        file_bytes = f.read()
+
+    try:
+        return file_bytes.decode("utf-8")
+    except UnicodeDecodeError:
+        return file_bytes.decode("latin-1", errors="ignore")
+
+
+def _txt_encoding(f) -> str:
+    """'utf-8' si todo el archivo lo es; si no, 'latin-1' (igual que _decode_txt)."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for chunk in _iter_chunks(f):
+            decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8"
+
+
+def _iter_txt_blocks(f, encoding: str) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore" if encoding == "latin-1" else "strict")
+    pending = ""
+    for chunk in _iter_chunks(f):
+        parts = _BLANK_LINE_RE.split(pending + decoder.decode(chunk))
+        # La última parte puede seguir en el bloque siguiente
+        pending = parts.pop()
+        yield from parts
+    yield pending + decoder.decode(b"", final=True)
+
+
+def iter_txt_sections(source: Source, section_chars: int = TXT_SECTION_CHARS) -> Iterator[Dict]:
+    """Generador perezoso de secciones de texto plano (cortes en líneas en blanco)."""
+    with _open_binary(source) as f:
+        start = f.tell()
+        encoding = _txt_encoding(f)
+        f.seek(start)
+        blocks = (b.strip() for b in _iter_txt_blocks(f, encoding))
+        yield from _group_sections((b for b in blocks if b), section_chars)
+
+
+def extract_text_from_txt(source: Source) -> str:
     """
     Extrae texto de archivos planos .txt codificados como UTF-8.
     """
-    if not isinstance(file_bytes, bytes):
-        file_bytes = file_bytes.read()
+    return _decode_txt(source)
 
-    try:
-        text = file_bytes.decode("utf-8")
-    except UnicodeDecodeError:
-        text = file_bytes.decode("latin-1", errors="ignore")
 
-    # Debug en logs de Render
-    print(f"DEBUG · TXT length={len(text)} preview={text[:200]!r}")
+# 4) Despachador por extensión para el pipeline
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
 
-    return text
 
+def iter_document_pages(filename: str, source: Source, pdf_engine: Optional[str] = None) -> Optional[Iterator[Dict]]:
+    """Devuelve el generador de páginas/secciones según la extensión, o None si no está soportada."""
+    if filename.endswith(".pdf"):
+        return iter_pdf_pages(source, engine=pdf_engine)
+    if filename.endswith(".docx"):
+        return iter_docx_sections(source)
+    if filename.endswith(".txt"):
+        return iter_txt_sections(source)
+    return None
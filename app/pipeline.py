@@ -0,0 +1,476 @@
+# app/pipeline.py
+import os
+import copy
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from app.parsers import iter_document_pages, PDF_ENGINE, PDF_ENGINE_CHOICES, SUPPORTED_EXTENSIONS
+from app.parse_pool import parse_pool
+from app.risk_engine import (
+    agenerate_risks,
+    agenerate_risks_chunked,
+    arank_candidates,
+    atranslate_risks,
+    format_pages,
+    take_pages_within_budget,
+    MODEL_NAME,
+    PROMPT_VERSION,
+    MAX_PROMPT_CHARS,
+    RISK_LISTS,
+    LANGUAGE_NAMES,
+)
+from app.ranking import select_passages
+from app.cache import result_cache, file_digest, make_key
+from app.evidence import EvidenceIndex, verify_risks, EVIDENCE_CHECK
+from app.fingerprints import (
+    fingerprint_index,
+    fingerprint_pages,
+    plan_reuse,
+    incremental_candidates,
+    INCREMENTAL_ENABLED,
+)
+from app.risk_library import risk_library, library_record, RISK_LIBRARY_ENABLED
+from app.uploads import memory_snapshot, memory_usage
+from app.metrics import stage, begin_request, current_request, CACHE_LOOKUPS, ANALYSES, DOCUMENT_PAGES, TRANSLATIONS
+from app.singleflight import SingleFlight
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Pipeline de análisis compartido por /analyze, /analyze/stream y los jobs:
+#  caché → extracción → huellas (revisiones) → LLM → verificación de citas
+#  → metadatos _debug → biblioteca de riesgos.
+# ─────────────────────────────────────────────────────────────────────────────
+
+logger = logging.getLogger("uvicorn.error")
+
+# Análisis en vuelo por clave de caché (ver app/singleflight.py)
+analysis_flights = SingleFlight()
+
+MODES = {"auto", "single", "chunked"}
+
+# Modo single: "ranked" elige los pasajes más relevantes de las primeras
+# RANK_SCAN_CHARS; "head" manda el principio del documento (comportamiento previo)
+PASSAGE_SELECTION = os.getenv("PASSAGE_SELECTION", "ranked").strip().lower()
+RANK_SCAN_CHARS = int(os.getenv("RANK_SCAN_CHARS", str(MAX_PROMPT_CHARS * 4)))
+
+# Otro idioma del mismo análisis: traducir el resultado cacheado en lugar de re-analizar
+TRANSLATE_CACHED = os.getenv("TRANSLATE_CACHED", "1") != "0"
+LANGS = tuple(LANGUAGE_NAMES)
+
+
+class AnalysisError(Exception):
+    """Error de entrada con código y status HTTP propios (400/422/...). No se reintenta."""
+
+    def __init__(self, error_code: str, message: str, status_code: int):
+        super().__init__(message)
+        self.error_code = error_code
+        self.message = message
+        self.status_code = status_code
+
+    def to_dict(self) -> dict:
+        return {"error_code": self.error_code, "message": self.message}
+
+
+def normalize_mode(mode: str) -> str:
+    mode_norm = (mode or "auto").strip().lower()
+    if mode_norm not in MODES:
+        raise AnalysisError("invalid_mode", "Modo no soportado (usa auto, single o chunked)", 400)
+    return mode_norm
+
+
+def normalize_lang(lang: str) -> str:
+    lang_norm = (lang or "es").strip().lower()
+    if lang_norm not in LANGS:
+        raise AnalysisError("invalid_lang", f"Idioma no soportado (usa {', '.join(LANGS)})", 400)
+    return lang_norm
+
+
+def analysis_keys(file_sha256: str, context: str, lang: str, **options):
+    """
+    (clave del análisis, clave por idioma). La primera no depende del idioma:
+    bajo ella se guarda el último análisis completo del documento, del que
+    salen las traducciones; la segunda es la entrada de caché de cada idioma.
+    """
+    analysis_key = make_key(file_sha256, context, "", MODEL_NAME, PROMPT_VERSION, **options)
+    return analysis_key, lang_key(analysis_key, lang)
+
+
+def lang_key(analysis_key: str, lang: str) -> str:
+    return make_key(analysis_key, "", lang, MODEL_NAME, PROMPT_VERSION)
+
+
+def normalize_pdf_engine(pdf_engine: Optional[str]) -> str:
+    engine = (pdf_engine or PDF_ENGINE).strip().lower()
+    if engine not in PDF_ENGINE_CHOICES:
+        raise AnalysisError(
+            "invalid_pdf_engine",
+            f"Motor PDF no soportado (usa {', '.join(PDF_ENGINE_CHOICES)})",
+            400,
+        )
+    return engine
+
+
+def _collect_pages(filename: str, source, mode: str, pdf_engine: Optional[str], ranked: bool):
+    """
+    Extracción propiamente dicha (CPU-bound): se ejecuta en un worker del
+    parse_pool, así que solo recibe y devuelve datos serializables.
+    Devuelve (páginas, presupuesto_lleno).
+    """
+    pages_iter = iter_document_pages(filename, source, pdf_engine=pdf_engine)
+    try:
+        if mode == "chunked":
+            return list(pages_iter), False
+        if ranked:
+            return take_pages_within_budget(pages_iter, RANK_SCAN_CHARS)
+        text_per_page, budget_full = take_pages_within_budget(pages_iter, MAX_PROMPT_CHARS)
+        if budget_full and mode == "auto":
+            text_per_page.extend(pages_iter)
+        return text_per_page, budget_full
+    finally:
+        pages_iter.close()
+
+
+def check_format(filename: str) -> None:
+    if not filename.endswith(SUPPORTED_EXTENSIONS):
+        raise AnalysisError("unsupported_format", "Formato no soportado (usa .txt, .pdf o .docx)", 400)
+
+
+def _document_info(text_per_page, budget_full: bool, mode: str):
+    # Validación mínima para detectar parser vacío
+    if not text_per_page or len("".join(p["text"] for p in text_per_page)) < 100:
+        raise AnalysisError(
+            "empty_or_too_short",
+            "El archivo se leyó vacío o muy corto. Revisa el parser o prueba otro archivo.",
+            422,
+        )
+    DOCUMENT_PAGES.observe(len(text_per_page))
+    info = {"pages_read": len(text_per_page), "stopped_early": budget_full and mode == "single"}
+    engines = Counter(p["engine"] for p in text_per_page if "engine" in p)
+    if engines:
+        info["engines"] = dict(engines)
+    return text_per_page, info
+
+
+def read_document(filename: str, source, mode: str = "auto", pdf_engine: Optional[str] = None):
+    """
+    Detecta tipo por extensión y devuelve (páginas, info) tal como salen del parser.
+    La extracción es perezosa: en modo single se deja de leer en cuanto se
+    llena el presupuesto del prompt (o RANK_SCAN_CHARS si se seleccionan
+    pasajes por relevancia con `context`); en auto solo se sigue leyendo si el
+    documento no cabe (y entonces irá por ventanas); chunked lo lee entero.
+    Extrae en el proceso actual; desde el event loop usar aread_document.
+    """
+    check_format(filename)
+    ranked = mode == "single" and PASSAGE_SELECTION == "ranked"
+    try:
+        text_per_page, budget_full = _collect_pages(filename, source, mode, pdf_engine, ranked)
+    except ValueError as e:
+        # Archivo con la extensión correcta pero ilegible (p. ej. un .docx que no es un zip)
+        raise AnalysisError("unreadable_document", str(e), 422)
+    return _document_info(text_per_page, budget_full, mode)
+
+
+def _source_size(source) -> Optional[int]:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            return os.path.getsize(source)
+        except OSError:
+            return None
+    return None
+
+
+async def aread_document(filename: str, source, mode: str = "auto", pdf_engine: Optional[str] = None):
+    """
+    Igual que read_document pero la extracción va al parse_pool y el event
+    loop sigue atendiendo otras peticiones (los documentos pequeños se
+    extraen aquí mismo). Con la cola llena lanza ParserBusy.
+    """
+    check_format(filename)
+    ranked = mode == "single" and PASSAGE_SELECTION == "ranked"
+    try:
+        # El coste de un PDF no sigue a su tamaño (layout, páginas dudosas): siempre al pool
+        size = None if filename.endswith(".pdf") else _source_size(source)
+        text_per_page, budget_full = await parse_pool.run(
+            _collect_pages, filename, source, mode, pdf_engine, ranked, size=size)
+    except ValueError as e:
+        raise AnalysisError("unreadable_document", str(e), 422)
+    return _document_info(text_per_page, budget_full, mode)
+
+
+def prompt_pages(pages, mode: str, context: str, info: dict):
+    """Páginas que irán al prompt (pasajes por relevancia en single/ranked) y su texto unido."""
+    if mode == "single" and PASSAGE_SELECTION == "ranked":
+        with stage("select"):
+            pages, selection = select_passages(pages, context, MAX_PROMPT_CHARS)
+        info.update(selection)
+    return pages, format_pages(pages)
+
+
+def _stored_risk(risk: dict) -> dict:
+    # Para el índice de huellas: la página ya corregida, sin los campos por petición
+    return {k: v for k, v in risk.items() if k not in ("origin", "evidence_match", "page_reported")}
+
+
+def cached_result(cache_key: str, no_cache: bool, invalidate: bool):
+    """Devuelve (resultado_cacheado | None, cache_status)."""
+    if no_cache:
+        CACHE_LOOKUPS.inc(result="bypass")
+        return None, "bypass"
+    if invalidate:
+        result_cache.invalidate(cache_key)
+        CACHE_LOOKUPS.inc(result="invalidated")
+        return None, "invalidated"
+    with stage("cache"):
+        cached, level = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"[analyze] cache hit ({level}) key={cache_key[:12]}")
+        CACHE_LOOKUPS.inc(result=f"hit_{level}")
+        return copy.deepcopy(cached), f"hit_{level}"
+    CACHE_LOOKUPS.inc(result="miss")
+    return None, "miss"
+
+
+# Campos de _debug que describen la petición y no el análisis
+_REQUEST_DEBUG_KEYS = ("cache", "cache_key", "coalesced", "timings", "memory", "upload_bytes")
+
+
+async def _translate(source: dict, analysis_key: str, lang: str, report: Callable[..., None]) -> dict:
+    source_lang = source["_debug"].get("lang")
+    report("translating", source_lang=source_lang)
+    t0 = time.perf_counter()
+    with stage("translate"):
+        translated = await atranslate_risks(source, lang)
+    report("translated", seconds=round(time.perf_counter() - t0, 3))
+    TRANSLATIONS.inc(lang=lang)
+
+    missing = translated.pop("_translation_missing", 0)
+    result = {k: v for k, v in source.items() if k != "_debug"}
+    result.update(translated)
+    result["_debug"] = {
+        **{k: v for k, v in source["_debug"].items() if k not in _REQUEST_DEBUG_KEYS},
+        "lang": lang,
+        "translated_from": source_lang,
+    }
+    if missing:
+        # Con riesgos sin traducir no se cachea: la próxima petición lo reintenta
+        result["_debug"]["translation_missing"] = missing
+    else:
+        result_cache.set(lang_key(analysis_key, lang), result)
+        if RISK_LIBRARY_ENABLED:
+            risk_library.submit(library_record(lang_key(analysis_key, lang), analysis_key, result))
+    return result
+
+
+async def translate_cached(analysis_key: str, lang: str, report: Optional[Callable[..., None]] = None) -> Optional[dict]:
+    """Traducción del análisis cacheado en otro idioma, o None si no hay ninguno."""
+    if not TRANSLATE_CACHED:
+        return None
+    with stage("cache"):
+        source, _ = result_cache.get(analysis_key)
+    if source is None or source.get("_debug", {}).get("lang") == lang:
+        return None
+    return await _translate(source, analysis_key, lang, report or (lambda stage, **info: None))
+
+
+async def translate_analysis(analysis_key: str, lang: str) -> dict:
+    """
+    POST /translate: el análisis `analysis_key` (ver _debug.analysis_key) en
+    otro idioma. Sale de la caché por idioma o se traduce del análisis guardado.
+    """
+    request_metrics = current_request() or begin_request()
+    lang_norm = normalize_lang(lang)
+    target_key = lang_key(analysis_key, lang_norm)
+
+    result, cache_status = cached_result(target_key, False, False)
+    coalesced = False
+    if result is None:
+        with stage("cache"):
+            source, _ = result_cache.get(analysis_key)
+        if source is None:
+            raise AnalysisError("analysis_not_found", "No hay ningún análisis guardado con esa clave", 404)
+        if source.get("_debug", {}).get("lang") == lang_norm:
+            result, cache_status = copy.deepcopy(source), "source"
+        else:
+            # Comparte vuelo con un /analyze simultáneo del mismo documento e idioma
+            result, coalesced = await analysis_flights.do(
+                target_key, lambda: _translate(source, analysis_key, lang_norm, lambda stage, **info: None))
+            result = copy.deepcopy(result)
+
+    result["_debug"] = {
+        **result.get("_debug", {}),
+        "cache": cache_status,
+        "cache_key": target_key,
+        "analysis_key": analysis_key,
+        "coalesced": coalesced,
+        "timings": request_metrics.summary(),
+    }
+    return result
+
+
+async def run_analysis(
+    source,
+    filename: str,
+    context: str = "",
+    lang: str = "es",
+    mode: str = "auto",
+    no_cache: bool = False,
+    invalidate: bool = False,
+    progress: Optional[Callable[..., None]] = None,
+    file_sha256: Optional[str] = None,
+    pdf_engine: Optional[str] = None,
+) -> dict:
+    """
+    Ejecuta el análisis completo y devuelve el resultado con _debug.
+    `source` es la ruta del archivo subido (o sus bytes); si ya se conoce su
+    SHA-256 (calculado al recibirlo) se pasa en file_sha256 para no releerlo.
+    `progress(stage, **info)` se invoca al empezar/terminar cada etapa
+    (lo usan los jobs en segundo plano para informar del avance).
+    `pdf_engine` elige el motor de extracción PDF (auto, pypdf, pdfplumber).
+    """
+    report = progress or (lambda stage, **info: None)
+    request_metrics = current_request() or begin_request()
+    filename = (filename or "").lower()
+
+    # 🔹 Formato e idioma se validan antes de calcular la clave de caché: una
+    # entrada inválida no debe salir de la caché ni de una traducción
+    check_format(filename)
+    lang_norm = normalize_lang(lang)
+    mode_norm = normalize_mode(mode)
+    engine_norm = normalize_pdf_engine(pdf_engine)
+    file_sha256 = file_sha256 or file_digest(source)
+    options = dict(mode=mode_norm, selection=PASSAGE_SELECTION, pdf_engine=engine_norm)
+    analysis_key, cache_key = analysis_keys(file_sha256, context, lang_norm, **options)
+    # Misma clave sin el archivo: agrupa las revisiones comparables en el índice de huellas
+    variant_key = make_key("", context, lang_norm, MODEL_NAME, PROMPT_VERSION, **options)
+
+    result, cache_status = cached_result(cache_key, no_cache, invalidate)
+    if result is not None:
+        result["_debug"] = {
+            **result.get("_debug", {}),
+            "filename": filename,
+            "lang": lang_norm,
+            "cache": cache_status,
+            "cache_key": cache_key,
+            "analysis_key": analysis_key,
+            "timings": request_metrics.summary(),
+        }
+        report("done", cache=cache_status)
+        return result
+
+    async def compute() -> dict:
+        # Mismo documento ya analizado en otro idioma: basta con traducir los riesgos
+        if cache_status == "miss":
+            translated = await translate_cached(analysis_key, lang_norm, report)
+            if translated is not None:
+                return translated
+
+        mem_start = memory_snapshot()
+        t0 = time.perf_counter()
+        report("extracting")
+        with stage("extract"):
+            raw_pages, extract_info = await aread_document(filename, source, mode_norm, engine_norm)
+
+        # Revisión de un documento ya analizado: solo se analizan las páginas cambiadas
+        fingerprints = base = reused = None
+        changed = pages_to_analyze = raw_pages
+        if INCREMENTAL_ENABLED and cache_status != "bypass":
+            # SimHash y emparejamiento son CPU + SQLite: fuera del event loop
+            with stage("fingerprint"):
+                fingerprints = await asyncio.to_thread(fingerprint_pages, raw_pages)
+                base = await asyncio.to_thread(fingerprint_index.closest, variant_key, file_sha256, fingerprints)
+            if base is not None:
+                reused, changed = plan_reuse(base, raw_pages, RISK_LISTS)
+                pages_to_analyze = changed or raw_pages
+                report("incremental", base=base["filename"], pages_changed=len(changed))
+
+        with stage("extract"):
+            text_per_page, joined_text = prompt_pages(pages_to_analyze, mode_norm, context, extract_info)
+        report("extracted", pages=len(raw_pages), chars=len(joined_text),
+               seconds=round(time.perf_counter() - t0, 3))
+
+        logger.info(f"[analyze] incoming lang={lang!r} -> norm={lang_norm}")
+
+        # Generar riesgos con GPT (por ventanas si el documento no cabe en una llamada)
+        use_chunks = mode_norm == "chunked" or (mode_norm == "auto" and len(joined_text) > MAX_PROMPT_CHARS)
+        if reused is not None and not changed and all(len(reused[name]) >= 5 for name in RISK_LISTS):
+            # Ninguna página nueva o editada y los riesgos previos siguen respaldados
+            result = {"source": "openai", "_chunks": 0}
+        else:
+            t1 = time.perf_counter()
+            report("analyzing", mode="chunked" if use_chunks else "single")
+            # "analyze" es el tiempo de pared; "llm" suma las llamadas (concurrentes en chunked)
+            with stage("analyze"):
+                if use_chunks:
+                    result = await agenerate_risks_chunked(text_per_page, context=context, lang=lang_norm)
+                else:
+                    result = await agenerate_risks(joined_text, context=context, lang=lang_norm)
+            report("analyzed", seconds=round(time.perf_counter() - t1, 3))
+        if reused is not None:
+            # Los riesgos de las páginas cambiadas compiten con los reutilizados
+            # (misma llamada de ranking que el modo chunked), no solo rellenan huecos
+            with stage("analyze"):
+                result.update(await arank_candidates(incremental_candidates(reused, result, RISK_LISTS), context))
+            extract_info["incremental"] = {
+                "base_file_sha256": base["file_sha256"],
+                "base_filename": base["filename"],
+                "page_overlap": round(base["overlap"], 3),
+                "pages_changed": [p["page"] for p in changed],
+                "risks_reused": sum(r.get("origin") == "reused" for name in RISK_LISTS for r in result[name]),
+                "risks_new": sum(r.get("origin") == "new" for name in RISK_LISTS for r in result[name]),
+            }
+
+        # Citas contra el texto extraído: corrige page y añade evidence_match
+        if EVIDENCE_CHECK:
+            with stage("verify"):
+                extract_info["evidence"] = verify_risks(EvidenceIndex(raw_pages), result, RISK_LISTS)
+
+        # Añadir metadatos internos para debugging (visible en la UI si lo muestras)
+        result["_debug"] = {
+            "filename": filename,
+            "file_sha256": file_sha256,
+            "chars": len(joined_text),
+            "lang": lang_norm,
+            "mode": "chunked" if use_chunks else "single",
+            "chunks": result.pop("_chunks", 1),
+            **({"repair": result.pop("_repair")} if "_repair" in result else {}),
+            **extract_info,
+        }
+        # Un resultado incompleto (faltan riesgos tras el re-ask) no se cachea
+        if cache_status != "bypass" and "missing" not in result["_debug"].get("repair", {}):
+            result_cache.set(cache_key, result)
+            result_cache.set(analysis_key, result)
+            if fingerprints is not None:
+                await asyncio.to_thread(fingerprint_index.add, variant_key, file_sha256, filename, fingerprints,
+                                        {name: [_stored_risk(r) for r in result[name]] for name in RISK_LISTS})
+            if RISK_LIBRARY_ENABLED:
+                # Solo encola: el escritor de la biblioteca vuelca por lotes fuera de la petición
+                risk_library.submit(library_record(cache_key, analysis_key, result, context))
+        result["_debug"]["memory"] = memory_usage(mem_start, memory_snapshot())
+        return result
+
+    # Peticiones simultáneas con la misma clave comparten una sola ejecución
+    # (no_cache pide explícitamente un cálculo propio)
+    if no_cache:
+        result, coalesced = await compute(), False
+    else:
+        if analysis_flights.in_flight(cache_key):
+            report("coalesced")
+        result, coalesced = await analysis_flights.do(cache_key, compute)
+        result = copy.deepcopy(result)
+    ANALYSES.inc(role="follower" if coalesced else "leader")
+
+    result["_debug"] = {
+        **result["_debug"],
+        "filename": filename,
+        "cache": cache_status,
+        "cache_key": cache_key,
+        "analysis_key": analysis_key,
+        "coalesced": coalesced,
+        "timings": request_metrics.summary(),
+    }
+    report("done", cache=cache_status)
+    return result
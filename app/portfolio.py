@@ -0,0 +1,362 @@
+# app/portfolio.py
+import os
+import re
+import glob
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from app.metrics import registry
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Cartera de análisis en columnas (NumPy) para GET /portfolio/stats:
+#  recuentos por tema y tipo, por idioma, densidad de riesgos por página y
+#  contramedidas recurrentes sobre todos los análisis guardados.
+#   - Cada riesgo es una fila de enteros (análisis, tipo, tema, página, hash
+#     de la contramedida); cada análisis guarda documento, idioma, páginas y
+#     fecha. Los agregados son bincount/unique sobre esos arrays.
+#   - Se alimenta del escritor por lotes de la biblioteca de riesgos: cada
+#     lote es un segmento .npz nuevo en PORTFOLIO_DIR (append, no se reescribe
+#     lo anterior). Con más de PORTFOLIO_MAX_SEGMENTS se compactan en uno.
+#   - Un análisis repetido (misma clave de caché) sustituye al anterior; las
+#     traducciones no cuentan (serían los mismos riesgos otra vez).
+#   - El tema se asigna al guardar, por raíces de palabra en de/en/es.
+#   - numpy se importa dentro de cada función: app.main lo carga a través de
+#     la biblioteca de riesgos y el arranque no debe pagarlo.
+# ─────────────────────────────────────────────────────────────────────────────
+
+logger = logging.getLogger("uvicorn.error")
+
+PORTFOLIO_ENABLED = os.getenv("PORTFOLIO_ENABLED", "1") != "0"
+PORTFOLIO_DIR = os.getenv("PORTFOLIO_DIR", os.path.join(".data", "portfolio"))
+PORTFOLIO_MAX_SEGMENTS = int(os.getenv("PORTFOLIO_MAX_SEGMENTS", "64"))
+PORTFOLIO_MAX_TOP = 200
+
+KINDS = ("intuitive", "counterintuitive")
+
+# Tema → raíces que lo delatan en el título o la justificación (primera coincidencia gana)
+THEMES = (
+    ("permits", ("genehmig", "planfeststell", "baurecht", "permit", "approval", "licens",
+                 "permiso", "autoriza", "aprobaci", "licencia")),
+    ("schedule", ("frist", "termin", "bauzeit", "verzug", "verzöger", "schedule", "delay", "deadline",
+                  "plazo", "retraso", "cronograma")),
+    ("cost", ("kosten", "budget", "nachtrag", "preis", "cost", "claim", "price", "coste", "costo",
+              "presupuesto", "sobrecoste")),
+    ("contract", ("vertrag", "vergabe", "haftung", "vertragsstrafe", "contract", "procurement", "penalty",
+                  "liabilit", "contrato", "licitaci", "penalizaci")),
+    ("interfaces", ("schnittstell", "etcs", "stellwerk", "signal", "interface", "interlocking", "integration",
+                    "interfaz", "enclavamiento", "integraci")),
+    ("ground", ("baugrund", "geotech", "boden", "tunnel", "soil", "ground", "geotécn", "suelo", "túnel")),
+    ("environment", ("umwelt", "lärm", "natur", "artenschutz", "environment", "noise", "ecolog",
+                     "ambiental", "ruido")),
+    ("operations", ("betrieb", "sperrpause", "inbetriebnahme", "possession", "operation", "commissioning",
+                    "explotaci", "puesta en servicio", "corte de vía")),
+    ("stakeholders", ("anwohner", "bürger", "öffentlichkeit", "stakeholder", "resident", "public",
+                      "vecino", "ciudadan", "expropia")),
+    ("safety", ("sicherheit", "unfall", "safety", "accident", "seguridad", "accidente")),
+)
+THEME_NAMES = tuple(name for name, _ in THEMES) + ("other",)
+_OTHER = len(THEMES)
+# Las raíces cuentan solo al principio de una palabra: "termin" no es "determine"
+# ni "ground" es "background". Una palabra compuesta cuenta por su primer elemento.
+_THEME_RES = tuple(re.compile(r"\b(?:" + "|".join(map(re.escape, stems)) + ")") for _, stems in THEMES)
+
+_NORM_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+PORTFOLIO_ANALYSES = registry.counter("portfolio_analyses_total", "Análisis añadidos a la cartera.", ("result",))
+
+
+def risk_theme(risk: Dict) -> int:
+    text = f"{risk.get('risk') or ''} {risk.get('justification') or ''}".lower()
+    for i, pattern in enumerate(_THEME_RES):
+        if pattern.search(text):
+            return i
+    return _OTHER
+
+
+def _countermeasure(text) -> tuple:
+    """(hash uint64, texto normalizado) de una contramedida; hash 0 = vacía."""
+    norm = _NORM_RE.sub(" ", str(text or "").lower()).strip()
+    if not norm:
+        return 0, ""
+    return int.from_bytes(hashlib.blake2b(norm.encode("utf-8"), digest_size=8).digest(), "little") or 1, norm
+
+
+def _segment(records: List[Dict]) -> Dict[str, "np.ndarray"]:
+    """Columnas de un lote de library_record (un segmento)."""
+    import numpy as np
+
+    a_key, a_file, a_filename, a_lang, a_created, a_pages = [], [], [], [], [], []
+    r_analysis, r_kind, r_theme, r_page, r_cm = [], [], [], [], []
+    cm_text: Dict[int, str] = {}
+    for record in records:
+        idx = len(a_key)
+        a_key.append(record["cache_key"])
+        a_file.append(record.get("file_sha256") or "")
+        a_filename.append(record.get("filename") or "")
+        a_lang.append(record.get("lang") or "")
+        a_created.append(record["created_at"])
+        a_pages.append(record.get("pages") or 0)
+        for kind, name in enumerate(f"{k}_risks" for k in KINDS):
+            for risk in record["risks"].get(name, []):
+                h, norm = _countermeasure(risk.get("countermeasure"))
+                if h:
+                    cm_text.setdefault(h, norm)
+                page = risk.get("page")
+                r_analysis.append(idx)
+                r_kind.append(kind)
+                r_theme.append(risk_theme(risk))
+                r_page.append(page if isinstance(page, int) and page > 0 else 0)
+                r_cm.append(h)
+    return {
+        "a_key": np.array(a_key, dtype=str),
+        "a_file": np.array(a_file, dtype=str),
+        "a_filename": np.array(a_filename, dtype=str),
+        "a_lang": np.array(a_lang, dtype=str),
+        "a_created": np.array(a_created, dtype=np.float64),
+        "a_pages": np.array(a_pages, dtype=np.int32),
+        "r_analysis": np.array(r_analysis, dtype=np.int64),
+        "r_kind": np.array(r_kind, dtype=np.int8),
+        "r_theme": np.array(r_theme, dtype=np.int8),
+        "r_page": np.array(r_page, dtype=np.int32),
+        "r_cm": np.array(r_cm, dtype=np.uint64),
+        "cm_hash": np.fromiter(cm_text.keys(), dtype=np.uint64, count=len(cm_text)),
+        "cm_text": np.array(list(cm_text.values()), dtype=str),
+    }
+
+
+def _concat(segments: List[Dict[str, "np.ndarray"]]) -> Dict[str, "np.ndarray"]:
+    """Une segmentos: los índices de análisis de cada uno se desplazan."""
+    import numpy as np
+
+    offsets = np.cumsum([0] + [len(s["a_key"]) for s in segments[:-1]])
+    merged = {
+        name: np.concatenate([s[name] for s in segments])
+        for name in segments[0] if name != "r_analysis"
+    }
+    merged["r_analysis"] = np.concatenate([s["r_analysis"] + off for s, off in zip(segments, offsets)])
+    return merged
+
+
+def _percentiles(values: "np.ndarray") -> Dict[str, Optional[float]]:
+    import numpy as np
+
+    if not len(values):
+        return {"mean": None, "p50": None, "p90": None}
+    p50, p90 = np.percentile(values, (50, 90))
+    return {"mean": round(float(values.mean()), 3), "p50": round(float(p50), 3), "p90": round(float(p90), 3)}
+
+
+class PortfolioStore:
+    """Segmentos .npz en un directorio; en memoria, un único juego de columnas."""
+
+    def __init__(self, path: str = PORTFOLIO_DIR, max_segments: int = PORTFOLIO_MAX_SEGMENTS):
+        self.path = path
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._segments: Optional[List[Dict[str, "np.ndarray"]]] = None
+        self._files: List[str] = []
+        self._columns: Optional[Dict[str, "np.ndarray"]] = None
+
+    # ── almacenamiento ───────────────────────────────────────────────────────
+    def _load(self) -> List[Dict[str, "np.ndarray"]]:
+        import numpy as np
+
+        if self._segments is None:
+            self._files = sorted(glob.glob(os.path.join(self.path, "seg-*.npz")))
+            segments = []
+            for f in self._files:
+                with np.load(f, allow_pickle=False) as data:
+                    segments.append({name: data[name] for name in data.files})
+            self._segments = segments
+        return self._segments
+
+    def _save(self, columns: Dict[str, "np.ndarray"]) -> str:
+        import numpy as np
+
+        os.makedirs(self.path, exist_ok=True)
+        seq = int(os.path.basename(self._files[-1])[4:12]) + 1 if self._files else 0
+        final = os.path.join(self.path, f"seg-{seq:08d}.npz")
+        tmp = os.path.join(self.path, f".tmp-{seq:08d}.npz")  # fuera del glob de segmentos
+        np.savez(tmp, **columns)
+        os.replace(tmp, final)
+        self._files.append(final)
+        return final
+
+    def append(self, records: List[Dict]) -> int:
+        """Añade un lote de library_record como segmento nuevo. Lo llama el escritor de la biblioteca."""
+        records = [r for r in records if not r.get("translated_from")]
+        if not records:
+            return 0
+        segment = _segment(records)
+        with self._lock:
+            self._load()
+            self._save(segment)
+            self._segments.append(segment)
+            self._columns = None
+            if len(self._segments) > self.max_segments:
+                self._compact()
+        PORTFOLIO_ANALYSES.inc(len(records), result="appended")
+        return len(records)
+
+    def _compact(self) -> None:
+        # Un solo segmento con los análisis vigentes; los antiguos se borran después
+        columns = self._live(_concat(self._segments))
+        old = list(self._files)
+        self._save(columns)
+        for f in old:
+            os.remove(f)
+        self._files = self._files[-1:]
+        self._segments = [columns]
+        logger.info(f"[portfolio] {len(old)} segmentos compactados ({len(columns['a_key'])} análisis)")
+
+    @staticmethod
+    def _alive(a_key: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        # Vale la última aparición de cada clave de caché
+        _, first_in_reversed = np.unique(a_key[::-1], return_index=True)
+        alive = np.zeros(len(a_key), dtype=bool)
+        alive[len(a_key) - 1 - first_in_reversed] = True
+        return alive
+
+    def _live(self, columns: Dict[str, "np.ndarray"]) -> Dict[str, "np.ndarray"]:
+        import numpy as np
+
+        alive = self._alive(columns["a_key"])
+        new_index = np.cumsum(alive) - 1
+        keep = alive[columns["r_analysis"]]
+        live = {name: col[alive] for name, col in columns.items() if name.startswith("a_")}
+        live.update({name: col[keep] for name, col in columns.items() if name.startswith("r_")})
+        live["r_analysis"] = new_index[columns["r_analysis"][keep]]
+        _, first = np.unique(columns["cm_hash"], return_index=True)
+        live["cm_hash"], live["cm_text"] = columns["cm_hash"][first], columns["cm_text"][first]
+        return live
+
+    def columns(self) -> Optional[Dict[str, "np.ndarray"]]:
+        """Columnas vigentes (sin análisis sustituidos). Se recalculan solo tras un append."""
+        with self._lock:
+            if self._columns is None and self._load():
+                self._columns = self._derive(self._live(_concat(self._segments)))
+            return self._columns
+
+    @staticmethod
+    def _derive(c: Dict[str, "np.ndarray"]) -> Dict[str, "np.ndarray"]:
+        import numpy as np
+
+        # Códigos enteros de idioma, documento y contramedida: las ordenaciones
+        # de cadenas se hacen una vez por append, no en cada consulta
+        c["langs"], c["a_lang_code"] = np.unique(c["a_lang"], return_inverse=True)
+        c["files"], c["file_first"], c["a_file_code"] = np.unique(c["a_file"], return_index=True,
+                                                                  return_inverse=True)
+        c["r_cm_code"] = np.searchsorted(c["cm_hash"], c["r_cm"])  # cm_hash ya viene ordenado
+        return c
+
+    # ── agregados ────────────────────────────────────────────────────────────
+    def stats(self, lang: Optional[str] = None, kind: Optional[str] = None, since: Optional[float] = None,
+              top: int = 20) -> Dict:
+        import numpy as np
+
+        top = max(1, min(PORTFOLIO_MAX_TOP, top))
+        c = self.columns()
+        if c is None:
+            c = self._derive(self._live(_segment([])))
+
+        a_mask = np.ones(len(c["a_key"]), dtype=bool)
+        if lang:
+            a_mask &= c["a_lang"] == lang
+        if since is not None:
+            a_mask &= c["a_created"] >= since
+        r_mask = a_mask[c["r_analysis"]]
+        if kind:
+            r_mask &= c["r_kind"] == KINDS.index(kind)
+        r_analysis = c["r_analysis"][r_mask]
+        r_kind = c["r_kind"][r_mask].astype(np.int64)
+        r_theme = c["r_theme"][r_mask].astype(np.int64)
+        n_themes = len(THEME_NAMES)
+
+        # Temas × tipo
+        theme_kind = np.bincount(r_theme * 2 + r_kind, minlength=n_themes * 2).reshape(n_themes, 2)
+        by_theme = {
+            name: {"total": int(row.sum()), **{k: int(v) for k, v in zip(KINDS, row)}}
+            for name, row in zip(THEME_NAMES, theme_kind)
+        }
+
+        # Idiomas × tema
+        langs, lang_of_analysis = c["langs"], c["a_lang_code"]
+        analyses_per_lang = np.bincount(lang_of_analysis[a_mask], minlength=len(langs))
+        lang_theme = np.bincount(lang_of_analysis[r_analysis] * n_themes + r_theme,
+                                 minlength=len(langs) * n_themes).reshape(len(langs), n_themes)
+        by_lang = {
+            str(code): {
+                "analyses": int(analyses_per_lang[i]),
+                "risks": int(lang_theme[i].sum()),
+                "themes": {name: int(v) for name, v in zip(THEME_NAMES, lang_theme[i]) if v},
+            }
+            for i, code in enumerate(langs) if analyses_per_lang[i]
+        }
+
+        # Densidad: riesgos por página leída y dónde caen en el documento (deciles)
+        risks_per_analysis = np.bincount(r_analysis, minlength=len(a_mask))[a_mask]
+        pages = c["a_pages"][a_mask]
+        known = pages > 0
+        r_pages = c["a_pages"][r_analysis]
+        r_page = c["r_page"][r_mask]
+        located = (r_page > 0) & (r_pages > 0)
+        position = np.minimum((r_page[located] - 1) / r_pages[located], 0.999)
+        deciles = np.bincount((position * 10).astype(np.int64), minlength=10)
+        page_density = {
+            "risks_per_analysis": _percentiles(risks_per_analysis),
+            "risks_per_page": _percentiles(risks_per_analysis[known] / pages[known]),
+            "position_deciles": [int(v) for v in deciles],
+            "without_page": int((r_page == 0).sum()),
+        }
+
+        # Contramedidas recurrentes (mismo texto normalizado en varios riesgos)
+        files, first_analysis, file_of_analysis = c["files"], c["file_first"], c["a_file_code"]
+        with_cm = c["r_cm"][r_mask] != 0
+        cm_code = c["r_cm_code"][r_mask][with_cm]
+        n_cm, n_files = len(c["cm_hash"]), max(1, len(files))
+        counts = np.bincount(cm_code, minlength=n_cm)
+        # Documentos distintos por contramedida: pares (contramedida, documento) únicos
+        pairs = np.unique(cm_code * n_files + file_of_analysis[r_analysis[with_cm]])
+        docs_per_cm = np.bincount(pairs // n_files, minlength=n_cm)
+        recurring = np.flatnonzero(counts > 1)
+        order = recurring[np.argsort(-counts[recurring], kind="stable")][:top]
+        countermeasures = [
+            {"countermeasure": str(c["cm_text"][i]), "risks": int(counts[i]), "documents": int(docs_per_cm[i])}
+            for i in order
+        ]
+
+        # Mapa de calor documentos × temas (los `top` documentos con más riesgos)
+        doc_theme = np.bincount(file_of_analysis[r_analysis] * n_themes + r_theme,
+                                minlength=len(files) * n_themes).reshape(len(files), n_themes)
+        totals = doc_theme.sum(axis=1)
+        docs = np.argsort(-totals, kind="stable")[:top]
+        docs = docs[totals[docs] > 0]
+        heatmap = {
+            "themes": list(THEME_NAMES),
+            "documents": [
+                {"file_sha256": str(files[d]), "filename": str(c["a_filename"][first_analysis[d]]),
+                 "risks": int(totals[d]), "counts": [int(v) for v in doc_theme[d]]}
+                for d in docs
+            ],
+        }
+
+        return {
+            "analyses": int(a_mask.sum()),
+            "documents": int(np.count_nonzero(np.bincount(file_of_analysis[a_mask], minlength=len(files)))),
+            "risks": int(r_mask.sum()),
+            "by_theme": by_theme,
+            "by_lang": by_lang,
+            "page_density": page_density,
+            "countermeasures": countermeasures,
+            "heatmap": heatmap,
+        }
+
+
+portfolio = PortfolioStore()
@@ -0,0 +1,168 @@
+# app/ranking.py
+import os
+import re
+from typing import List, Dict, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Selección de pasajes por relevancia para el modo single:
+#   En lugar de mandar los primeros MAX_PROMPT_CHARS caracteres, cada página se
+#   parte en pasajes (~PASSAGE_CHARS), se puntúan con BM25 contra un
+#   vocabulario de riesgos ferroviarios (de/en/es) más el `context` del
+#   usuario, y se empaquetan los mejores hasta llenar el presupuesto. Los
+#   pasajes elegidos se devuelven en orden de documento y conservan su número
+#   de página, así [Página n] y las citas siguen siendo trazables.
+#  La matriz término-pasaje se limita a los términos de la consulta (unas
+#  pocas centenas de columnas) y se puntúa vectorizada con NumPy.
+# ─────────────────────────────────────────────────────────────────────────────
+
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "1200"))
+RANK_CONTEXT_WEIGHT = float(os.getenv("RANK_CONTEXT_WEIGHT", "2.0"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Prefijo con el que se comparan los términos: hace de stemming ligero y
+# captura compuestos alemanes (Baugrundgutachten → "baugru").
+STEM_CHARS = 6
+
+RISK_VOCABULARY = (
+    # de
+    "Risiko Gefahr Frist Termin Verzug Verzögerung Bauzeit Sperrpause Vertragsstrafe Nachtrag "
+    "Mehrkosten Kosten Budget Genehmigung Planfeststellung Auflage Einwendung Klage Haftung "
+    "Gewährleistung Baugrund Altlasten Kampfmittel Grundwasser Lärmschutz Erschütterung "
+    "Umweltprüfung Artenschutz Schnittstelle Abhängigkeit Inbetriebnahme Abnahme Zulassung "
+    "Stellwerk Oberleitung ETCS Signaltechnik Leit Sicherungstechnik Vergabe Ausschreibung "
+    "Kapazität Engpass Lieferkette Mangel Störung Unfall Sicherheit Brandschutz Rettungsweg "
+    "Bahnbetrieb Betriebseinschränkung Ersatzverkehr Eigentum Grunderwerb Enteignung "
+    # en
+    "risk hazard deadline delay schedule possession penalty claim variation overrun cost "
+    "budget permit approval consent objection litigation liability warranty geotechnical "
+    "contamination groundwater noise vibration environmental interface dependency "
+    "commissioning acceptance certification interlocking catenary signalling procurement "
+    "tender capacity bottleneck supply shortage failure accident safety fire evacuation "
+    "disruption closure land acquisition expropriation "
+    # es
+    "riesgo peligro plazo retraso demora cronograma corte penalización reclamación "
+    "sobrecoste coste presupuesto permiso licencia aprobación alegación litigio "
+    "responsabilidad garantía geotécnico contaminación freático ruido vibración ambiental "
+    "interfaz dependencia puesta servicio recepción homologación enclavamiento catenaria "
+    "señalización licitación capacidad suministro escasez fallo accidente seguridad "
+    "incendio evacuación interrupción expropiación"
+).split()
+
+_TOKEN_RE = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Palabras de 3+ letras en minúsculas, recortadas a STEM_CHARS."""
+    return [t[:STEM_CHARS] for t in _TOKEN_RE.findall(text.lower())]
+
+
+def _marker_cost(page: int) -> int:
+    # Lo que añade format_pages por cada página: "[Página n]\n" + separador
+    return len(f"[Página {page}]\n") + len("\n---\n")
+
+
+def split_passages(pages: List[Dict], passage_chars: int = PASSAGE_CHARS) -> List[Dict]:
+    """Parte cada página en pasajes de líneas consecutivas de ~passage_chars."""
+    passages = []
+    for p in pages:
+        current, size = [], 0
+        lines = (p.get("text") or "").split("\n")
+        # Líneas enormes (párrafos DOCX sin saltos) se cortan para que ningún pasaje desborde
+        lines = [ln[k:k + passage_chars] for ln in lines for k in range(0, max(len(ln), 1), passage_chars)]
+        for line in lines:
+            if not line.strip() and not current:
+                continue
+            current.append(line)
+            size += len(line) + 1
+            if size >= passage_chars:
+                passages.append({"page": p["page"], "text": "\n".join(current).strip()})
+                current, size = [], 0
+        if current and "".join(current).strip():
+            passages.append({"page": p["page"], "text": "\n".join(current).strip()})
+    return passages
+
+
+def build_query(context: str = "") -> Dict[str, float]:
+    """Pesos por término: vocabulario de riesgos (1.0) + términos del context (RANK_CONTEXT_WEIGHT)."""
+    weights = {t: 1.0 for t in tokenize(" ".join(RISK_VOCABULARY))}
+    for t in tokenize(context or ""):
+        weights[t] = max(weights.get(t, 0.0), RANK_CONTEXT_WEIGHT)
+    return weights
+
+
+def bm25_scores(passages: List[Dict], query: Dict[str, float]):
+    """Puntuación BM25 ponderada de cada pasaje (np.ndarray de len(passages))."""
+    import numpy as np
+
+    terms = list(query)
+    term_index = {t: j for j, t in enumerate(terms)}
+    rows, cols, doc_len = [], [], np.zeros(len(passages))
+    for i, passage in enumerate(passages):
+        tokens = tokenize(passage["text"])
+        doc_len[i] = len(tokens)
+        for t in tokens:
+            j = term_index.get(t)
+            if j is not None:
+                rows.append(i)
+                cols.append(j)
+
+    tf = np.zeros((len(passages), len(terms)))
+    np.add.at(tf, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), 1.0)
+
+    n_docs = len(passages)
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / max(doc_len.mean(), 1.0))
+    bm25 = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+    return bm25 @ (idf * np.fromiter((query[t] for t in terms), dtype=float, count=len(terms)))
+
+
+def select_passages(pages: List[Dict], context: str, max_chars: int) -> Tuple[List[Dict], dict]:
+    """
+    Devuelve (páginas, info): si el documento ya cabe en max_chars (tal como
+    queda tras format_pages) se devuelve igual; si no, solo los pasajes mejor
+    puntuados, agrupados por página y en orden de documento. El primer pasaje
+    (título, objeto del contrato) se incluye siempre.
+    """
+    total = sum(len(p.get("text") or "") + _marker_cost(p["page"]) for p in pages)
+    if total <= max_chars:
+        return pages, {"selection": "all"}
+
+    passages = split_passages(pages)
+    if not passages:
+        return pages, {"selection": "all"}
+
+    import numpy as np
+
+    scores = bm25_scores(passages, build_query(context))
+    # Orden por puntuación; a igualdad, se prefiere lo que aparece antes
+    order = [0] + [int(i) for i in np.argsort(-scores, kind="stable") if i != 0]
+
+    chosen, used, pages_used = [], 0, set()
+    for i in order:
+        passage = passages[i]
+        cost = len(passage["text"]) + 1
+        if passage["page"] not in pages_used:
+            cost += _marker_cost(passage["page"])
+        if used + cost > max_chars:
+            continue
+        chosen.append(i)
+        used += cost
+        pages_used.add(passage["page"])
+
+    selected = []
+    for i in sorted(chosen):
+        passage = passages[i]
+        if selected and selected[-1]["page"] == passage["page"]:
+            selected[-1]["text"] += "\n" + passage["text"]
+        else:
+            selected.append({"page": passage["page"], "text": passage["text"]})
+
+    info = {
+        "selection": "ranked",
+        "passages": len(passages),
+        "passages_selected": len(chosen),
+        "pages_selected": len(pages_used),
+    }
+    return selected, info
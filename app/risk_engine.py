@@ -1,89 +1,246 @@
 # app/risk_engine.py
 import os
+import re
 import json
+import asyncio
+import threading
+import weakref
+from typing import List, Dict, Iterable
 from dotenv import load_dotenv
 
+from app.json_stream import RiskStreamParser, RISK_LISTS
+from app.metrics import stage, record_llm_call, record_prompt_chars
+from app.json_repair import repair_json, validate_risks, valid_risk, REASKS
+from app.ranking import select_passages
+from app.transport import llm_transport
+from app.cassette import cassette, LLM_CASSETTE_MODE
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  Compatibilidad SDK OpenAI:
 #   - SDK nuevo (>=1.x): from openai import OpenAI; client.chat.completions.create(...)
 #   - SDK viejo (0.27.x): import openai; openai.ChatCompletion.create(...)
-#  Este módulo detecta el entorno y usa la llamada correcta automáticamente.
+#  Este módulo detecta el entorno (en el primer uso) y usa la llamada correcta.
 # ─────────────────────────────────────────────────────────────────────────────
 
 load_dotenv()
 
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
+# Súbela cuando cambien los prompts o el formato de salida: invalida la caché de resultados
+PROMPT_VERSION = "3"
+
+# Presupuesto de documento por llamada y parámetros del modo por ventanas
+MAX_PROMPT_CHARS = int(os.getenv("MAX_PROMPT_CHARS", "18000"))
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(MAX_PROMPT_CHARS // 4)))
+CHUNK_PARALLELISM = int(os.getenv("CHUNK_PARALLELISM", "8"))
+
+REQUIRED_KEYS = ["risk", "justification", "countermeasure", "page", "evidence"]
+
+# Idiomas de salida. `lang` llega ya validado por pipeline.normalize_lang (el
+# único normalizador; la API responde 400 invalid_lang antes de llegar aquí)
+LANGUAGE_NAMES = {"es": "Spanish", "en": "English", "de": "German"}
+
+# Transporte: endpoint alternativo (p. ej. un stub local), pool y límites
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "90"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", str(LLM_MAX_CONCURRENCY)))
+
 API_KEY = os.getenv("OPENAI_API_KEY")
 USE_MOCK = False
 
-if not API_KEY:
-    raise RuntimeError("OPENAI_API_KEY no está definida. Añádela en Render > Environment")
 
-# Detecta SDK
-USE_NEW_SDK = False
-_openai_version = None
+class LLMClients:
+    """Clientes del SDK detectado. Se construyen en el primer uso (ver get_llm)."""
 
-try:
-    # Intentar SDK nuevo
-    from openai import OpenAI
-    client = OpenAI(api_key=API_KEY)
-    USE_NEW_SDK = True
-    try:
-        # no siempre está disponible __version__ aquí
-        import openai as _openai_mod  # solo para leer versión si existe
-        _openai_version = getattr(_openai_mod, "__version__", "unknown")
-    except Exception:
-        _openai_version = "unknown"
-except Exception:
-    # Fallback a SDK viejo
-    import openai as _openai_old
-    _openai_old.api_key = API_KEY
-    _openai_version = getattr(_openai_old, "__version__", "0.27.x")
+    def __init__(self):
+        self.use_new_sdk = False
+        self.version = None
+        self.sync = None        # OpenAI (SDK nuevo)
+        self.legacy = None      # módulo openai 0.27.x
+        self.make_async = None  # fábrica de AsyncOpenAI (SDK nuevo)
+        self._per_loop = weakref.WeakKeyDictionary()
+
+    def async_resources(self):
+        """
+        (AsyncOpenAI | None, semáforo) del event loop actual. En producción hay
+        un loop por worker, así que es un único pool de conexiones keep-alive y
+        un único tope de llamadas en vuelo; los clientes httpx y los semáforos
+        no se pueden compartir entre loops (tests, benchmarks, varios servers).
+        """
+        loop = asyncio.get_running_loop()
+        res = self._per_loop.get(loop)
+        if res is None:
+            client = self.make_async() if self.use_new_sdk else None
+            res = (client, asyncio.Semaphore(LLM_MAX_CONCURRENCY))
+            self._per_loop[loop] = res
+        return res
 
-print(f"[risk_engine] OpenAI SDK detected: {'new>=1.x' if USE_NEW_SDK else 'legacy 0.27.x'} · version={_openai_version}")
 
+_llm = None
+_llm_lock = threading.Lock()
 
-def _chat_completion(messages, temperature=0.3, max_tokens=3000, response_format_json=True):
+
+def get_llm() -> LLMClients:
     """
-    Abstracción de llamada al chat para soportar ambos SDKs.
-    Retorna (content_str).
+    Construcción perezosa y thread-safe de los clientes: importar este módulo
+    no carga openai/httpx ni exige OPENAI_API_KEY, así la API arranca rápido
+    (y /health responde) aunque el stack LLM aún no se haya inicializado.
     """
-    if USE_NEW_SDK:
-        # SDK nuevo (>=1.x)
-        kwargs = {
-            "model": MODEL_NAME,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-        }
-        # response_format solo existe en SDK nuevo
-        if response_format_json:
-            kwargs["response_format"] = {"type": "json_object"}
+    global _llm
+    if _llm is not None:
+        return _llm
+    with _llm_lock:
+        if _llm is not None:
+            return _llm
 
-        resp = client.chat.completions.create(**kwargs)
+        if LLM_CASSETTE_MODE == "replay":
+            # Sin red ni API key: las respuestas salen del cassette (ver app/cassette.py)
+            llm = LLMClients()
+            llm.use_new_sdk = True
+            llm.version = "cassette"
+            llm.sync = cassette.replay()
+            llm.make_async = cassette.replay_async
+            print(f"[risk_engine] LLM replay from cassette {cassette.path} ({len(cassette)} entries)")
+            _llm = llm
+            return _llm
+
+        api_key = API_KEY or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY no está definida. Añádela en Render > Environment")
+
+        llm = LLMClients()
+        try:
+            # Intentar SDK nuevo
+            from openai import OpenAI, AsyncOpenAI
+            import httpx
+            # Reintentos y timeouts los gestiona app/transport.py, no el SDK
+            llm.sync = OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, timeout=LLM_TIMEOUT_S, max_retries=0)
+            llm.make_async = lambda: AsyncOpenAI(
+                api_key=api_key,
+                base_url=OPENAI_BASE_URL,
+                timeout=LLM_TIMEOUT_S,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=LLM_POOL_CONNECTIONS,
+                        max_keepalive_connections=LLM_POOL_CONNECTIONS,
+                    ),
+                    timeout=LLM_TIMEOUT_S,
+                ),
+            )
+            llm.use_new_sdk = True
+            try:
+                # no siempre está disponible __version__ aquí
+                import openai as _openai_mod  # solo para leer versión si existe
+                llm.version = getattr(_openai_mod, "__version__", "unknown")
+            except Exception:
+                llm.version = "unknown"
+        except Exception:
+            # Fallback a SDK viejo
+            import openai as _openai_old
+            _openai_old.api_key = api_key
+            if OPENAI_BASE_URL:
+                _openai_old.api_base = OPENAI_BASE_URL
+            llm.legacy = _openai_old
+            llm.version = getattr(_openai_old, "__version__", "0.27.x")
+
+        print(f"[risk_engine] OpenAI SDK detected: {'new>=1.x' if llm.use_new_sdk else 'legacy 0.27.x'} · version={llm.version}")
+        if LLM_CASSETTE_MODE == "record":
+            if llm.use_new_sdk:
+                make_async = llm.make_async
+                llm.sync = cassette.recording(llm.sync)
+                llm.make_async = lambda: cassette.recording_async(make_async())
+                print(f"[risk_engine] recording LLM calls to cassette {cassette.path}")
+            else:
+                print("[risk_engine] LLM_CASSETTE_MODE=record requiere el SDK nuevo; no se graba")
+        _llm = llm
+        return _llm
+
+
+def _completion_kwargs(messages, temperature, max_tokens, response_format_json):
+    kwargs = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    # response_format solo existe en SDK nuevo
+    if response_format_json:
+        kwargs["response_format"] = {"type": "json_object"}
+    return kwargs
+
+
+def _chat_completion_once(messages, temperature, max_tokens, response_format_json, timeout):
+    """Un único intento síncrono con ambos SDKs. Retorna (content_str)."""
+    llm = get_llm()
+    try:
+        with stage("llm"):
+            if llm.use_new_sdk:
+                # SDK nuevo (>=1.x)
+                kwargs = _completion_kwargs(messages, temperature, max_tokens, response_format_json)
+                resp = llm.sync.chat.completions.create(timeout=timeout, **kwargs)
+            else:
+                # SDK viejo (0.27.x) — NO soporta response_format
+                # Nos apoyamos en el prompt para forzar JSON estricto.
+                resp = llm.legacy.ChatCompletion.create(
+                    model=MODEL_NAME,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    request_timeout=timeout,
+                )
+    except Exception:
+        record_llm_call(outcome="error")
+        raise
+    if llm.use_new_sdk:
+        record_llm_call(resp.usage)
         return resp.choices[0].message.content
-    else:
-        # SDK viejo (0.27.x) — NO soporta response_format
-        # Nos apoyamos en el prompt para forzar JSON estricto.
-        resp = _openai_old.ChatCompletion.create(
-            model=MODEL_NAME,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        return resp["choices"][0]["message"]["content"]
+    record_llm_call(resp.get("usage"))
+    return resp["choices"][0]["message"]["content"]
 
 
-def generate_risks(text: str, context: str = "", lang: str = "es") -> dict:
-    if USE_MOCK:
-        raise RuntimeError("USE_MOCK=True pero el modo estricto está activo.")
+async def _achat_completion(messages, temperature=0.3, max_tokens=3000, response_format_json=True,
+                            timeout: float = None):
+    """
+    Llamada al chat con ambos SDKs, con reintentos, deadline y circuit breaker
+    (ver app/transport.py); no bloquea el event loop.
+    - SDK nuevo: AsyncOpenAI sobre el pool httpx compartido.
+    - SDK viejo: la llamada síncrona se ejecuta en un thread.
+    Cada intento pasa por el semáforo global (las esperas de backoff no ocupan
+    hueco); `timeout` es por intento (por defecto LLM_ATTEMPT_TIMEOUT_S).
+    """
+    llm = get_llm()
+    async_client, semaphore = llm.async_resources()
+
+    async def attempt(attempt_timeout: float) -> str:
+        async with semaphore:
+            if not llm.use_new_sdk:
+                return await asyncio.to_thread(
+                    _chat_completion_once, messages, temperature, max_tokens, response_format_json, attempt_timeout
+                )
+            kwargs = _completion_kwargs(messages, temperature, max_tokens, response_format_json)
+            try:
+                with stage("llm"):
+                    resp = await async_client.chat.completions.create(timeout=attempt_timeout, **kwargs)
+            except asyncio.CancelledError:
+                record_llm_call(outcome="cancelled")
+                raise
+            except Exception:
+                record_llm_call(outcome="error")
+                raise
+            record_llm_call(resp.usage)
+            return resp.choices[0].message.content
+
+    return await llm_transport.acall(attempt, attempt_timeout=timeout)
 
-    # 🔹 Normaliza/valida lang
-    lang = (lang or "es").strip().lower()
-    if lang not in {"es", "en", "de"}:
-        raise ValueError(f"Unsupported lang='{lang}'. Use one of: es,en,de")
-    print(f"[risk_engine] lang received: {lang}")
 
+@stage("prompt")
+def _build_messages(text: str, context: str, lang: str, extra_instructions: str = "") -> list:
+    """
+    Construye los mensajes system/user para el análisis de un texto.
+    El texto se recorta a MAX_PROMPT_CHARS; el modo por ventanas se encarga
+    de que cada ventana ya quepa en ese presupuesto.
+    """
     # 🔹 System prompt monolingüe por idioma
     SYSTEM_BY_LANG = {
         "de": (
@@ -137,39 +294,548 @@ def generate_risks(text: str, context: str = "", lang: str = "es") -> dict:
 
 {TASK}
 {STRUCT}
+{extra_instructions}
 
 Kontext / Contexto / Context:
 {context}
 
-Dokument (gekürzt / truncado a 18000 Zeichen):
-{text[:18000]}
+Dokument (gekürzt / truncado a {MAX_PROMPT_CHARS} Zeichen):
+{text[:MAX_PROMPT_CHARS]}
 
 {JSON_ONLY}
 """.strip()
 
-    # ── Llamada unificada al modelo ───────────────────────────────────────────
-    content = _chat_completion(
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user",   "content": user_prompt},
-        ],
+    record_prompt_chars(min(len(text), MAX_PROMPT_CHARS))
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user",   "content": user_prompt},
+    ]
+
+
+@stage("parse")
+def _parse_risks(content: str, expected: int = 5):
+    """
+    Repara la salida (code fences, comas colgantes, JSON truncado) y separa los
+    riesgos válidos de los que faltan. Devuelve (datos, problemas); ver
+    json_repair.validate_risks. Solo falla si no hay ningún JSON recuperable.
+    """
+    try:
+        data, repairs = repair_json(content)
+    except ValueError as e:
+        raise RuntimeError(f"No se pudo parsear la respuesta como JSON. Raw: {(content or '')[:400]}... Error: {e}")
+
+    data, problems = validate_risks(data, RISK_LISTS, REQUIRED_KEYS, expected)
+    if repairs:
+        data["_repair"] = {"repairs": repairs}
+    return data, problems
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Re-ask: si tras la reparación faltan riesgos o alguno está incompleto, se
+#  piden solo esos con un prompt corto (riesgos ya aceptados + pasajes del
+#  documento más relevantes) en lugar de repetir el análisis completo.
+# ─────────────────────────────────────────────────────────────────────────────
+
+REASK_ENABLED = os.getenv("REASK_ENABLED", "1") != "0"
+REASK_DOC_CHARS = int(os.getenv("REASK_DOC_CHARS", "4000"))
+
+_PAGE_MARK_RE = re.compile(r"\[Página (\d+)\]\n")
+
+
+def _reask_excerpt(text: str, context: str) -> str:
+    """Recorta el documento a REASK_DOC_CHARS con los pasajes mejor puntuados."""
+    parts = _PAGE_MARK_RE.split(text[:MAX_PROMPT_CHARS])
+    if len(parts) < 3:
+        return text[:REASK_DOC_CHARS]
+    pages = [{"page": int(parts[i]), "text": parts[i + 1].rstrip().removesuffix("---").rstrip()}
+             for i in range(1, len(parts) - 1, 2)]
+    selected, _ = select_passages(pages, context, REASK_DOC_CHARS)
+    return format_pages(selected)[:REASK_DOC_CHARS]
+
+
+def _reask_messages(data: dict, problems: dict, text: str, context: str, lang: str) -> list:
+    accepted = {name: [r.get("risk") for r in data.get(name, [])] for name in RISK_LISTS}
+    wanted = {name: p["missing"] for name, p in problems.items()}
+    incomplete = {name: p["invalid"] for name, p in problems.items() if p["invalid"]}
+    return [
+        {"role": "system", "content": "You are an interdisciplinary expert panel for rail infrastructure."},
+        {"role": "user", "content": (
+            f"A previous answer was incomplete. Write the missing risks in {LANGUAGE_NAMES[lang]} "
+            "(JSON keys in English, 'evidence' quoted verbatim, not translated).\n"
+            f"Missing risks per list: {json.dumps(wanted)}\n"
+            f"Already accepted (do not repeat): {json.dumps(accepted, ensure_ascii=False)}\n"
+            + (f"Incomplete entries to fix if possible: {json.dumps(incomplete, ensure_ascii=False)[:2000]}\n"
+               if incomplete else "")
+            + f"Each entry: {json.dumps(REQUIRED_KEYS)}. {PAGE_HINT}\n"
+            f"Context: {context}\n\n"
+            f"Document excerpt:\n{_reask_excerpt(text, context)}\n\n"
+            "Return ONLY a JSON object with the same two lists, each containing exactly the missing number of entries."
+        )},
+    ]
+
+
+def _merge_reask(data: dict, problems: dict, content: str) -> dict:
+    """Añade los riesgos nuevos válidos (sin duplicar títulos) y anota el resultado."""
+    added = 0
+    try:
+        extra, _ = _parse_risks(content, expected=0)
+    except RuntimeError:
+        extra = {}
+    for name, p in problems.items():
+        seen = {str(r.get("risk", "")).strip().lower() for r in data[name]}
+        for item in extra.get(name, []):
+            title = str(item.get("risk", "")).strip().lower()
+            if len(data[name]) >= 5 or title in seen:
+                continue
+            data[name] = data[name] + [item]
+            seen.add(title)
+            added += 1
+    REASKS.inc(outcome="ok" if added >= sum(p["missing"] for p in problems.values()) else "partial")
+    data.setdefault("_repair", {})["reask_added"] = added
+    return data
+
+
+def _finish(data: dict, problems: dict) -> dict:
+    """Lo que siga faltando tras el re-ask se entrega incompleto; vacío del todo es error."""
+    counts = {name: len(data.get(name, [])) for name in RISK_LISTS}
+    if not any(counts.values()):
+        raise ValueError("El modelo no devolvió el JSON esperado.")
+    short = {name: 5 - n for name, n in counts.items() if n < 5}
+    if short:
+        data.setdefault("_repair", {})["missing"] = short
+    return data
+
+
+async def _acomplete_risks(data: dict, problems: dict, text: str, context: str, lang: str) -> dict:
+    if problems and REASK_ENABLED:
+        try:
+            content = await _achat_completion(_reask_messages(data, problems, text, context, lang),
+                                              temperature=0.3,
+                                              max_tokens=300 * sum(p["missing"] for p in problems.values()))
+            data = _merge_reask(data, problems, content)
+        except Exception as e:
+            REASKS.inc(outcome="error")
+            print(f"[risk_engine] re-ask failed, returning partial result: {e}")
+    return _finish(data, problems)
+
+
+def generate_risks(text: str, context: str = "", lang: str = "es") -> dict:
+    """Envoltorio síncrono de agenerate_risks para scripts (fuera de un event loop)."""
+    return asyncio.run(agenerate_risks(text, context=context, lang=lang))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Modo por ventanas (map-reduce) para documentos largos:
+#   1) map:    se parte la lista de páginas en ventanas acotadas en tokens y
+#              cada ventana se analiza en paralelo (con tope de concurrencia).
+#   2) reduce: se deduplican los candidatos localmente y una llamada corta
+#              (solo con los candidatos, sin el documento) elige los 5 + 5
+#              finales por id, así page/evidence se conservan tal cual.
+# ─────────────────────────────────────────────────────────────────────────────
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata (~4 caracteres por token) suficiente para acotar ventanas."""
+    return len(text) // 4 + 1
+
+
+def format_pages(pages: List[Dict]) -> str:
+    """Une páginas con marcas [Página n] para que el modelo pueda citar la página."""
+    return "\n---\n".join(f"[Página {p['page']}]\n{p['text']}" for p in pages)
+
+
+def take_pages_within_budget(pages: Iterable[Dict], max_chars: int = MAX_PROMPT_CHARS):
+    """
+    Consume páginas de un iterador perezoso hasta llenar el presupuesto del
+    prompt (tal como quedarán tras format_pages) y deja de pedir más.
+    Devuelve (páginas, presupuesto_lleno). Las páginas se devuelven completas:
+    el recorte final lo hace _build_messages.
+    """
+    taken, used = [], 0
+    for p in pages:
+        taken.append(p)
+        used += len(p.get("text") or "") + len(f"[Página {p['page']}]\n") + len("\n---\n")
+        if used >= max_chars:
+            return taken, True
+    return taken, False
+
+
+def split_into_windows(pages: List[Dict], max_tokens: int = CHUNK_MAX_TOKENS) -> List[List[Dict]]:
+    """
+    Agrupa páginas consecutivas en ventanas de como máximo max_tokens.
+    Una página que por sí sola no cabe se parte en trozos que conservan su
+    número de página.
+    """
+    max_chars = max_tokens * 4
+    windows, current, current_tokens = [], [], 0
+
+    for p in pages:
+        text = p.get("text") or ""
+        if not text.strip():
+            continue
+        parts = [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+        for part in parts:
+            part_tokens = estimate_tokens(part) + 8  # marca [Página n] + separador
+            if current and current_tokens + part_tokens > max_tokens:
+                windows.append(current)
+                current, current_tokens = [], 0
+            current.append({"page": p["page"], "text": part})
+            current_tokens += part_tokens
+
+    if current:
+        windows.append(current)
+    return windows
+
+
+def _risk_tokens(text: str) -> set:
+    return set(re.findall(r"\w{4,}", (text or "").lower()))
+
+
+def _dedupe(candidates: List[Dict], threshold: float = 0.6) -> List[Dict]:
+    """Elimina candidatos cuyo título se solapa (Jaccard) con uno anterior."""
+    kept, kept_tokens = [], []
+    for c in candidates:
+        toks = _risk_tokens(c.get("risk", ""))
+        duplicate = any(
+            toks and other and len(toks & other) / len(toks | other) >= threshold
+            for other in kept_tokens
+        )
+        if not duplicate:
+            kept.append(c)
+            kept_tokens.append(toks)
+    return kept
+
+
+def _rank_messages(candidates: Dict[str, List[Dict]], context: str) -> list:
+    """
+    Mensajes para que el modelo elija los 5 mejores ids por categoría. El
+    prompt solo lleva títulos y justificaciones recortadas, no el documento.
+    """
+    listing = {
+        kind: [
+            {"id": i, "risk": c["risk"], "justification": str(c.get("justification", ""))[:300], "page": c.get("page")}
+            for i, c in enumerate(items)
+        ]
+        for kind, items in candidates.items()
+    }
+    return [
+        {"role": "system", "content": "You are an interdisciplinary expert panel for rail infrastructure."},
+        {"role": "user", "content": (
+            "The following candidate risks were extracted from different parts of the same document. "
+            "Merge near-duplicates and pick the 5 most relevant, non-overlapping candidates from each list.\n"
+            f"Context: {context}\n\n"
+            f"Candidates:\n{json.dumps(listing, ensure_ascii=False)}\n\n"
+            'Return ONLY a JSON object: {"intuitive_risks": [ids], "counterintuitive_risks": [ids]} '
+            "with exactly 5 ids per list, ordered from most to least relevant."
+        )},
+    ]
+
+
+def _select(items: List[Dict], ranked_ids, fallback: List[Dict], n: int = 5) -> List[Dict]:
+    chosen, seen = [], set()
+    for i in ranked_ids or []:
+        if isinstance(i, int) and 0 <= i < len(items) and i not in seen:
+            chosen.append(items[i])
+            seen.add(i)
+    # Completa hasta n con el orden original (y, si hace falta, con duplicados descartados)
+    for c in items + fallback:
+        if len(chosen) >= n:
+            break
+        if not any(c is x for x in chosen):
+            chosen.append(c)
+    return chosen[:n]
+
+
+def _collect_candidates(partials: List[dict]):
+    raw = {
+        "intuitive_risks": [r for d in partials for r in d["intuitive_risks"]],
+        "counterintuitive_risks": [r for d in partials for r in d["counterintuitive_risks"]],
+    }
+    return raw, {kind: _dedupe(items) for kind, items in raw.items()}
+
+
+def _parse_ranking(content: str) -> dict:
+    """
+    {"intuitive_risks": [ids], ...} de la respuesta del ranking. Una respuesta
+    que no es un objeto (lista, texto) o listas que no lo son cuentan como
+    ranking fallido: se conserva el orden del documento.
+    """
+    ranked = json.loads(content)
+    if not isinstance(ranked, dict):
+        raise ValueError(f"ranking no es un objeto JSON: {type(ranked).__name__}")
+    return {kind: ids for kind, ids in ranked.items() if isinstance(ids, list)}
+
+
+def _merge_ranked(raw: dict, deduped: dict, ranked: dict, n_windows: int) -> dict:
+    data = {
+        kind: _select(deduped[kind], ranked.get(kind), raw[kind])
+        for kind in ("intuitive_risks", "counterintuitive_risks")
+    }
+    data["source"] = "openai"
+    data["_chunks"] = n_windows
+    return data
+
+
+async def arank_candidates(candidates: Dict[str, List[Dict]], context: str = "", n: int = 5) -> Dict[str, List[Dict]]:
+    """
+    Los n mejores de cada lista con la misma llamada de ranking que el reduce
+    del modo chunked (solo títulos y justificaciones, no el documento). Sin
+    llamada si ninguna lista pasa de n; si el ranking falla, se conserva el
+    orden de los candidatos.
+    """
+    if all(len(candidates.get(kind, [])) <= n for kind in RISK_LISTS):
+        return {kind: list(candidates.get(kind, [])) for kind in RISK_LISTS}
+    try:
+        content = await _achat_completion(_rank_messages(candidates, context), temperature=0.0, max_tokens=300)
+        ranked = _parse_ranking(content)
+    except Exception as e:
+        print(f"[risk_engine] ranking failed, keeping candidate order: {e}")
+        ranked = {}
+    return {kind: _select(candidates.get(kind, []), ranked.get(kind), [], n) for kind in RISK_LISTS}
+
+
+PAGE_HINT = "'page' must be the number N of the [Página N] marker that precedes the quoted evidence."
+
+
+def generate_risks_chunked(pages: List[Dict], context: str = "", lang: str = "es",
+                           max_parallel: int = CHUNK_PARALLELISM) -> dict:
+    """Envoltorio síncrono de agenerate_risks_chunked para scripts (fuera de un event loop)."""
+    return asyncio.run(agenerate_risks_chunked(pages, context=context, lang=lang, max_parallel=max_parallel))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Implementación async (la única: generate_risks* solo la envuelven para scripts)
+# ─────────────────────────────────────────────────────────────────────────────
+
+async def agenerate_risks(text: str, context: str = "", lang: str = "es") -> dict:
+    if USE_MOCK:
+        raise RuntimeError("USE_MOCK=True pero el modo estricto está activo.")
+
+    print(f"[risk_engine] lang received: {lang}")
+
+    content = await _achat_completion(
+        messages=_build_messages(text, context, lang),
         temperature=0.3,
         max_tokens=3000,
-        response_format_json=True,  # en SDK viejo se ignora y usamos el prompt duro
+        response_format_json=True,
     )
 
-    # ── Parseo y validación JSON ──────────────────────────────────────────────
+    data, problems = _parse_risks(content)
+    data = await _acomplete_risks(data, problems, text, context, lang)
+    data["source"] = "openai"
+    return data
+
+
+async def agenerate_risks_chunked(pages: List[Dict], context: str = "", lang: str = "es",
+                                  max_parallel: int = CHUNK_PARALLELISM) -> dict:
+    if USE_MOCK:
+        raise RuntimeError("USE_MOCK=True pero el modo estricto está activo.")
+
+    windows = split_into_windows(pages)
+    if len(windows) <= 1:
+        data = await agenerate_risks(format_pages(windows[0] if windows else pages), context=context, lang=lang)
+        data["_chunks"] = len(windows)
+        return data
+
+    print(f"[risk_engine] chunked analysis (async): {len(windows)} windows · parallel={max_parallel}")
+
+    # Tope por documento además del semáforo global de _achat_completion
+    window_semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    async def analyze_window(window: List[Dict]) -> dict:
+        async with window_semaphore:
+            content = await _achat_completion(
+                messages=_build_messages(format_pages(window), context, lang, extra_instructions=PAGE_HINT),
+                temperature=0.3,
+                max_tokens=3000,
+                response_format_json=True,
+            )
+        # Sin re-ask por ventana: el reduce elige entre los candidatos de todas
+        return _parse_risks(content)[0]
+
+    # ── map ───────────────────────────────────────────────────────────────────
+    partials = await asyncio.gather(*(analyze_window(w) for w in windows))
+
+    # ── reduce ────────────────────────────────────────────────────────────────
+    raw, deduped = _collect_candidates(partials)
     try:
-        data = json.loads(content)
+        content = await _achat_completion(_rank_messages(deduped, context), temperature=0.0, max_tokens=300)
+        ranked = _parse_ranking(content)
     except Exception as e:
-        raise RuntimeError(f"No se pudo parsear la respuesta como JSON. Raw: {content[:400]}... Error: {e}")
+        print(f"[risk_engine] ranking failed, keeping document order: {e}")
+        ranked = {}
 
-    if not isinstance(data.get("intuitive_risks"), list) or not isinstance(data.get("counterintuitive_risks"), list):
-        raise ValueError("El modelo no devolvió el JSON esperado.")
+    return _merge_ranked(raw, deduped, ranked, len(windows))
+
+
+async def _read_risk_stream(llm, messages, parser, emitted, events: asyncio.Queue) -> None:
+    """
+    Lee el stream del LLM bajo el semáforo y deja en `events` cada riesgo
+    completo y válido (como mucho 5 por lista); None al terminar, con o sin error.
+    """
+    async_client, semaphore = llm.async_resources()
+    kwargs = _completion_kwargs(messages, 0.3, 3000, True)
+    # include_usage: el último chunk trae el campo usage (sin choices)
+    usage = None
+    try:
+        async with semaphore:
+            try:
+                with stage("llm"):
+                    # Reintentos solo hasta abrir el stream; sin hedging (duplicaría la salida)
+                    stream = await llm_transport.acall(
+                        lambda timeout: async_client.chat.completions.create(
+                            stream=True, stream_options={"include_usage": True}, timeout=timeout, **kwargs
+                        ),
+                        hedge=False,
+                    )
+                    async for chunk in stream:
+                        usage = getattr(chunk, "usage", None) or usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content or ""
+                        for list_name, item in parser.feed(delta):
+                            # Solo riesgos completos y como mucho 5 por lista: lo emitido ya no se retira
+                            item = valid_risk(item, REQUIRED_KEYS)
+                            if item is not None and len(emitted[list_name]) < 5:
+                                emitted[list_name].append(item)
+                                events.put_nowait({"event": "risk", "kind": list_name.replace("_risks", ""), "item": item})
+            except Exception:
+                record_llm_call(outcome="error")
+                raise
+            record_llm_call(usage)
+    finally:
+        events.put_nowait(None)
+
+
+async def astream_risks(text: str, context: str = "", lang: str = "es"):
+    """
+    Generador async para /analyze/stream. Emite eventos:
+      {"event": "risk", "kind": "intuitive"|"counterintuitive", "item": {...}}
+      {"event": "result", "data": {...}}   ← JSON completo validado, al final
+    Con el SDK viejo no hay streaming: se emiten todos los riesgos al final.
+    """
+    if USE_MOCK:
+        raise RuntimeError("USE_MOCK=True pero el modo estricto está activo.")
+
+    messages = _build_messages(text, context, lang)
 
-    for block in data["intuitive_risks"] + data["counterintuitive_risks"]:
-        if not all(k in block for k in ["risk", "justification", "countermeasure", "page", "evidence"]):
-            raise ValueError("Falta una de las claves requeridas en un riesgo.")
+    llm = get_llm()
+    if not llm.use_new_sdk:
+        data = await agenerate_risks(text, context=context, lang=lang)
+        for list_name in RISK_LISTS:
+            for item in data[list_name]:
+                yield {"event": "risk", "kind": list_name.replace("_risks", ""), "item": item}
+        yield {"event": "result", "data": data}
+        return
 
+    parser = RiskStreamParser()
+    emitted = {name: [] for name in RISK_LISTS}
+    # La lectura del stream va en su propia tarea: el semáforo y el tiempo de
+    # "llm" cubren solo la conexión con la API, no lo que tarde el cliente
+    # HTTP en consumir los eventos (un navegador lento no retiene el cupo).
+    events: asyncio.Queue = asyncio.Queue()
+    reader = asyncio.create_task(_read_risk_stream(llm, messages, parser, emitted, events))
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+        await reader  # propaga el error de la API, si lo hubo
+    finally:
+        reader.cancel()
+
+    # El resultado final empieza por lo ya emitido; el parseo completo (con
+    # reparación) solo aporta lo que el parser incremental no pudo cerrar
+    try:
+        data, problems = _parse_risks(parser.text)
+    except RuntimeError:
+        if not any(emitted.values()):
+            raise
+        data, problems = {name: [] for name in RISK_LISTS}, {}
+    for list_name in RISK_LISTS:
+        recovered = [item for item in data[list_name] if item not in emitted[list_name]]
+        data[list_name] = (emitted[list_name] + recovered)[:5]
+    problems = {
+        name: {"missing": 5 - len(data[name]), "invalid": problems.get(name, {}).get("invalid", [])}
+        for name in RISK_LISTS if len(data[name]) < 5
+    }
+    data = await _acomplete_risks(data, problems, text, context, lang)
+    # Lo recuperado al final y lo añadido por el re-ask también se emite
+    for list_name in RISK_LISTS:
+        for item in data[list_name]:
+            if item not in emitted[list_name]:
+                yield {"event": "risk", "kind": list_name.replace("_risks", ""), "item": item}
     data["source"] = "openai"
-    return data
+    yield {"event": "result", "data": data}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Cambio de idioma: traduce un análisis ya hecho en lugar de repetirlo. El
+#  prompt solo lleva los campos de texto de los riesgos (risk, justification,
+#  countermeasure) con su id; page, evidence y el resto se copian del
+#  original, así las citas siguen sin traducir y verificadas.
+# ─────────────────────────────────────────────────────────────────────────────
+
+TRANSLATABLE_KEYS = ("risk", "justification", "countermeasure")
+
+
+def _translate_messages(data: dict, lang: str) -> list:
+    payload = {
+        name: [{"id": i, **{k: item.get(k, "") for k in TRANSLATABLE_KEYS}} for i, item in enumerate(data.get(name, []))]
+        for name in RISK_LISTS
+    }
+    return [
+        {"role": "system", "content": "You are a professional translator for rail infrastructure projects."},
+        {"role": "user", "content": (
+            f"Translate the text fields of these risk entries into {LANGUAGE_NAMES[lang]}. "
+            "Keep ids, keys and technical terms, abbreviations and norm references unchanged. "
+            "Do not add, drop or merge entries.\n\n"
+            f"{json.dumps(payload, ensure_ascii=False)}\n\n"
+            'Return ONLY a JSON object with the same structure: '
+            '{"intuitive_risks": [{"id", "risk", "justification", "countermeasure"}], "counterintuitive_risks": [...]}'
+        )},
+    ]
+
+
+def _merge_translation(data: dict, content: str) -> dict:
+    """Copia del original con los textos traducidos; lo que falte se queda en el idioma de origen."""
+    try:
+        translated, _ = repair_json(content)
+    except ValueError:
+        translated = {}
+    if not isinstance(translated, dict):
+        translated = {}
+    out, missing = {}, 0
+    for name in RISK_LISTS:
+        by_id = {
+            t.get("id"): t for t in (translated.get(name) or [])
+            if isinstance(t, dict) and isinstance(t.get("id"), int)
+        }
+        out[name] = []
+        for i, item in enumerate(data.get(name, [])):
+            fields = by_id.get(i) or {}
+            new_item = dict(item)
+            untranslated = False
+            for k in TRANSLATABLE_KEYS:
+                if isinstance(fields.get(k), str) and fields[k].strip():
+                    new_item[k] = fields[k]
+                elif str(item.get(k) or "").strip():
+                    untranslated = True
+            # Una traducción igual al original (ETCS, nombres propios) es válida:
+            # solo falta lo que el modelo no devolvió o devolvió vacío
+            missing += untranslated
+            out[name].append(new_item)
+    if missing:
+        out["_translation_missing"] = missing
+    return out
+
+
+async def atranslate_risks(data: dict, lang: str) -> dict:
+    """Devuelve los riesgos de `data` traducidos a `lang` (el resto de claves no se copia)."""
+    chars = sum(len(str(item.get(k, ""))) for name in RISK_LISTS for item in data.get(name, []) for k in TRANSLATABLE_KEYS)
+    content = await _achat_completion(
+        _translate_messages(data, lang),
+        temperature=0.0,
+        # ~4 caracteres por token y algo de margen para idiomas más largos (de)
+        max_tokens=max(500, int(chars / 4 * 1.5) + 200),
+    )
+    result = _merge_translation(data, content)
+    result["source"] = data.get("source", "openai")
+    return result
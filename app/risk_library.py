@@ -0,0 +1,274 @@
+# app/risk_library.py
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from app.metrics import registry
+from app.portfolio import portfolio, PORTFOLIO_ENABLED
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Biblioteca local de riesgos: cada análisis terminado (riesgos con
+#  justificación, contramedida, cita y página, más hash del documento e
+#  idioma) se guarda en SQLite con un índice FTS5 para buscar entre todos
+#  los análisis anteriores (GET /risks/search).
+#   - La ingesta no toca la petición: submit() solo encola en memoria y un
+#     thread escritor vuelca por lotes (RISK_LIBRARY_BATCH filas o cada
+#     RISK_LIBRARY_FLUSH_S) en una sola transacción. Lo recién analizado
+#     aparece en la búsqueda con ese retraso.
+#   - Un mismo análisis (misma clave de caché) se sustituye, no se duplica.
+#   - Sin FTS5 en el SQLite del sistema se busca con LIKE (más lento).
+#   - Cada lote escrito se añade también a la cartera (app/portfolio.py).
+# ─────────────────────────────────────────────────────────────────────────────
+
+logger = logging.getLogger("uvicorn.error")
+
+RISK_LIBRARY_ENABLED = os.getenv("RISK_LIBRARY_ENABLED", "1") != "0"
+RISK_LIBRARY_DB_PATH = os.getenv("RISK_LIBRARY_DB", os.path.join(".data", "risk_library.sqlite3"))
+RISK_LIBRARY_BATCH = int(os.getenv("RISK_LIBRARY_BATCH", "50"))  # análisis por transacción
+RISK_LIBRARY_FLUSH_S = float(os.getenv("RISK_LIBRARY_FLUSH_S", "1"))
+# Tope de análisis pendientes de escribir (disco lento o bloqueado): se descartan los más antiguos
+RISK_LIBRARY_MAX_PENDING = int(os.getenv("RISK_LIBRARY_MAX_PENDING", "10000"))
+SEARCH_MAX_LIMIT = 100
+
+RISK_LISTS = ("intuitive_risks", "counterintuitive_risks")
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+LIBRARY_ANALYSES = registry.counter("risk_library_analyses_total", "Análisis enviados a la biblioteca de riesgos.", ("result",))
+
+
+def library_record(cache_key: str, analysis_key: str, result: Dict, context: Optional[str] = None) -> Dict:
+    """Lo que se guarda de un resultado de /analyze (sin _debug salvo la identificación)."""
+    debug = result.get("_debug", {})
+    return {
+        "cache_key": cache_key,
+        "analysis_key": analysis_key,
+        "file_sha256": debug.get("file_sha256"),
+        "filename": debug.get("filename"),
+        "lang": debug.get("lang"),
+        "mode": debug.get("mode"),
+        "pages": debug.get("pages_read"),
+        "translated_from": debug.get("translated_from"),
+        "context": context,
+        "created_at": time.time(),
+        "risks": {name: list(result.get(name, [])) for name in RISK_LISTS},
+    }
+
+
+def _fts_query(q: str) -> Optional[str]:
+    # Cada palabra entre comillas (sin sintaxis FTS del usuario); la última como prefijo
+    tokens = _TOKEN_RE.findall((q or "").lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"' for t in tokens[:-1]) + (" " if len(tokens) > 1 else "") + f'"{tokens[-1]}"*'
+
+
+class RiskLibrary:
+    """Índice SQLite de riesgos. Una conexión por operación, como SQLiteStore."""
+
+    def __init__(self, path: str = RISK_LIBRARY_DB_PATH, batch_size: int = RISK_LIBRARY_BATCH,
+                 flush_s: float = RISK_LIBRARY_FLUSH_S, max_pending: int = RISK_LIBRARY_MAX_PENDING):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.max_pending = max_pending
+        self.fts = True
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._pending: List[Dict] = []
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path) as conn:
+                        self._create_schema(conn)
+                    self._ready = True
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " cache_key TEXT NOT NULL UNIQUE,"
+            " analysis_key TEXT,"
+            " file_sha256 TEXT,"
+            " filename TEXT,"
+            " lang TEXT,"
+            " mode TEXT,"
+            " context TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS risks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,"
+            " kind TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " risk TEXT, justification TEXT, countermeasure TEXT, evidence TEXT,"
+            " page INTEGER)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS risks_analysis ON risks (analysis_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS analyses_file ON analyses (file_sha256, lang)")
+        try:
+            # Índice externo sobre risks: el texto no se duplica, los triggers lo mantienen
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS risks_fts USING fts5("
+                " risk, justification, countermeasure, evidence,"
+                " content='risks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+        except sqlite3.OperationalError:
+            logger.warning("[risk_library] SQLite sin FTS5: la búsqueda usará LIKE")
+            self.fts = False
+            return
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS risks_ai AFTER INSERT ON risks BEGIN"
+            " INSERT INTO risks_fts (rowid, risk, justification, countermeasure, evidence)"
+            " VALUES (new.id, new.risk, new.justification, new.countermeasure, new.evidence); END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS risks_ad AFTER DELETE ON risks BEGIN"
+            " INSERT INTO risks_fts (risks_fts, rowid, risk, justification, countermeasure, evidence)"
+            " VALUES ('delete', old.id, old.risk, old.justification, old.countermeasure, old.evidence); END"
+        )
+
+    # ── ingesta por lotes ────────────────────────────────────────────────────
+    def submit(self, record: Dict) -> None:
+        """Encola un análisis (library_record) para el siguiente lote. No toca disco."""
+        with self._cond:
+            self._pending.append(record)
+            if len(self._pending) > self.max_pending:
+                del self._pending[0]
+                LIBRARY_ANALYSES.inc(result="dropped")
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="risk-library-writer", daemon=True)
+                self._writer.start()
+
+    def _take_pending(self) -> List[Dict]:
+        with self._cond:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def _run_writer(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= self.batch_size, timeout=self.flush_s)
+            try:
+                self.flush()
+            except Exception as e:
+                # Un fallo de disco no debe tumbar el thread: el lote se pierde y se sigue
+                logger.error(f"[risk_library] no se pudo guardar el lote: {e}")
+
+    def flush(self) -> int:
+        """Escribe ya lo pendiente (lo llama el escritor; también al apagar y en benchmarks)."""
+        with self._write_lock:
+            batch = self._take_pending()
+            if batch:
+                self._write(batch)
+                LIBRARY_ANALYSES.inc(len(batch), result="ingested")
+                if PORTFOLIO_ENABLED:
+                    # El mismo lote alimenta la cartera en columnas (/portfolio/stats)
+                    portfolio.append(batch)
+        return len(batch)
+
+    def _write(self, batch: List[Dict]) -> None:
+        with self._connect() as conn:
+            for record in batch:
+                # Re-análisis del mismo documento y variante: sustituye al anterior
+                old = conn.execute("SELECT id FROM analyses WHERE cache_key = ?", (record["cache_key"],)).fetchone()
+                if old:
+                    conn.execute("DELETE FROM risks WHERE analysis_id = ?", old)
+                    conn.execute("DELETE FROM analyses WHERE id = ?", old)
+                cur = conn.execute(
+                    "INSERT INTO analyses (cache_key, analysis_key, file_sha256, filename, lang, mode, context,"
+                    " created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record["cache_key"], record.get("analysis_key"), record.get("file_sha256"),
+                     record.get("filename"), record.get("lang"), record.get("mode"), record.get("context"),
+                     record["created_at"]),
+                )
+                conn.executemany(
+                    "INSERT INTO risks (analysis_id, kind, position, risk, justification, countermeasure,"
+                    " evidence, page) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (cur.lastrowid, name.replace("_risks", ""), i, str(r.get("risk") or ""),
+                         str(r.get("justification") or ""), str(r.get("countermeasure") or ""),
+                         str(r.get("evidence") or ""), r.get("page") if isinstance(r.get("page"), int) else None)
+                        for name, items in record["risks"].items()
+                        for i, r in enumerate(items)
+                    ],
+                )
+
+    # ── búsqueda ─────────────────────────────────────────────────────────────
+    def search(self, q: str, lang: Optional[str] = None, kind: Optional[str] = None,
+               file_sha256: Optional[str] = None, limit: int = 20, offset: int = 0) -> Dict:
+        """
+        Riesgos anteriores que contienen todas las palabras de `q` (la última
+        como prefijo), los más relevantes primero (bm25, con más peso en el
+        título del riesgo). Devuelve {"total", "items"}.
+        """
+        tokens = _TOKEN_RE.findall((q or "").lower())
+        if not tokens:
+            raise ValueError("La búsqueda necesita al menos una palabra")
+        limit = max(1, min(SEARCH_MAX_LIMIT, limit))
+        offset = max(0, offset)
+        filters, params = [], []
+        for column, value in (("a.lang", lang), ("r.kind", kind), ("a.file_sha256", file_sha256)):
+            if value:
+                filters.append(f"{column} = ?")
+                params.append(value)
+
+        with self._connect() as conn:
+            if self.fts:
+                where = " AND ".join(["risks_fts MATCH ?"] + filters)
+                match = [_fts_query(q)]
+                source = "risks_fts JOIN risks r ON r.id = risks_fts.rowid JOIN analyses a ON a.id = r.analysis_id"
+                # Sin filtros se cuenta solo en el índice: ahorra las dos joins por coincidencia
+                count_sql = (f"SELECT count(*) FROM {source} WHERE {where}" if filters
+                             else "SELECT count(*) FROM risks_fts WHERE risks_fts MATCH ?")
+                total = conn.execute(count_sql, match + params).fetchone()[0]
+                rows = conn.execute(
+                    "SELECT r.kind, r.risk, r.justification, r.countermeasure, r.evidence, r.page,"
+                    " a.lang, a.file_sha256, a.filename, a.cache_key, a.created_at,"
+                    " bm25(risks_fts, 8.0, 2.0, 2.0, 1.0) AS score,"
+                    " snippet(risks_fts, -1, '[', ']', '…', 12)"
+                    f" FROM {source} WHERE {where} ORDER BY score LIMIT ? OFFSET ?",
+                    match + params + [limit, offset],
+                ).fetchall()
+            else:
+                text = "lower(r.risk || ' ' || r.justification || ' ' || r.countermeasure || ' ' || r.evidence)"
+                where = " AND ".join([f"{text} LIKE ?"] * len(tokens) + filters)
+                like = [f"%{t}%" for t in tokens]
+                source = "risks r JOIN analyses a ON a.id = r.analysis_id"
+                total = conn.execute(f"SELECT count(*) FROM {source} WHERE {where}", like + params).fetchone()[0]
+                rows = conn.execute(
+                    "SELECT r.kind, r.risk, r.justification, r.countermeasure, r.evidence, r.page,"
+                    " a.lang, a.file_sha256, a.filename, a.cache_key, a.created_at, 0.0, NULL"
+                    f" FROM {source} WHERE {where} ORDER BY a.created_at DESC LIMIT ? OFFSET ?",
+                    like + params + [limit, offset],
+                ).fetchall()
+
+        items = [
+            {
+                "kind": kind_, "risk": risk, "justification": justification, "countermeasure": countermeasure,
+                "evidence": evidence, "page": page, "lang": lang_, "file_sha256": sha, "filename": filename,
+                "cache_key": cache_key, "analyzed_at": created_at, "score": round(-score, 4), "snippet": snippet,
+            }
+            for (kind_, risk, justification, countermeasure, evidence, page, lang_, sha, filename, cache_key,
+                 created_at, score, snippet) in rows
+        ]
+        return {"total": total, "items": items}
+
+
+risk_library = RiskLibrary()
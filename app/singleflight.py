@@ -0,0 +1,72 @@
+# app/singleflight.py
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Dict, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Single-flight: peticiones concurrentes con la misma clave comparten una
+#  única ejecución en vuelo (p. ej. varias personas analizando el mismo
+#  archivo a la vez → una sola llamada al LLM).
+#   - La ejecución corre en su propia tarea: si quien la lanzó se cancela
+#     (cliente desconectado), los demás siguen esperando el resultado.
+#   - Solo si se cancelan todos los que esperan se cancela la ejecución.
+#   - Una excepción llega a todos; la clave se libera al terminar, así que
+#     la siguiente petición vuelve a intentarlo (no se cachean fallos).
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        # Las tareas pertenecen a un event loop: un registro por loop
+        self._calls_by_loop = weakref.WeakKeyDictionary()
+
+    def _calls(self) -> Dict[str, _Call]:
+        loop = asyncio.get_running_loop()
+        calls = self._calls_by_loop.get(loop)
+        if calls is None:
+            calls = self._calls_by_loop[loop] = {}
+        return calls
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """
+        Ejecuta fn() o se une a la ejecución en curso con la misma clave.
+        Devuelve (resultado, compartido). El resultado es el mismo objeto para
+        todos: quien lo vaya a modificar debe copiarlo.
+        """
+        calls = self._calls()
+        call = calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            calls[key] = call
+
+            def _release(task, key=key, call=call):
+                if calls.get(key) is call:
+                    del calls[key]
+                if not task.cancelled():
+                    task.exception()  # marcada como recogida aunque ya no espere nadie
+
+            call.task.add_done_callback(_release)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nadie espera ya el resultado: no tiene sentido seguir pagando la llamada.
+                # Se suelta la clave ya para que una petición nueva no herede la cancelación.
+                if calls.get(key) is call:
+                    del calls[key]
+                call.task.cancel()
@@ -0,0 +1,290 @@
+# app/transport.py
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from app.metrics import registry
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Transporte resiliente para las llamadas al LLM (envuelve un "intento"):
+#   - Timeout por intento y presupuesto total por petición (deadline).
+#   - Reintentos con backoff exponencial + jitter completo en errores
+#     reintentables (429, 5xx, timeouts, conexión); respeta Retry-After.
+#   - Hedging opcional: si un intento tarda más que el p95 observado se lanza
+#     un duplicado y gana el primero que responde (el otro se cancela).
+#   - Circuit breaker: tras N fallos seguidos de upstream falla rápido durante
+#     LLM_CB_RESET_S; luego deja pasar una sola petición de prueba.
+#  Los reintentos del SDK se desactivan (max_retries=0) para no duplicarlos.
+# ─────────────────────────────────────────────────────────────────────────────
+
+LLM_ATTEMPT_TIMEOUT_S = float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", os.getenv("LLM_TIMEOUT_S", "90")))
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "180"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "20"))
+
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "0.5"))
+
+LLM_CB_FAILURES = int(os.getenv("LLM_CB_FAILURES", "5"))
+LLM_CB_RESET_S = float(os.getenv("LLM_CB_RESET_S", "30"))
+
+RETRIES = registry.counter("llm_retries_total", "Reintentos de llamadas al LLM por motivo.", ("reason",))
+HEDGES = registry.counter("llm_hedges_total", "Peticiones duplicadas (hedging) y quién ganó.", ("result",))
+CIRCUIT = registry.counter("llm_circuit_transitions_total", "Cambios de estado del circuit breaker.", ("state",))
+
+
+class LLMTransportError(Exception):
+    """Fallo definitivo del transporte (la API lo devuelve como 503 con Retry-After)."""
+
+    def __init__(self, error_code: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.error_code = error_code
+        self.message = message
+        self.retry_after = retry_after
+
+    def to_dict(self) -> dict:
+        return {"error_code": self.error_code, "message": self.message}
+
+
+def _retry_after_seconds(exc) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+    except AttributeError:
+        return None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def classify(exc) -> Tuple[bool, str]:
+    """(reintentable, motivo). Funciona con los errores del SDK nuevo y del 0.27.x."""
+    if hasattr(exc, "cassette_reason"):
+        # Error grabado en un cassette (app/cassette.py): se clasifica como el original
+        return exc.cassette_retryable, exc.cassette_reason
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True, "timeout"
+    name = type(exc).__name__
+    if name in ("APITimeoutError", "Timeout"):
+        return True, "timeout"
+    if name in ("APIConnectionError", "ServiceUnavailableError", "TryAgain"):
+        return True, "connection"
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429:
+        return True, "rate_limit"
+    if status is not None and (status >= 500 or status == 408):
+        return True, "server_error"
+    return False, "client_error" if status else "error"
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base_s: float = LLM_BACKOFF_BASE_S, max_s: float = LLM_BACKOFF_MAX_S) -> float:
+    """Jitter completo U(0, min(max, base·2^attempt)); nunca menos que Retry-After."""
+    delay = random.uniform(0, min(max_s, base_s * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base_s))
+    return delay
+
+
+class CircuitBreaker:
+    """closed → (N fallos seguidos) → open → (reset_s) → half_open → 1 prueba → closed/open."""
+
+    def __init__(self, failures: int = LLM_CB_FAILURES, reset_s: float = LLM_CB_RESET_S):
+        self.failures = failures
+        self.reset_s = reset_s
+        self.state = "closed"
+        self._consecutive = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            CIRCUIT.inc(state=state)
+
+    def allow(self) -> None:
+        """Lanza LLMTransportError si el circuito está abierto (o ya hay una prueba en curso)."""
+        if self.failures <= 0:
+            return
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now >= self._open_until:
+                self._set_state("half_open")
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_after = max(0.0, self._open_until - now) or 1.0
+        raise LLMTransportError(
+            "llm_circuit_open",
+            "El servicio LLM no responde; se reintentará en breve",
+            retry_after=round(retry_after, 1),
+        )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self._probe_in_flight = False
+            self._set_state("closed")
+
+    def release(self) -> None:
+        """El intento se abandonó sin resultado (cancelado): libera la prueba de half_open."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (self.failures > 0 and self._consecutive >= self.failures):
+                self._open_until = time.monotonic() + self.reset_s
+                self._set_state("open")
+
+
+class LatencyTracker:
+    """Latencias de los últimos intentos correctos para calcular el retardo del hedging."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES) -> Optional[float]:
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Transport:
+    def __init__(
+        self,
+        attempt_timeout: float = LLM_ATTEMPT_TIMEOUT_S,
+        deadline: float = LLM_DEADLINE_S,
+        max_retries: int = LLM_MAX_RETRIES,
+        hedge: bool = LLM_HEDGE,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyTracker()
+
+    def hedge_delay(self) -> Optional[float]:
+        p = self.latencies.quantile(LLM_HEDGE_QUANTILE)
+        return None if p is None else max(LLM_HEDGE_MIN_DELAY_S, p)
+
+    def _on_error(self, exc, attempt: int, deadline_at: float) -> float:
+        """Decide si se reintenta: devuelve la espera o relanza el error definitivo."""
+        if isinstance(exc, LLMTransportError):
+            raise exc
+        retryable, reason = classify(exc)
+        if not retryable:
+            # upstream respondió (p. ej. 400): no cuenta como caída
+            self.breaker.record_success()
+            raise exc
+        self.breaker.record_failure()
+        retry_after = _retry_after_seconds(exc)
+        delay = backoff_delay(attempt, retry_after)
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline_at:
+            code = "llm_timeout" if reason == "timeout" else "llm_rate_limited" if reason == "rate_limit" else "llm_unavailable"
+            raise LLMTransportError(
+                code,
+                f"El servicio LLM falló tras {attempt + 1} intento(s): {exc}",
+                retry_after=retry_after,
+            ) from exc
+        RETRIES.inc(reason=reason)
+        return delay
+
+    # ── async ─────────────────────────────────────────────────────────────────
+
+    async def acall(self, attempt: Callable[[float], Awaitable], hedge: Optional[bool] = None,
+                    attempt_timeout: Optional[float] = None):
+        """
+        Ejecuta attempt(timeout) con reintentos. `attempt` hace una sola
+        llamada y recibe el timeout que le corresponde a ese intento.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        attempt_timeout = attempt_timeout or self.attempt_timeout
+        deadline_at = time.monotonic() + self.deadline
+        n = 0
+        while True:
+            self.breaker.allow()
+            timeout = min(attempt_timeout, deadline_at - time.monotonic())
+            try:
+                if timeout <= 0:
+                    raise asyncio.TimeoutError()
+                if hedge:
+                    result = await self._hedged(attempt, timeout)
+                else:
+                    result = await self._timed(attempt, timeout)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                delay = self._on_error(e, n, deadline_at)
+                n += 1
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def _timed(self, attempt, timeout: float):
+        t0 = time.perf_counter()
+        result = await asyncio.wait_for(attempt(timeout), timeout)
+        self.latencies.record(time.perf_counter() - t0)
+        return result
+
+    async def _hedged(self, attempt, timeout: float):
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return await self._timed(attempt, timeout)
+        primary = asyncio.ensure_future(self._timed(attempt, timeout))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                HEDGES.inc(result="sent")
+                tasks.append(asyncio.ensure_future(self._timed(attempt, timeout - delay)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            HEDGES.inc(result="primary_won" if task is primary else "hedge_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # El perdedor (o todo, si nos cancelan) se cancela
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+llm_transport = Transport()
@@ -0,0 +1,222 @@
+# app/uploads.py
+import os
+import sys
+import hashlib
+import tempfile
+from typing import Callable, Dict, Optional, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Subidas en streaming: el cuerpo multipart se parsea a medida que llega
+#  (request.stream(), sin pasar por el UploadFile de Starlette, que ya lo
+#  habría copiado entero a un temporal) y el archivo se escribe una sola vez a
+#  un temporal en disco, calculando el SHA-256 por el camino. Los parsers
+#  reciben la ruta, de modo que un PDF grande nunca está entero en memoria.
+#  MAX_UPLOAD_MB se aplica mientras se lee: se corta en cuanto el archivo (o
+#  el cuerpo, también sin Content-Length o con transfer-encoding chunked) lo
+#  supera, sin esperar al final.
+# ─────────────────────────────────────────────────────────────────────────────
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None
+# Margen para los demás campos del multipart (context, lang, ...) y sus cabeceras
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"El archivo supera el máximo de {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+class InvalidForm(Exception):
+    """Cuerpo que no es un multipart/form-data válido."""
+
+
+class SpooledUpload:
+    """Archivo subido en disco. Se borra al salir del `with` (salvo que se haya movido)."""
+
+    def __init__(self, path: str, size: int, sha256: str, filename: str = ""):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+
+    def close(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _FormSpooler:
+    """Callbacks de python-multipart: campos de texto en memoria, el archivo directo a disco."""
+
+    def __init__(self, file_field: str, max_bytes: int, on_file: Optional[Callable[[str], None]]):
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.on_file = on_file
+        self.fields: Dict[str, str] = {}
+        self.upload: Optional[SpooledUpload] = None
+        self._header_name = self._header_value = b""
+        self._disposition = b""
+        self._name = None
+        self._data = bytearray()
+        self._out = None
+        self._digest = None
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value_part,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self) -> None:
+        self._disposition, self._name, self._data = b"", None, bytearray()
+
+    def _header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _header_value_part(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _headers_finished(self) -> None:
+        from python_multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise InvalidForm('Falta "name" en el Content-Disposition de una parte del formulario')
+        self._name = options[b"name"].decode("utf-8", "replace")
+        if self._name == self.file_field and b"filename" in options and self.upload is None:
+            filename = options[b"filename"].decode("utf-8", "replace")
+            if self.on_file is not None:
+                self.on_file(filename)  # p. ej. formato no soportado: se corta antes de leer el archivo
+            suffix = os.path.splitext(filename)[1].lower()
+            fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=UPLOAD_TMP_DIR)
+            self._out, self._digest = os.fdopen(fd, "wb"), hashlib.sha256()
+            self.upload = SpooledUpload(path, 0, "", filename)
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._out is not None:
+            chunk = data[start:end]
+            self.upload.size += len(chunk)
+            if self.upload.size > self.max_bytes:
+                raise UploadTooLarge(self.max_bytes)
+            self._digest.update(chunk)
+            self._out.write(chunk)
+        else:
+            self._data += data[start:end]
+
+    def _part_end(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+            self.upload.sha256 = self._digest.hexdigest()
+        elif self._name is not None:
+            self.fields[self._name] = self._data.decode("utf-8", "replace")
+
+    def discard(self) -> None:
+        if self._out is not None:
+            self._out.close()
+        if self.upload is not None:
+            self.upload.close()
+
+
+async def receive_form(request, file_field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES,
+                       on_file: Optional[Callable[[str], None]] = None) -> Tuple[Dict[str, str], Optional[SpooledUpload]]:
+    """
+    Lee un multipart/form-data de `request.stream()` y devuelve (campos,
+    archivo en disco | None). `on_file(filename)` se llama al llegar las
+    cabeceras del archivo, antes de su contenido. Lanza UploadTooLarge o InvalidForm.
+    """
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, MultipartState, parse_options_header
+
+    content_type, params = parse_options_header(request.headers.get("content-type") or "")
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise InvalidForm("El cuerpo debe ser multipart/form-data")
+    form = _FormSpooler(file_field, max_bytes, on_file)
+    parser = MultipartParser(params[b"boundary"], form.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes + FORM_OVERHEAD_BYTES:
+                raise UploadTooLarge(max_bytes)
+            parser.write(chunk)
+        parser.finalize()
+        if parser.state != MultipartState.END:
+            raise InvalidForm("Formulario multipart incompleto (falta el delimitador final)")
+    except MultipartParseError as e:
+        form.discard()
+        raise InvalidForm(f"Formulario multipart inválido: {e}")
+    except BaseException:
+        form.discard()
+        raise
+    return form.fields, form.upload
+
+
+def content_length_exceeds(content_length: Optional[str], max_bytes: int = MAX_UPLOAD_BYTES) -> bool:
+    """Comprobación temprana con la cabecera Content-Length (antes de leer el cuerpo)."""
+    try:
+        return content_length is not None and int(content_length) > max_bytes + FORM_OVERHEAD_BYTES
+    except ValueError:
+        return False
+
+
+def memory_snapshot() -> dict:
+    """RSS actual y pico del proceso en MB (Linux: /proc; otros: resource si existe)."""
+    info = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    info["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    info["rss_peak_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        try:
+            import resource
+            # ru_maxrss: KB en Linux, bytes en macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            info["rss_peak_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        except ImportError:
+            pass
+    return info
+
+
+def memory_usage(start: dict, end: dict) -> dict:
+    """
+    Memoria de una petición a partir de dos memory_snapshot (inicio y fin).
+    El pico (VmHWM) es del proceso entero y no se puede reiniciar por petición
+    sin pisar las demás en curso: lo atribuible a esta es cuánto lo subió
+    (rss_peak_growth_mb; 0 si no superó el pico anterior). Con peticiones
+    simultáneas en el mismo proceso ambos deltas incluyen lo de las otras.
+    """
+    def delta(key):
+        if start.get(key) is None or end.get(key) is None:
+            return None
+        return round(end[key] - start[key], 1)
+
+    return {
+        "rss_start_mb": start.get("rss_mb"),
+        "rss_end_mb": end.get("rss_mb"),
+        "rss_delta_mb": delta("rss_mb"),
+        "rss_peak_growth_mb": delta("rss_peak_mb"),  # el pico solo crece: nunca negativo
+        "process_rss_peak_mb": end.get("rss_peak_mb"),
+    }
@@ -0,0 +1,113 @@
+# benchmarks/bench_admission.py
+"""
+Control de admisión (app/admission.py):
+  - Sobrecoste por petición de admitir + liquidar (token buckets por cliente
+    y global) con el backend en memoria y con SQLite, para N clientes.
+  - Reparto de turnos: un cliente que encola muchos análisis y otro con
+    pocos, con la cola justa (deficit round robin) frente a un semáforo FIFO.
+
+    python -m benchmarks.bench_admission --requests 5000 --clients 1 100 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from app import admission as adm
+from benchmarks.common import percentiles, write_results
+
+
+def overhead(backend: str, n_requests: int, n_clients: int) -> dict:
+    if backend == "sqlite":
+        buckets = adm.SQLiteBuckets(os.path.join(tempfile.mkdtemp(), "admission.sqlite3"))
+    else:
+        buckets = adm.MemoryBuckets()
+    controller = adm.AdmissionController(buckets)
+    # Buckets que no se agotan: se mide el coste de la decisión, no los 429
+    adm.ADMISSION_GLOBAL_RATE = adm.ADMISSION_CLIENT_RATE = 1e9
+    rng = random.Random(0)
+    admit_us, settle_us = [], []
+    for _ in range(n_requests):
+        client = f"ip:10.0.{rng.randrange(n_clients)}"
+        t0 = time.perf_counter()
+        ticket = controller.admit(client, adm.request_cost("250000"))
+        t1 = time.perf_counter()
+        controller.settle(ticket, {"cache": "miss", "pages_read": 12})
+        t2 = time.perf_counter()
+        admit_us.append((t1 - t0) * 1e6)
+        settle_us.append((t2 - t1) * 1e6)
+    return {
+        "backend": backend,
+        "clients": n_clients,
+        "requests": n_requests,
+        "admit_us": percentiles(admit_us),
+        "settle_us": percentiles(settle_us),
+    }
+
+
+async def _fairness(fair: bool, slots: int, heavy: int, light: int, service_s: float) -> dict:
+    queue = adm.FairQueue(slots=slots, max_queued=heavy + light)
+    sem = asyncio.Semaphore(slots)
+    waits = {"heavy": [], "light": []}
+
+    async def one(kind: str, delay: float):
+        await asyncio.sleep(delay)
+        t0 = time.perf_counter()
+        if fair:
+            async with queue.slot(adm.Ticket(kind, 1.0)):
+                waits[kind].append(time.perf_counter() - t0)
+                await asyncio.sleep(service_s)
+        else:
+            async with sem:
+                waits[kind].append(time.perf_counter() - t0)
+                await asyncio.sleep(service_s)
+
+    # El cliente "heavy" lo encola todo de golpe; "light" llega poco después
+    tasks = [one("heavy", 0) for _ in range(heavy)]
+    tasks += [one("light", 0.01 + i * service_s) for i in range(light)]
+    await asyncio.gather(*tasks)
+    return {
+        "scheduler": "fair" if fair else "fifo",
+        "slots": slots,
+        "heavy_wait_s": percentiles(waits["heavy"]),
+        "light_wait_s": percentiles(waits["light"]),
+    }
+
+
+def run(n_requests: int = 5000, client_counts=(1, 100, 10000), slots: int = 2, heavy: int = 40,
+        light: int = 5, service_s: float = 0.05) -> dict:
+    rates = adm.ADMISSION_GLOBAL_RATE, adm.ADMISSION_CLIENT_RATE
+    rows = []
+    try:
+        for backend in ("memory", "sqlite"):
+            for n_clients in client_counts:
+                row = overhead(backend, n_requests if backend == "memory" else min(n_requests, 1000), n_clients)
+                print(json.dumps(row))
+                rows.append(row)
+    finally:
+        adm.ADMISSION_GLOBAL_RATE, adm.ADMISSION_CLIENT_RATE = rates
+    fairness = []
+    for fair in (False, True):
+        row = asyncio.run(_fairness(fair, slots, heavy, light, service_s))
+        print(json.dumps(row))
+        fairness.append(row)
+    return {"overhead": rows, "fairness": fairness}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=5000)
+    ap.add_argument("--clients", type=int, nargs="+", default=[1, 100, 10000])
+    ap.add_argument("--slots", type=int, default=2)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    result = run(args.requests, args.clients, args.slots)
+    if args.out:
+        write_results({"admission": result}, args.out)
+
+
+if __name__ == "__main__":
+    main()
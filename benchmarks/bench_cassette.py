@@ -0,0 +1,104 @@
+# benchmarks/bench_cassette.py
+"""
+Grabar y reproducir llamadas al LLM (app/cassette.py): se analizan N
+documentos contra el stub grabando un cassette, se apaga el stub y se
+repiten los análisis en modo replay con la latencia grabada y sin latencia.
+
+    python -m benchmarks.bench_cassette --docs 5 --pages 30 --latency 0.3
+
+Por escenario: segundos, llamadas al LLM, tokens (los de la grabación) y si
+los riesgos coinciden exactamente con los de la grabación; más el tamaño
+del cassette en disco.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import write_results
+from benchmarks.corpus import make_txt
+from benchmarks.stub_llm import StubConfig, start_stub
+
+
+def _use(mode: str, cassette):
+    # La configuración se lee al importar: se reemplaza en caliente y se
+    # fuerza a reconstruir los clientes del LLM
+    from app import risk_engine
+
+    risk_engine.LLM_CASSETTE_MODE = mode
+    risk_engine.cassette = cassette
+    risk_engine._llm = None
+
+
+async def _analyze_all(docs, mode: str) -> dict:
+    from app import pipeline
+    from app.metrics import begin_request
+
+    metrics = begin_request()
+    t0 = time.perf_counter()
+    results = [
+        await pipeline.run_analysis(doc, f"doc{i}.txt", context="Bahn", lang="en", mode=mode, no_cache=True)
+        for i, doc in enumerate(docs)
+    ]
+    summary = metrics.summary()
+    risks = [{name: r[name] for name in ("intuitive_risks", "counterintuitive_risks")} for r in results]
+    return {
+        "seconds": round(time.perf_counter() - t0, 3),
+        "llm_calls": summary["llm_calls"],
+        "tokens": sum(summary["tokens"].values()),
+        "risks": risks,
+    }
+
+
+def run(docs: int = 5, pages: int = 30, latency: float = 0.3, mode: str = "chunked") -> list:
+    from app.cassette import Cassette
+    from app import pipeline
+
+    pipeline.INCREMENTAL_ENABLED = False
+    path = os.path.join(tempfile.mkdtemp(), "llm.jsonl.gz")
+    corpus = [make_txt(pages, seed=i) for i in range(docs)]
+
+    server, url = start_stub(0, StubConfig(latency=latency))
+    os.environ["OPENAI_BASE_URL"] = url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    from app import risk_engine
+    risk_engine.OPENAI_BASE_URL = url
+    recorder = Cassette(path)
+    _use("record", recorder)
+    recorded = asyncio.run(_analyze_all(corpus, mode))
+    recorder.close()
+    server.shutdown()
+
+    rows = [{"scenario": "live_record", **{k: v for k, v in recorded.items() if k != "risks"}}]
+    for name, scale in (("replay_recorded_latency", 1.0), ("replay_no_latency", 0.0)):
+        _use("replay", Cassette(path, latency_scale=scale))
+        replayed = asyncio.run(_analyze_all(corpus, mode))
+        rows.append({
+            "scenario": name,
+            **{k: v for k, v in replayed.items() if k != "risks"},
+            "identical_risks": replayed["risks"] == recorded["risks"],
+        })
+    _use("off", None)
+    for row in rows:
+        row.update(docs=docs, pages=pages, cassette_bytes=os.path.getsize(path))
+        print(json.dumps(row))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", type=int, default=5)
+    ap.add_argument("--pages", type=int, default=30)
+    ap.add_argument("--latency", type=float, default=0.3)
+    ap.add_argument("--mode", default="chunked", choices=["single", "chunked"])
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.docs, args.pages, args.latency, args.mode)
+    if args.out:
+        write_results({"cassette": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
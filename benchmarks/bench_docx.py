@@ -0,0 +1,80 @@
+# benchmarks/bench_docx.py
+"""
+Parser DOCX en streaming (app/parsers.py) frente a la implementación anterior
+con python-docx: throughput, pico de memoria (tracemalloc) y texto extraído.
+
+    python -m benchmarks.bench_docx --pages 10 100 1000 [--out results.json]
+"""
+import argparse
+import io
+import json
+import time
+import tracemalloc
+
+from app.parsers import extract_text_from_docx
+from benchmarks.common import write_results
+from benchmarks.corpus import make_docx
+
+
+def python_docx_baseline(data: bytes) -> str:
+    """Lo que hacía extract_text_from_docx antes: modelo completo y solo doc.paragraphs."""
+    from docx import Document
+
+    doc = Document(io.BytesIO(data))
+    return "\n".join(p.text for p in doc.paragraphs if p.text.strip()).strip()
+
+
+IMPLEMENTATIONS = {
+    "streaming": extract_text_from_docx,
+    "python_docx": python_docx_baseline,
+}
+
+
+def _measure(fn, data: bytes, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = fn(data)
+        timings.append(time.perf_counter() - t0)
+    # Memoria en una pasada aparte: tracemalloc ralentiza y falsearía el tiempo
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": round(peak / (1024 * 1024), 2), "text": out}
+
+
+def run(pages_list, repeats: int = 3) -> list:
+    rows = []
+    for pages in pages_list:
+        data = make_docx(pages)
+        for name, fn in IMPLEMENTATIONS.items():
+            m = _measure(fn, data, repeats)
+            row = {
+                "pages": pages,
+                "docx_kb": round(len(data) / 1024, 1),
+                "implementation": name,
+                "seconds": round(m["seconds"], 4),
+                "pages_per_s": round(pages / m["seconds"], 1),
+                "peak_mb": m["peak_mb"],
+                "chars": len(m["text"]),
+                "table_rows": sum(" | " in line for line in m["text"].split("\n")),
+            }
+            rows.append(row)
+            print(json.dumps(row))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.pages, args.repeats)
+    if args.out:
+        write_results({"docx": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
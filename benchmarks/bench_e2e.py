@@ -0,0 +1,119 @@
+# benchmarks/bench_e2e.py
+"""
+Throughput y latencia de extremo a extremo de POST /analyze contra el stub LLM.
+
+    python -m benchmarks.bench_e2e --requests 100 --concurrency 10 --latency 0.5 --format txt --pages 20
+
+Arranca el stub y uvicorn (app.main) en threads locales; cada petición lleva
+no_cache=true para medir el pipeline completo y no la caché.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+from benchmarks.common import percentiles, write_results
+from benchmarks.corpus import MAKERS
+from benchmarks.stub_llm import StubConfig, start_stub
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(stub_url: str, port: int):
+    # La configuración del motor se lee al importar: fijar el entorno antes
+    os.environ["OPENAI_BASE_URL"] = stub_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ.setdefault("RESULT_CACHE_ENABLED", "0")
+    # Todas las peticiones salen de la misma IP: sin control de admisión
+    os.environ.setdefault("ADMISSION_ENABLED", "0")
+    import uvicorn
+
+    config = uvicorn.Config("app.main:app", host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def _load(url: str, payload: bytes, filename: str, n_requests: int, concurrency: int, extra: dict):
+    import httpx
+
+    latencies, errors = [], {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        async def one():
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.post(
+                    url,
+                    files={"file": (filename, payload)},
+                    data={"lang": "en", "no_cache": "true", **extra},
+                )
+                elapsed = time.perf_counter() - t0
+                if r.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    key = str(r.status_code)
+                    errors[key] = errors.get(key, 0) + 1
+
+        t_start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n_requests)))
+        wall = time.perf_counter() - t_start
+    return latencies, errors, wall
+
+
+def run(n_requests: int, concurrency: int, latency: float, fmt: str, pages: int, mode: str = "auto") -> dict:
+    stub, stub_url = start_stub(0, StubConfig(latency=latency))
+    port = _free_port()
+    api = start_api(stub_url, port)
+    try:
+        payload = MAKERS[fmt](pages)
+        latencies, errors, wall = asyncio.run(_load(
+            f"http://127.0.0.1:{port}/analyze", payload, f"bench.{fmt}", n_requests, concurrency, {"mode": mode},
+        ))
+    finally:
+        api.should_exit = True
+        stub.shutdown()
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "stub_latency_s": latency,
+        "format": fmt,
+        "pages": pages,
+        "mode": mode,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_s": {**percentiles(latencies), "mean": round(sum(latencies) / len(latencies), 4) if latencies else None},
+        "llm_calls": stub.config.requests,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=50)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--latency", type=float, default=0.5)
+    ap.add_argument("--format", default="txt", choices=list(MAKERS))
+    ap.add_argument("--pages", type=int, default=5)
+    ap.add_argument("--mode", default="auto", choices=["auto", "single", "chunked"])
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    result = run(args.requests, args.concurrency, args.latency, args.format, args.pages, args.mode)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        write_results({"e2e": result}, args.out)
+
+
+if __name__ == "__main__":
+    main()
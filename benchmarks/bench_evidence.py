@@ -0,0 +1,101 @@
+# benchmarks/bench_evidence.py
+"""
+Verificación de citas (app/evidence.py): coste de construir el índice de
+trigramas y latencia por cita frente a un escaneo ingenuo de todas las
+páginas por cita, con citas literales, con palabras omitidas/insertadas y con
+la página declarada mal.
+
+    python -m benchmarks.bench_evidence --pages 10 100 1000 --quotes 20
+"""
+import argparse
+import json
+import random
+import time
+
+from app.evidence import EvidenceIndex, verify_risks, _words, NGRAM
+from benchmarks.common import percentiles, write_results
+from benchmarks.corpus import make_txt
+
+
+def make_risks(pages, n: int, seed: int = 0):
+    rng = random.Random(seed)
+    risks = []
+    for k in range(n):
+        page = rng.randrange(len(pages))
+        words = pages[page]["text"].split()
+        start = rng.randrange(max(1, len(words) - 20))
+        quote = words[start:start + 15]
+        if k % 3 == 1:
+            del quote[5]
+            quote.insert(9, "zusätzlich")
+        reported = page + 1 if k % 2 == 0 else rng.randrange(len(pages)) + 1
+        risks.append({"risk": f"r{k}", "page": reported, "evidence": " ".join(quote), "_true_page": page + 1})
+    return risks
+
+
+def naive_locate(pages, quote: str):
+    """Sin índice: trigramas de cada página, recalculados para cada cita."""
+    words = _words(quote)
+    grams = set(zip(*(words[k:] for k in range(NGRAM))))
+    best, best_page = 0, None
+    for p in pages:
+        w = _words(p["text"])
+        hits = len(grams & set(zip(*(w[k:] for k in range(NGRAM)))))
+        if hits > best:
+            best, best_page = hits, p["page"]
+    return best_page
+
+
+def run(page_counts, n_quotes: int = 20) -> list:
+    EvidenceIndex([{"page": 1, "text": "warm up numpy import"}])
+    rows = []
+    for n in page_counts:
+        pages = [{"page": i + 1, "text": t} for i, t in enumerate(make_txt(n).decode().split("\n\n"))]
+        risks = make_risks(pages, n_quotes)
+        originals = [dict(r) for r in risks]
+
+        t0 = time.perf_counter()
+        index = EvidenceIndex(pages)
+        build_s = time.perf_counter() - t0
+
+        per_quote = []
+        for r in risks:
+            t0 = time.perf_counter()
+            index.verify(r)
+            per_quote.append((time.perf_counter() - t0) * 1000)
+        summary = verify_risks(index, {"intuitive_risks": originals}, ("intuitive_risks",))
+        correct = sum(r["page"] == r["_true_page"] for r in risks)
+
+        naive = []
+        for r in risks[:min(5, len(risks))]:
+            t0 = time.perf_counter()
+            naive_locate(pages, r["evidence"])
+            naive.append(time.perf_counter() - t0)
+
+        row = {
+            "pages": n,
+            "quotes": n_quotes,
+            "build_ms": round(build_s * 1000, 2),
+            "per_quote_ms": percentiles(per_quote),
+            "naive_per_quote_ms": round(sum(naive) / len(naive) * 1000, 2),
+            "page_correct_rate": round(correct / n_quotes, 3),
+            "outcomes": summary,
+        }
+        print(json.dumps(row))
+        rows.append(row)
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--quotes", type=int, default=20)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.pages, args.quotes)
+    if args.out:
+        write_results({"evidence": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
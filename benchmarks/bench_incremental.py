@@ -0,0 +1,91 @@
+# benchmarks/bench_incremental.py
+"""
+Re-análisis de una revisión (app/fingerprints.py): se analiza la versión 1
+de un documento y después una revisión con --changed páginas reescritas y
+una página insertada, con y sin reutilización por huellas de página.
+
+    python -m benchmarks.bench_incremental --pages 60 --changed 3
+
+Por escenario: llamadas al LLM, tokens, caracteres de prompt, segundos y
+riesgos reutilizados/nuevos de la revisión.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import write_results
+from benchmarks.corpus import make_txt
+from benchmarks.stub_llm import StubConfig, start_stub
+
+
+def make_revision(n_pages: int, changed: int) -> bytes:
+    """Reescribe `changed` páginas repartidas por el documento (desde la 1) e inserta una nueva a mitad."""
+    blocks = make_txt(n_pages).decode().split("\n\n")
+    step = max(1, n_pages // max(1, changed))
+    for i in range(changed):
+        blocks[min(n_pages - 1, i * step)] = make_txt(1, seed=100 + i).decode()
+    blocks.insert(n_pages // 2, make_txt(1, seed=999).decode())
+    return "\n\n".join(blocks).encode()
+
+
+async def _scenario(name: str, v1: bytes, v2: bytes) -> dict:
+    from app import fingerprints, pipeline
+    from app.cache import ResultCache
+    from app.metrics import begin_request
+
+    tmp = tempfile.mkdtemp()
+    fingerprints.fingerprint_index = pipeline.fingerprint_index = fingerprints.FingerprintIndex(
+        os.path.join(tmp, "fp.sqlite3"))
+    pipeline.result_cache = ResultCache(db_path=os.path.join(tmp, "cache.sqlite3"), enabled=True)
+    pipeline.INCREMENTAL_ENABLED = name == "incremental"
+
+    await pipeline.run_analysis(v1, "v1.txt", context="Bahn", lang="en", mode="chunked")
+    metrics = begin_request()
+    t0 = time.perf_counter()
+    result = await pipeline.run_analysis(v2, "v2.txt", context="Bahn", lang="en", mode="chunked")
+    seconds = time.perf_counter() - t0
+    summary = metrics.summary()
+    incremental = result["_debug"].get("incremental", {})
+    return {
+        "scenario": name,
+        "llm_calls": summary["llm_calls"],
+        "tokens": sum(summary["tokens"].values()),
+        "prompt_chars": summary["prompt_chars"],
+        "seconds": round(seconds, 3),
+        "pages_changed": len(incremental.get("pages_changed", [])),
+        "risks_reused": incremental.get("risks_reused", 0),
+        "risks_new": incremental.get("risks_new", 0),
+    }
+
+
+def run(pages: int = 60, changed: int = 3, latency: float = 0.2) -> list:
+    server, url = start_stub(0, StubConfig(latency=latency))
+    os.environ["OPENAI_BASE_URL"] = url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    v1, v2 = make_txt(pages), make_revision(pages, changed)
+    rows = []
+    for name in ("full", "incremental"):
+        row = {"pages": pages, "changed": changed, **asyncio.run(_scenario(name, v1, v2))}
+        print(json.dumps(row))
+        rows.append(row)
+    server.shutdown()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, default=60)
+    ap.add_argument("--changed", type=int, default=3)
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.pages, args.changed, args.latency)
+    if args.out:
+        write_results({"incremental": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
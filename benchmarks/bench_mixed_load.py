@@ -0,0 +1,119 @@
+# benchmarks/bench_mixed_load.py
+"""
+Latencia bajo carga mixta de subidas: PDFs con extracción CPU-bound
+(pdfplumber, ~0,2 s por página) mezclados con .txt pequeños, con la
+extracción en el event loop (PARSE_WORKERS=0, comportamiento previo) y en
+el parse_pool.
+
+    python -m benchmarks.bench_mixed_load --heavy 6 --light 60 --pdf-pages 10 --workers 2
+
+Por escenario: percentiles de latencia de cada clase de petición, rechazos
+503 (cola llena) y espera media en la cola de extracción.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.bench_e2e import _free_port, start_api
+from benchmarks.common import percentiles, write_results
+from benchmarks.corpus import make_pdf, make_txt
+from benchmarks.stub_llm import StubConfig, start_stub
+
+
+async def _load(url: str, heavy: int, light: int, pdf: bytes, txt: bytes, concurrency: int, pdf_engine: str) -> dict:
+    import httpx
+
+    latencies = {"heavy": [], "light": []}
+    errors = {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        async def one(kind: str, delay: float):
+            await asyncio.sleep(delay)
+            async with sem:
+                if kind == "heavy":
+                    payload, filename, extra = pdf, "big.pdf", {"pdf_engine": pdf_engine}
+                else:
+                    payload, filename, extra = txt, "small.txt", {}
+                t0 = time.perf_counter()
+                r = await client.post(url, files={"file": (filename, payload)},
+                                      data={"lang": "en", "no_cache": "true", **extra})
+                elapsed = time.perf_counter() - t0
+            if r.status_code == 200:
+                latencies[kind].append(elapsed)
+            else:
+                key = f"{kind}_{r.status_code}"
+                errors[key] = errors.get(key, 0) + 1
+
+        # Llegadas repartidas en ~3 s: los PDFs se intercalan con los .txt
+        tasks = [one("heavy", i * 3 / max(1, heavy)) for i in range(heavy)]
+        tasks += [one("light", i * 3 / max(1, light)) for i in range(light)]
+        t0 = time.perf_counter()
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+    return {
+        "wall_s": round(wall, 3),
+        "heavy_latency_s": percentiles(latencies["heavy"]),
+        "light_latency_s": percentiles(latencies["light"]),
+        "errors": errors,
+    }
+
+
+def run(heavy: int = 6, light: int = 60, pdf_pages: int = 10, workers: int = 2, queue_depth: int = 16,
+        concurrency: int = 32, latency: float = 0.05, pdf_engine: str = "pdfplumber") -> list:
+    from app.parse_pool import parse_pool, PARSE_WAIT_SECONDS
+
+    stub, stub_url = start_stub(0, StubConfig(latency=latency))
+    port = _free_port()
+    api = start_api(stub_url, port)
+    pdf, txt = make_pdf(pdf_pages), make_txt(2)
+    rows = []
+    try:
+        for name, n_workers in (("inline", 0), ("pool", workers)):
+            parse_pool.shutdown()
+            parse_pool.workers, parse_pool.queue_depth = n_workers, queue_depth
+            PARSE_WAIT_SECONDS._series.clear()
+            row = asyncio.run(_load(f"http://127.0.0.1:{port}/analyze", heavy, light, pdf, txt,
+                                  concurrency, pdf_engine))
+            waits = PARSE_WAIT_SECONDS._series.get((), [None, 0.0, 0])
+            row = {
+                "scenario": name,
+                "workers": n_workers,
+                "queue_depth": queue_depth if n_workers else None,
+                "heavy": heavy,
+                "light": light,
+                "pdf_pages": pdf_pages,
+                "pdf_engine": pdf_engine,
+                **row,
+                "parse_wait_mean_s": round(waits[1] / waits[2], 4) if waits[2] else None,
+            }
+            print(json.dumps(row))
+            rows.append(row)
+    finally:
+        parse_pool.shutdown()
+        api.should_exit = True
+        stub.shutdown()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--heavy", type=int, default=6)
+    ap.add_argument("--light", type=int, default=60)
+    ap.add_argument("--pdf-pages", type=int, default=10)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--queue-depth", type=int, default=16)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--latency", type=float, default=0.05)
+    ap.add_argument("--pdf-engine", default="pdfplumber", choices=["auto", "pypdf", "pdfplumber"])
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.heavy, args.light, args.pdf_pages, args.workers, args.queue_depth, args.concurrency, args.latency,
+               args.pdf_engine)
+    if args.out:
+        write_results({"mixed_load": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
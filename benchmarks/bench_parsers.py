@@ -0,0 +1,64 @@
+# benchmarks/bench_parsers.py
+"""
+Throughput de cada parser de app/parsers.py sobre el corpus sintético.
+
+    python -m benchmarks.bench_parsers --pages 1 10 100 [--out results.json]
+"""
+import argparse
+import json
+import time
+
+from app.parsers import extract_text_from_pdf, extract_text_from_docx, extract_text_from_txt
+from benchmarks.common import write_results
+from benchmarks.corpus import MAKERS
+
+PARSERS = {
+    # workers=1: mide el parser en sí; el escalado va en bench_pdf_parallel
+    "pdf": lambda data: extract_text_from_pdf(data, workers=1),
+    "docx": extract_text_from_docx,
+    "txt": extract_text_from_txt,
+}
+
+
+def _chars(out) -> int:
+    return sum(len(p["text"]) for p in out) if isinstance(out, list) else len(out)
+
+
+def run(pages_list, formats, repeats: int = 3) -> list:
+    rows = []
+    for fmt in formats:
+        for pages in pages_list:
+            data = MAKERS[fmt](pages)
+            timings = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                out = PARSERS[fmt](data)
+                timings.append(time.perf_counter() - t0)
+            best = min(timings)
+            rows.append({
+                "format": fmt,
+                "pages": pages,
+                "bytes": len(data),
+                "chars": _chars(out),
+                "seconds": round(best, 6),
+                "pages_per_s": round(pages / best, 1),
+                "mb_per_s": round(len(data) / best / 1e6, 2),
+            })
+            print(json.dumps(rows[-1]))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--formats", nargs="+", default=list(PARSERS), choices=list(PARSERS))
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.pages, args.formats, args.repeats)
+    if args.out:
+        write_results({"parsers": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_pdf_engines.py
+"""
+Páginas/s y paridad de salida de cada motor PDF (pypdf, pdfplumber, auto).
+La paridad se mide contra pdfplumber (el motor de referencia) como Jaccard
+de palabras por página.
+
+    python -m benchmarks.bench_pdf_engines --pages 10 100 [--pdf contrato.pdf ...] [--out results.json]
+"""
+import argparse
+import json
+import time
+from collections import Counter
+
+from app.parsers import extract_text_from_pdf, PDF_ENGINE_CHOICES
+from benchmarks.common import write_results
+from benchmarks.corpus import make_pdf
+
+REFERENCE_ENGINE = "pdfplumber"
+
+
+def _similarity(a: str, b: str) -> float:
+    wa, wb = set(a.split()), set(b.split())
+    if not wa and not wb:
+        return 1.0
+    return len(wa & wb) / len(wa | wb)
+
+
+def run_document(name: str, data, engines=PDF_ENGINE_CHOICES, repeats: int = 1) -> list:
+    outputs, rows = {}, []
+    for engine in engines:
+        timings = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            out = extract_text_from_pdf(data, workers=1, engine=engine)
+            timings.append(time.perf_counter() - t0)
+        outputs[engine] = out
+        best = min(timings)
+        rows.append({
+            "document": name,
+            "engine": engine,
+            "pages": len(out),
+            "seconds": round(best, 3),
+            "pages_per_s": round(len(out) / best, 1) if best else None,
+            "chars": sum(len(p["text"]) for p in out),
+            "pages_by_engine": dict(Counter(p["engine"] for p in out)),
+        })
+
+    reference = outputs.get(REFERENCE_ENGINE)
+    for row in rows:
+        if reference is None:
+            break
+        sims = [_similarity(p["text"], r["text"]) for p, r in zip(outputs[row["engine"]], reference)]
+        row["parity_mean"] = round(sum(sims) / len(sims), 4) if sims else None
+        row["parity_min"] = round(min(sims), 4) if sims else None
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+
+def run(pages_list, pdf_paths=(), repeats: int = 1) -> list:
+    rows = []
+    for pages in pages_list:
+        rows.extend(run_document(f"synthetic-{pages}p", make_pdf(pages), repeats=repeats))
+    for path in pdf_paths:
+        rows.extend(run_document(path, path, repeats=repeats))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, nargs="*", default=[10, 100])
+    ap.add_argument("--pdf", nargs="*", default=[], help="PDFs reales adicionales")
+    ap.add_argument("--repeats", type=int, default=1)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.pages, args.pdf, args.repeats)
+    if args.out:
+        write_results({"pdf_engines": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
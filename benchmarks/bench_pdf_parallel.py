@@ -0,0 +1,51 @@
+# benchmarks/bench_pdf_parallel.py
+"""
+Escalado de extract_text_from_pdf con 1/2/4/8 workers.
+
+    python -m benchmarks.bench_pdf_parallel --pages 300 --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import time
+
+from app.parsers import extract_text_from_pdf
+from benchmarks.corpus import make_pdf
+
+
+def run(pages: int, workers_list, repeats: int) -> dict:
+    pdf = make_pdf(pages)
+    baseline = None
+    results = []
+    for workers in workers_list:
+        timings = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            out = extract_text_from_pdf(pdf, workers=workers, min_pages=1)
+            timings.append(time.perf_counter() - t0)
+        if baseline is None:
+            baseline = out
+        best = min(timings)
+        results.append({
+            "workers": workers,
+            "seconds": round(best, 3),
+            "pages_per_s": round(pages / best, 1),
+            "identical_output": out == baseline,
+        })
+    serial = results[0]["seconds"]
+    for r in results:
+        r["speedup"] = round(serial / r["seconds"], 2)
+    return {"benchmark": "pdf_parallel", "pages": pages, "cpu_count": os.cpu_count(), "results": results}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--pages", type=int, default=200)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--repeats", type=int, default=2)
+    args = ap.parse_args()
+    print(json.dumps(run(args.pages, args.workers, args.repeats), indent=2))
+
+
+if __name__ == "__main__":
+    main()
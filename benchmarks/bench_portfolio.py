@@ -0,0 +1,133 @@
+# benchmarks/bench_portfolio.py
+"""
+Cartera en columnas (app/portfolio.py) con N riesgos guardados:
+  - append de un lote (segmento .npz nuevo; incluye las compactaciones).
+  - Carga en frío desde disco y recálculo de columnas tras un append.
+  - GET /portfolio/stats (sin HTTP): sin filtros, por idioma y por tipo.
+  - Referencia: los mismos agregados con pandas construyendo el DataFrame
+    desde los resultados, como hace hoy la página de Streamlit.
+
+    python -m benchmarks.bench_portfolio --risks 10000 100000 --batch 50
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from app.portfolio import PortfolioStore, risk_theme
+from benchmarks.common import percentiles, write_results
+from benchmarks.corpus import make_lines
+
+RISKS_PER_ANALYSIS = 10
+
+
+def _records(n_analyses: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    countermeasures = [f"Countermeasure {i}: " + make_lines(rng, 1, 6)[0] for i in range(500)]
+    weights = [1 / (i + 1) for i in range(len(countermeasures))]
+
+    def risk():
+        title, justification = make_lines(rng, 2, 8)
+        return {"risk": title, "justification": justification, "evidence": "",
+                "countermeasure": rng.choices(countermeasures, weights)[0], "page": rng.randint(1, 120)}
+
+    half = RISKS_PER_ANALYSIS // 2
+    return [
+        {
+            "cache_key": f"bench-{i}",
+            "file_sha256": f"{i % (n_analyses // 2 or 1):064x}",  # cada documento, en dos idiomas
+            "filename": f"project{i}.pdf",
+            "lang": ("de", "en", "es")[i % 3],
+            "pages": 120,
+            "created_at": time.time(),
+            "risks": {"intuitive_risks": [risk() for _ in range(half)],
+                      "counterintuitive_risks": [risk() for _ in range(half)]},
+        }
+        for i in range(n_analyses)
+    ]
+
+
+def _pandas_stats(records: list) -> dict:
+    import pandas as pd
+
+    frames = []
+    for record in records:
+        for name in ("intuitive_risks", "counterintuitive_risks"):
+            df = pd.DataFrame(record["risks"][name])
+            df["kind"], df["lang"], df["file"] = name, record["lang"], record["file_sha256"]
+            frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    df["theme"] = [risk_theme(r) for r in df[["risk", "justification"]].to_dict("records")]
+    return {
+        "by_theme": df.groupby(["theme", "kind"]).size().to_dict(),
+        "by_lang": df.groupby(["lang", "theme"]).size().to_dict(),
+        "countermeasures": df["countermeasure"].str.lower().value_counts().head(20).to_dict(),
+        "heatmap": df.groupby(["file", "theme"]).size().unstack(fill_value=0).head(20).to_dict(),
+    }
+
+
+def run(sizes=(10000, 100000), batch: int = 50, repeats: int = 20) -> list:
+    rows = []
+    for size in sizes:
+        records = _records(size // RISKS_PER_ANALYSIS)
+        path = tempfile.mkdtemp()
+        store = PortfolioStore(path)
+        append_ms = []
+        for i in range(0, len(records), batch):
+            t0 = time.perf_counter()
+            store.append(records[i:i + batch])
+            append_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        cold = PortfolioStore(path)
+        cold.columns()
+        load_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        cold.append(records[:batch])  # re-análisis: sustituye, no suma
+        cold.columns()
+        refresh_ms = (time.perf_counter() - t0) * 1000
+
+        row = {
+            "risks": size,
+            "batch": batch,
+            "segments": len(cold._files),
+            "append_ms": percentiles(append_ms),
+            "cold_load_ms": round(load_ms, 2),
+            "refresh_after_append_ms": round(refresh_ms, 2),
+            "stats_ms": {},
+        }
+        for name, params in (("all", {}), ("lang", {"lang": "de"}), ("kind", {"kind": "counterintuitive"})):
+            samples = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                stats = cold.stats(**params)
+                samples.append((time.perf_counter() - t0) * 1000)
+            row["stats_ms"][name] = percentiles(samples)
+            if name == "all":
+                row["counted_risks"] = stats["risks"]
+        try:
+            t0 = time.perf_counter()
+            _pandas_stats(records)
+            row["pandas_from_results_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        except ImportError:
+            row["pandas_from_results_ms"] = None  # pandas solo se instala con la UI
+        print(json.dumps(row))
+        rows.append(row)
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--risks", type=int, nargs="+", default=[10000, 100000])
+    ap.add_argument("--batch", type=int, default=50)
+    ap.add_argument("--repeats", type=int, default=20)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.risks, args.batch, args.repeats)
+    if args.out:
+        write_results({"portfolio": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
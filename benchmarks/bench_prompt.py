@@ -0,0 +1,62 @@
+# benchmarks/bench_prompt.py
+"""
+Coste de construir el prompt (lo que hace generate_risks antes de llamar al LLM),
+incluida la selección de pasajes por relevancia del modo single.
+
+    python -m benchmarks.bench_prompt --pages 10 100 1000
+"""
+import argparse
+import json
+import random
+import timeit
+
+from app import risk_engine, ranking
+from benchmarks.common import write_results
+from benchmarks.corpus import make_lines
+
+
+def synthetic_pages(n_pages: int, lines_per_page: int = 45):
+    rng = random.Random(0)
+    return [{"page": i + 1, "text": "\n".join(make_lines(rng, lines_per_page))} for i in range(n_pages)]
+
+
+def _per_call_ms(fn, number: int) -> float:
+    return round(min(timeit.repeat(fn, number=number, repeat=3)) / number * 1000, 4)
+
+
+def run(pages_list, context: str = "Fokus auf Genehmigungen und Bauzeit") -> list:
+    rows = []
+    for n in pages_list:
+        pages = synthetic_pages(n)
+        joined = risk_engine.format_pages(pages)
+        number = max(1, 2000 // n)
+        row = {
+            "pages": n,
+            "chars": len(joined),
+            "format_pages_ms": _per_call_ms(lambda: risk_engine.format_pages(pages), number),
+            "take_within_budget_ms": _per_call_ms(
+                lambda: risk_engine.take_pages_within_budget(iter(pages)), number),
+            "build_messages_ms": _per_call_ms(
+                lambda: risk_engine._build_messages(joined, context, "de"), number),
+            "select_passages_ms": _per_call_ms(
+                lambda: ranking.select_passages(pages, context, risk_engine.MAX_PROMPT_CHARS), number),
+            "split_into_windows_ms": _per_call_ms(lambda: risk_engine.split_into_windows(pages), number),
+            "windows": len(risk_engine.split_into_windows(pages)),
+        }
+        rows.append(row)
+        print(json.dumps(row))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.pages)
+    if args.out:
+        write_results({"prompt": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
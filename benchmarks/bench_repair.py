@@ -0,0 +1,113 @@
+# benchmarks/bench_repair.py
+"""
+Salida JSON defectuosa del modelo (stub con --malformed-rate): reparación
+local + re-ask de los riesgos que faltan frente al comportamiento anterior
+(parseo estricto; cualquier defecto obliga a repetir el análisis completo).
+
+    python -m benchmarks.bench_repair --analyses 50 --malformed-rate 0.3
+
+Por escenario: análisis completos (5 + 5), llamadas al LLM y tokens por
+análisis y latencia p50/p95.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.common import percentiles, write_results
+from benchmarks.corpus import make_txt
+from benchmarks.stub_llm import StubConfig, start_stub
+
+MAX_FULL_RUNS = 3
+
+
+def _strict_ok(content: str) -> bool:
+    """El _parse_risks de antes: JSON exacto y todas las claves en cada riesgo."""
+    from app.risk_engine import REQUIRED_KEYS
+
+    try:
+        data = json.loads(content)
+        return all(
+            isinstance(data.get(k), list) and len(data[k]) == 5
+            and all(all(key in r for key in REQUIRED_KEYS) for r in data[k])
+            for k in ("intuitive_risks", "counterintuitive_risks")
+        )
+    except (ValueError, AttributeError, TypeError):
+        return False
+
+
+async def _strict(text: str) -> bool:
+    from app import risk_engine
+
+    for _ in range(MAX_FULL_RUNS):
+        content = await risk_engine._achat_completion(risk_engine._build_messages(text, "", "en"))
+        if _strict_ok(content):
+            return True
+    return False
+
+
+async def _repair(text: str) -> bool:
+    from app import risk_engine
+
+    data = await risk_engine.agenerate_risks(text, context="", lang="en")
+    return len(data["intuitive_risks"]) == 5 and len(data["counterintuitive_risks"]) == 5
+
+
+async def _run(name: str, fn, text: str, analyses: int) -> dict:
+    from app.metrics import begin_request
+
+    complete, calls, tokens, latencies = 0, [], [], []
+    for _ in range(analyses):
+        metrics = begin_request()
+        t0 = time.perf_counter()
+        try:
+            complete += bool(await fn(text))
+        except Exception:
+            pass
+        latencies.append(time.perf_counter() - t0)
+        summary = metrics.summary()
+        calls.append(summary["llm_calls"])
+        tokens.append(sum(summary["tokens"].values()))
+    return {
+        "scenario": name,
+        "analyses": analyses,
+        "complete_rate": round(complete / analyses, 4),
+        "llm_calls_per_analysis": round(sum(calls) / analyses, 3),
+        "tokens_per_analysis": round(sum(tokens) / analyses, 1),
+        "latency_s": percentiles(latencies),
+    }
+
+
+def run(analyses: int = 50, malformed_rate: float = 0.3, pages: int = 10, latency: float = 0.02) -> list:
+    server, url = start_stub(0, StubConfig(latency=latency, malformed_rate=malformed_rate, seed=7))
+    os.environ["OPENAI_BASE_URL"] = url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    from app.risk_engine import format_pages
+
+    blocks = make_txt(pages).decode().split("\n\n")
+    text = format_pages([{"page": i + 1, "text": t} for i, t in enumerate(blocks)])
+    rows = []
+    for name, fn in (("strict_rerun", _strict), ("repair_reask", _repair)):
+        row = asyncio.run(_run(name, fn, text, analyses))
+        row["malformed_rate"] = malformed_rate
+        print(json.dumps(row))
+        rows.append(row)
+    server.shutdown()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--analyses", type=int, default=50)
+    ap.add_argument("--malformed-rate", type=float, default=0.3)
+    ap.add_argument("--pages", type=int, default=10)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.analyses, args.malformed_rate, args.pages)
+    if args.out:
+        write_results({"repair": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/bench_resilience.py
+"""
+Transporte del LLM (app/transport.py) contra el stub con fallos inyectados:
+tasa de éxito, latencia p50/p95/p99 y peticiones reales al upstream (coste)
+con y sin reintentos, con hedging y durante una caída (circuit breaker).
+
+    python -m benchmarks.bench_resilience --calls 200 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.transport import Transport, CircuitBreaker, LLMTransportError
+from benchmarks.common import percentiles, write_results
+from benchmarks.stub_llm import StubConfig, start_stub
+
+MESSAGES = [{"role": "user", "content": "[Página 1] Vertragsstrafe bei Verzug"}]
+
+FAULTS = dict(latency=0.05, jitter=0.02, error_rate=0.1, rate_limit_rate=0.05, retry_after=0.2,
+              slow_rate=0.05, slow_latency=1.5)
+
+SCENARIOS = {
+    "no_retries": dict(faults=FAULTS, transport=dict(max_retries=0, hedge=False), breaker=0),
+    "retries": dict(faults=FAULTS, transport=dict(max_retries=3, hedge=False), breaker=0),
+    "retries_hedge": dict(faults=FAULTS, transport=dict(max_retries=3, hedge=True), breaker=0),
+    "outage_breaker": dict(faults=dict(latency=0.05, fail_first=10 ** 9), transport=dict(max_retries=3, hedge=False),
+                           breaker=5),
+}
+
+
+async def _run(name: str, spec: dict, calls: int, concurrency: int) -> dict:
+    from openai import AsyncOpenAI
+
+    server, url = start_stub(0, StubConfig(**spec["faults"]))
+    client = AsyncOpenAI(api_key="stub", base_url=url, max_retries=0)
+    transport = Transport(attempt_timeout=5, deadline=10,
+                          breaker=CircuitBreaker(failures=spec["breaker"], reset_s=30), **spec["transport"])
+    # Calentamiento: el hedging necesita muestras de latencia para su p95
+    for _ in range(20):
+        try:
+            await transport.acall(lambda t: client.chat.completions.create(model="stub", messages=MESSAGES, timeout=t),
+                                  hedge=False)
+        except Exception:
+            pass
+    server.config.requests = 0
+
+    latencies, outcomes = [], {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await transport.acall(
+                    lambda t: client.chat.completions.create(model="stub", messages=MESSAGES, timeout=t))
+                outcome = "ok"
+            except LLMTransportError as e:
+                outcome = e.error_code
+            except Exception as e:
+                outcome = type(e).__name__
+            latencies.append(time.perf_counter() - t0)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    elapsed = time.perf_counter() - t0
+    await client.close()
+    server.shutdown()
+    row = {
+        "scenario": name,
+        "calls": calls,
+        "success_rate": round(outcomes.get("ok", 0) / calls, 4),
+        "outcomes": outcomes,
+        "latency_s": percentiles(latencies),
+        "upstream_requests": server.config.requests,
+        "faults_injected": server.config.faults,
+        "circuit_state": transport.breaker.state,
+        "seconds": round(elapsed, 2),
+    }
+    print(json.dumps(row))
+    return row
+
+
+def run(calls: int = 200, concurrency: int = 10, scenarios=None) -> list:
+    return [asyncio.run(_run(name, SCENARIOS[name], calls, concurrency)) for name in (scenarios or SCENARIOS)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--scenarios", nargs="*", choices=list(SCENARIOS))
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.calls, args.concurrency, args.scenarios)
+    if args.out:
+        write_results({"resilience": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# benchmarks/bench_risk_library.py
+"""
+Biblioteca de riesgos (app/risk_library.py):
+  - Coste de submit() en la petición (solo encolar) y rendimiento de la
+    escritura por lotes (análisis/s y riesgos/s).
+  - Latencia de GET /risks/search (la consulta SQLite, sin HTTP) con 1k, 10k
+    y 100k riesgos: una palabra, dos palabras, prefijo, con filtro de idioma
+    y una página profunda (offset 200).
+El texto sale de un vocabulario con distribución de Zipf: el vocabulario del
+corpus más --vocab términos de relleno. Con --vocab 0 quedan solo las ~80
+palabras del corpus y cada palabra aparece en la mitad de los riesgos (peor
+caso: hay que ordenar por relevancia decenas de miles de coincidencias).
+
+    python -m benchmarks.bench_risk_library --sizes 1000 10000 100000 --queries 200 --vocab 5000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from app.risk_library import RiskLibrary
+from benchmarks.common import percentiles, write_results
+from benchmarks.corpus import WORDS
+
+RISKS_PER_ANALYSIS = 10
+
+
+class Vocabulary:
+    """Palabras del corpus primero (las más frecuentes) y términos de relleno en la cola."""
+
+    def __init__(self, extra: int):
+        self.words = [w.lower() for w in WORDS] + [f"term{i}" for i in range(extra)]
+        self.weights = [1 / (rank + 1) for rank in range(len(self.words))]
+
+    def line(self, rng: random.Random, n: int) -> str:
+        return " ".join(rng.choices(self.words, self.weights, k=n))
+
+    def query_word(self, rng: random.Random) -> str:
+        # Consultas sobre términos de frecuencia media, como las de un usuario
+        return rng.choice(self.words[len(self.words) // 50:len(self.words) // 5] or self.words)
+
+
+def _record(rng: random.Random, vocab: Vocabulary, i: int) -> dict:
+    def risk():
+        title, justification, countermeasure, evidence = (vocab.line(rng, 10) for _ in range(4))
+        return {"risk": title[:80], "justification": justification, "countermeasure": countermeasure,
+                "evidence": evidence, "page": rng.randint(1, 200)}
+
+    half = RISKS_PER_ANALYSIS // 2
+    return {
+        "cache_key": f"bench-{i}",
+        "analysis_key": f"bench-{i}",
+        "file_sha256": f"{i:064x}",
+        "filename": f"doc{i}.pdf",
+        "lang": rng.choice(("de", "en", "es")),
+        "mode": "chunked",
+        "context": "Bahn",
+        "created_at": time.time(),
+        "risks": {"intuitive_risks": [risk() for _ in range(half)],
+                  "counterintuitive_risks": [risk() for _ in range(half)]},
+    }
+
+
+def _queries(rng: random.Random, vocab: Vocabulary):
+    word = lambda: vocab.query_word(rng)  # noqa: E731
+    return {
+        "one_word": lambda: ({"q": word()}),
+        "two_words": lambda: ({"q": f"{word()} {word()}"}),
+        "prefix": lambda: ({"q": word()[:-1]}),
+        "lang_filter": lambda: ({"q": word(), "lang": "de"}),
+        "deep_page": lambda: ({"q": word(), "offset": 200}),
+    }
+
+
+def run(sizes=(1000, 10000, 100000), n_queries: int = 200, extra_vocab: int = 5000) -> list:
+    rng = random.Random(0)
+    vocab = Vocabulary(extra_vocab)
+    rows = []
+    for size in sizes:
+        lib = RiskLibrary(os.path.join(tempfile.mkdtemp(), "risk_library.sqlite3"), max_pending=size)
+        lib._writer = False  # sin thread escritor: se vuelca a mano para medir la escritura
+        records = [_record(rng, vocab, i) for i in range(size // RISKS_PER_ANALYSIS)]
+
+        submit_us = []
+        for record in records:
+            t0 = time.perf_counter()
+            lib.submit(record)
+            submit_us.append((time.perf_counter() - t0) * 1e6)
+        t0 = time.perf_counter()
+        while lib._pending:
+            batch = lib._pending[:lib.batch_size]
+            del lib._pending[:lib.batch_size]
+            lib._write(batch)
+        ingest_s = time.perf_counter() - t0
+
+        row = {
+            "risks": size,
+            "vocabulary": len(vocab.words),
+            "submit_us": percentiles(submit_us),
+            "ingest_analyses_per_s": round(len(records) / ingest_s),
+            "ingest_risks_per_s": round(size / ingest_s),
+            "db_bytes": os.path.getsize(lib.path),
+            "search_ms": {},
+        }
+        for name, make in _queries(random.Random(1), vocab).items():
+            samples, hits = [], 0
+            for _ in range(n_queries):
+                params = make()
+                t0 = time.perf_counter()
+                found = lib.search(**params)
+                samples.append((time.perf_counter() - t0) * 1000)
+                hits += found["total"]
+            row["search_ms"][name] = {**percentiles(samples), "avg_total": round(hits / n_queries)}
+        print(json.dumps(row))
+        rows.append(row)
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--vocab", type=int, default=5000, help="términos de relleno además del corpus")
+    ap.add_argument("--out")
+    args = ap.parse_args()
+    rows = run(args.sizes, args.queries, args.vocab)
+    if args.out:
+        write_results({"risk_library": rows}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/bench_startup.py
+"""
+Tiempo de arranque de la API (estilo `python -X importtime`) con presupuesto.
+
+    python -m benchmarks.bench_startup [--budget-ms 800] [--runs 5]
+
+Sale con código 1 si la mediana supera el presupuesto o si importar app.main
+carga módulos pesados que deben ser perezosos (openai, httpx, pdfplumber...).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+TARGET = "app.main"
+LAZY_MODULES = ("openai", "httpx", "pdfplumber", "pdfminer", "docx", "PyPDF2", "numpy")
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "800"))
+
+
+def _env():
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)  # el arranque no debe necesitarla
+    return env
+
+
+def import_profile(target: str = TARGET):
+    """Ejecuta `python -X importtime -c 'import target'` y parsea el informe."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True, text=True, env=_env(), check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [p.strip() for p in line[len("import time:"):].split("|")]
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return rows
+
+
+def loaded_lazy_modules(target: str = TARGET):
+    code = (
+        f"import sys, json, {target}; "
+        f"print(json.dumps(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules)))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=_env(), check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    totals, last = [], []
+    for _ in range(args.runs):
+        last = import_profile()
+        target_row = next(r for r in last if r["module"] == TARGET)
+        totals.append(target_row["cumulative_us"] / 1000)
+
+    median_ms = statistics.median(totals)
+    lazy_loaded = loaded_lazy_modules()
+    top = sorted(last, key=lambda r: r["self_us"], reverse=True)[: args.top]
+    report = {
+        "benchmark": "startup",
+        "target": TARGET,
+        "runs_ms": [round(t, 1) for t in totals],
+        "median_ms": round(median_ms, 1),
+        "budget_ms": args.budget_ms,
+        "within_budget": median_ms <= args.budget_ms,
+        "heavy_modules_loaded": lazy_loaded,
+        "top_self_us": top,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["within_budget"] and not lazy_loaded else 1)
+
+
+if __name__ == "__main__":
+    main()
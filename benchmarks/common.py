@@ -0,0 +1,45 @@
+# benchmarks/common.py
+"""Utilidades compartidas por los benchmarks: percentiles y salida JSON."""
+import json
+import os
+import platform
+import subprocess
+import time
+
+
+def percentiles(samples, ps=(50, 95, 99)) -> dict:
+    """Percentiles por rango más cercano (suficiente para comparar entre commits)."""
+    if not samples:
+        return {f"p{p}": None for p in ps}
+    ordered = sorted(samples)
+    out = {}
+    for p in ps:
+        idx = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        out[f"p{p}"] = round(ordered[idx], 4)
+    return out
+
+
+def git_sha() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment() -> dict:
+    return {
+        "git_sha": git_sha(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(results: dict, out_path: str) -> None:
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump({"env": environment(), **results}, f, indent=2, ensure_ascii=False)
+    print(f"results → {out_path}")
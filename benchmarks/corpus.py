@@ -0,0 +1,162 @@
+# benchmarks/corpus.py
+"""
+Generador de documentos sintéticos PDF/DOCX/TXT para benchmarks (sin
+dependencias extra). Una "página" DOCX/TXT equivale al texto de una página PDF.
+
+    python -m benchmarks.corpus --pages 1 10 100 1000 --out .data/corpus
+"""
+import argparse
+import io
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+WORDS = (
+    "Planfeststellung Trasse Gleis Weiche Brücke Tunnel Oberleitung Stellwerk Bauzeit "
+    "Vergabe Nachtrag Sperrpause Baugrund Lärmschutz Umweltprüfung Genehmigung Frist "
+    "Vertragsstrafe Kosten Risiko Schnittstelle Inbetriebnahme ETCS Bahnsteig Entwässerung "
+    "permit track switch bridge tunnel catenary interlocking schedule procurement claim "
+    "possession geotechnical noise environmental approval deadline penalty cost interface "
+    "plazo penalización expropiación licitación catenaria túnel puente vía"
+).split()
+
+
+def make_lines(rng: random.Random, n_lines: int, words_per_line: int = 12):
+    return [" ".join(rng.choice(WORDS) for _ in range(words_per_line)) for _ in range(n_lines)]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(n_pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """PDF mínimo válido (Helvetica, una columna de texto por página)."""
+    rng = random.Random(seed)
+    objects = []  # contenido de los objetos 1..N
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog_id = add(b"")  # se rellena al final
+    pages_id = add(b"")
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    page_ids = []
+    for p in range(n_pages):
+        lines = [f"Seite {p + 1}"] + make_lines(rng, lines_per_page)
+        ops = ["BT", "/F1 9 Tf", "11 TL", "50 800 Td"]
+        for line in lines:
+            ops.append(f"({_pdf_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % n_pages
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_at)
+    return bytes(out)
+
+
+def make_txt(n_pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    blocks = []
+    for p in range(n_pages):
+        blocks.append(f"Seite {p + 1}\n" + "\n".join(make_lines(rng, lines_per_page)))
+    return "\n\n".join(blocks).encode("utf-8")
+
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def _docx_paragraph(text: str, style: str = "") -> str:
+    ppr = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f'<w:p>{ppr}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def _docx_table(rows) -> str:
+    cells = "".join(
+        "<w:tr>" + "".join(f"<w:tc>{_docx_paragraph(c)}</w:tc>" for c in row) + "</w:tr>"
+        for row in rows
+    )
+    return f"<w:tbl>{cells}</w:tbl>"
+
+
+def make_docx(n_pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """DOCX mínimo: un título (Heading1), párrafos y una tabla pequeña por 'página'."""
+    rng = random.Random(seed)
+    body = []
+    for p in range(n_pages):
+        body.append(_docx_paragraph(f"Abschnitt {p + 1}", style="Heading1"))
+        body.extend(_docx_paragraph(line) for line in make_lines(rng, lines_per_page - 4))
+        body.append(_docx_table([
+            ["Leistung", "Menge", "Frist", "Vertragsstrafe"],
+            [rng.choice(WORDS), str(rng.randint(1, 900)), f"{rng.randint(1, 28)}.{rng.randint(1, 12)}.2027",
+             f"{rng.randint(1, 50)}000 EUR"],
+        ]))
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:document xmlns:w="{_W}"><w:body>{"".join(body)}</w:body></w:document>'
+    )
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        z.writestr("_rels/.rels", _DOCX_RELS)
+        z.writestr("word/document.xml", document)
+    return out.getvalue()
+
+
+MAKERS = {"pdf": make_pdf, "docx": make_docx, "txt": make_txt}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--formats", nargs="+", default=list(MAKERS), choices=list(MAKERS))
+    ap.add_argument("--out", default=os.path.join(".data", "corpus"))
+    args = ap.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for n in args.pages:
+        for fmt in args.formats:
+            path = os.path.join(args.out, f"doc_{n}p.{fmt}")
+            with open(path, "wb") as f:
+                f.write(MAKERS[fmt](n))
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# benchmarks/run_all.py
+"""
+Ejecuta la suite offline completa y guarda un JSON comparable entre commits.
+
+    python -m benchmarks.run_all [--quick] [--out .data/bench/<sha>.json]
+"""
+import argparse
+import os
+
+from benchmarks import (
+    bench_admission, bench_cassette, bench_docx, bench_e2e, bench_evidence, bench_incremental, bench_mixed_load,
+    bench_parsers, bench_pdf_engines, bench_portfolio, bench_prompt, bench_repair, bench_resilience,
+    bench_risk_library,
+)
+from benchmarks.common import git_sha, write_results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--quick", action="store_true", help="tamaños pequeños (CI / smoke)")
+    ap.add_argument("--out")
+    args = ap.parse_args()
+
+    if args.quick:
+        parser_pages, prompt_pages, e2e = [1, 10], [10, 100], dict(n_requests=20, concurrency=5, latency=0.2)
+    else:
+        parser_pages, prompt_pages, e2e = [1, 10, 100], [10, 100, 1000], dict(n_requests=100, concurrency=10, latency=0.5)
+
+    results = {
+        "parsers": bench_parsers.run(parser_pages, list(bench_parsers.PARSERS), repeats=1 if args.quick else 3),
+        "pdf_engines": bench_pdf_engines.run(parser_pages),
+        "docx": bench_docx.run(prompt_pages, repeats=1 if args.quick else 3),
+        "prompt": bench_prompt.run(prompt_pages),
+        "resilience": bench_resilience.run(calls=50 if args.quick else 200),
+        "repair": bench_repair.run(analyses=20 if args.quick else 100),
+        "evidence": bench_evidence.run(prompt_pages),
+        "incremental": bench_incremental.run(pages=20 if args.quick else 60),
+        "admission": bench_admission.run(n_requests=1000 if args.quick else 5000),
+        "cassette": bench_cassette.run(docs=2 if args.quick else 5, pages=10 if args.quick else 30),
+        "mixed_load": bench_mixed_load.run(heavy=3 if args.quick else 6, light=20 if args.quick else 60),
+        "risk_library": bench_risk_library.run(sizes=(1000, 10000) if args.quick else (1000, 10000, 100000)),
+        "portfolio": bench_portfolio.run(sizes=(10000,) if args.quick else (10000, 100000)),
+        "e2e": [
+            bench_e2e.run(fmt=fmt, pages=pages, **e2e)
+            for fmt, pages in (("txt", 5), ("pdf", 3), ("docx", 20))
+        ],
+    }
+    out = args.out or os.path.join(".data", "bench", f"{git_sha()}.json")
+    write_results(results, out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# benchmarks/stub_llm.py
+"""
+Stub local del endpoint /v1/chat/completions de OpenAI para pruebas offline.
+
+    python -m benchmarks.stub_llm --port 8765 --latency 0.8 --jitter 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub uvicorn app.main:app
+
+Responde con un JSON canónico de 5 + 5 riesgos cuyas páginas salen de las
+marcas [Página N] del prompt (o, en las llamadas de ranking, con ids; en las
+de traducción, los mismos textos marcados con el idioma).
+Soporta `stream: true` (chunks SSE) y el campo `usage`.
+
+Inyección de fallos (para probar app/transport.py), por petición y al azar:
+    --error-rate 0.2        500 Internal Server Error
+    --rate-limit-rate 0.1   429 con Retry-After: --retry-after segundos
+    --slow-rate 0.05        respuesta lenta (--slow-latency segundos): cola para hedging
+    --fail-first 3          las N primeras peticiones devuelven 503 (circuit breaker)
+    --malformed-rate 0.3    JSON defectuoso: code fence, coma colgante o truncado
+                            a mitad de un riesgo (para app/json_repair.py y el re-ask)
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubConfig:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, stream_chunk_chars: int = 40, seed: int = 0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 slow_rate: float = 0.0, slow_latency: float = 5.0, fail_first: int = 0,
+                 malformed_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunk_chars = stream_chunk_chars
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fail_first = fail_first
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.faults = {"error": 0, "rate_limit": 0, "slow": 0, "fail_first": 0, "malformed": 0}
+
+    def delay(self) -> float:
+        with self.lock:
+            self.requests += 1
+            return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def fault(self):
+        """None o (tipo, segundos de latencia extra) para la petición actual."""
+        with self.lock:
+            if self.requests < self.fail_first:
+                self.faults["fail_first"] += 1
+                return "fail_first"
+            r = self.rng.random()
+            for kind, rate in (("error", self.error_rate), ("rate_limit", self.rate_limit_rate),
+                               ("slow", self.slow_rate), ("malformed", self.malformed_rate)):
+                if r < rate:
+                    self.faults[kind] += 1
+                    return kind
+                r -= rate
+        return None
+
+
+def canned_content(prompt: str) -> str:
+    if "Candidates:" in prompt:
+        return json.dumps({"intuitive_risks": [0, 1, 2, 3, 4], "counterintuitive_risks": [0, 1, 2, 3, 4]})
+    translate = re.search(r"into (\w+)\..*?entries\.\n\n(\{.*\})\n\nReturn ONLY", prompt, re.S)
+    if translate:
+        # "Traducción": mismo texto con el idioma delante
+        tag, payload = translate.group(1)[:2].upper(), json.loads(translate.group(2))
+        return json.dumps({
+            name: [{k: (f"[{tag}] {v}" if k != "id" else v) for k, v in item.items()} for item in items]
+            for name, items in payload.items()
+        }, ensure_ascii=False)
+    sections = re.findall(r"\[Página (\d+)\]\n(.*?)(?=\n---\n|\n\n[A-Z][a-z]+:|\Z)", prompt, re.S)
+    pages = [int(p) for p, _ in sections] or [1]
+    # La cita son palabras reales de la página citada (para la verificación de evidence)
+    quotes = {int(p): " ".join(text.split()[5:17]) for p, text in sections}
+    counts = {"intuitive_risks": 5, "counterintuitive_risks": 5}
+    prefix = ""
+    reask = re.search(r"Missing risks per list: (\{.*?\})", prompt)
+    if reask:
+        counts = {k: int(v) for k, v in json.loads(reask.group(1)).items()}
+        prefix = "Follow-up "
+
+    def risk(kind: str, i: int) -> dict:
+        page = pages[(i * 7) % len(pages)]
+        return {
+            "risk": f"{prefix}{kind} risk {i + 1} on page {page}",
+            "justification": "Synthetic justification from the stub server.",
+            "countermeasure": "Synthetic countermeasure.",
+            "page": page,
+            "evidence": quotes.get(page) or "Vertragsstrafe Frist Genehmigung",
+        }
+
+    return json.dumps({
+        "intuitive_risks": [risk("Intuitive", i) for i in range(counts.get("intuitive_risks", 0))],
+        "counterintuitive_risks": [risk("Counterintuitive", i) for i in range(counts.get("counterintuitive_risks", 0))],
+    }, ensure_ascii=False)
+
+
+def malform(content: str, rng: random.Random) -> str:
+    """Defectos típicos de la salida del modelo."""
+    kind = rng.choice(("fence", "trailing_comma", "truncated"))
+    if kind == "fence":
+        return "```json\n" + content + "\n```"
+    if kind == "trailing_comma":
+        return content.replace("}]", "},]", 1)
+    return content[: int(len(content) * rng.uniform(0.55, 0.9))]
+
+
+def make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            fault = config.fault()
+            if fault == "fail_first":
+                config.delay()
+                self._send_json(503, {"error": {"message": "stub: upstream unavailable", "type": "server_error"}})
+                return
+            if fault == "error":
+                time.sleep(config.delay())
+                self._send_json(500, {"error": {"message": "stub: injected failure", "type": "server_error"}})
+                return
+            if fault == "rate_limit":
+                config.delay()
+                self._send_json(429, {"error": {"message": "stub: rate limited", "type": "rate_limit"}},
+                                {"Retry-After": str(config.retry_after)})
+                return
+            prompt = "\n".join(m.get("content", "") for m in req.get("messages", []))
+            content = canned_content(prompt)
+            if fault == "malformed":
+                with config.lock:
+                    content = malform(content, config.rng)
+            delay = config.delay() + (config.slow_latency if fault == "slow" else 0.0)
+            usage = {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4,
+            }
+
+            if req.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                step = config.stream_chunk_chars
+                n_chunks = max(1, -(-len(content) // step))
+                for i in range(0, len(content), step):
+                    time.sleep(delay / n_chunks)
+                    chunk = {
+                        "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": req.get("model", "stub"),
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                if (req.get("stream_options") or {}).get("include_usage"):
+                    chunk = {
+                        "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": req.get("model", "stub"), "choices": [], "usage": usage,
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+                return
+
+            time.sleep(delay)
+            self._send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()),
+                "model": req.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+    return Handler
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clientes que cortan la conexión (timeouts, hedging) no son un error del stub
+        import sys
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_stub(port: int = 0, config: StubConfig = None):
+    """Arranca el stub en un thread daemon. Devuelve (server, base_url)."""
+    config = config or StubConfig()
+    server = _StubServer(("127.0.0.1", port), make_handler(config))
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.5, help="segundos por respuesta")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--slow-rate", type=float, default=0.0)
+    ap.add_argument("--slow-latency", type=float, default=5.0)
+    ap.add_argument("--fail-first", type=int, default=0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0)
+    args = ap.parse_args()
+
+    config = StubConfig(
+        args.latency, args.jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        slow_rate=args.slow_rate, slow_latency=args.slow_latency, fail_first=args.fail_first,
+        malformed_rate=args.malformed_rate,
+    )
+    server, url = start_stub(args.port, config)
+    print(f"stub LLM listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
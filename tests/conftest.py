@@ -0,0 +1,26 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# La configuración de app/ se lee al importar: todo lo que va a disco se
+# redirige a un directorio temporal antes de que ningún test importe la app
+_DATA = tempfile.mkdtemp(prefix="risk_radar_tests_")
+for name, default in {
+    "RESULT_CACHE_DB": "result_cache.sqlite3",
+    "FINGERPRINT_DB": "fingerprints.sqlite3",
+    "JOBS_DB": "jobs.sqlite3",
+    "JOBS_DIR": "jobs",
+    "ADMISSION_DB": "admission.sqlite3",
+    "RISK_LIBRARY_DB": "risk_library.sqlite3",
+    "PORTFOLIO_DIR": "portfolio",
+    "LLM_CASSETTE": "cassettes/llm.jsonl.gz",
+}.items():
+    os.environ.setdefault(name, os.path.join(_DATA, default))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("JOB_WORKERS", "0")
+# Todos los tests de la API comparten la IP de TestClient: sin esto agotarían su
+# bucket de admisión. tests/test_admission.py la activa donde la prueba.
+os.environ.setdefault("ADMISSION_ENABLED", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,153 @@
+# tests/test_admission.py
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import admission as admission_module
+from app import main
+from app.admission import (
+    AdmissionController,
+    FairQueue,
+    MemoryBuckets,
+    RateLimited,
+    SQLiteBuckets,
+    Ticket,
+    client_id,
+)
+
+SPECS = [("key:a", 1.0, 10.0), ("global", 10.0, 100.0)]
+
+
+def _level(buckets, key):
+    return buckets._state[key][0]
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_take_charges_all_buckets_or_none(backend, tmp_path):
+    buckets = MemoryBuckets() if backend == "memory" else SQLiteBuckets(str(tmp_path / "b.sqlite3"))
+    assert buckets.take(SPECS, 8)[0]
+    ok, wait, blocked = buckets.take(SPECS, 8)
+    assert not ok and blocked == "key:a"
+    assert wait == pytest.approx(6.0, abs=0.1)  # faltan 6 tokens a 1 token/s
+    # El rechazo no cobra nada: con el bucket global lleno, 2 tokens siguen disponibles
+    assert buckets.take(SPECS, 2)[0]
+
+
+def test_request_more_expensive_than_burst_passes_with_a_full_bucket():
+    buckets = MemoryBuckets()
+    assert buckets.take(SPECS, 25)[0]
+    assert _level(buckets, "key:a") == pytest.approx(0.0, abs=0.01)
+
+
+def test_debt_is_capped_at_one_bucket():
+    buckets = MemoryBuckets()
+    buckets.adjust(SPECS, 500)
+    assert _level(buckets, "key:a") == pytest.approx(-10.0)
+
+
+def test_settle_and_refund_happen_once():
+    controller = AdmissionController(MemoryBuckets())
+    ticket = controller.admit("key:a", 6.0)
+    controller.refund(ticket)
+    controller.refund(ticket)
+    controller.settle(ticket, {"pages_read": 400})
+    level = _level(controller.buckets, "key:a")
+    assert level == pytest.approx(admission_module.ADMISSION_CLIENT_BURST - admission_module.ADMISSION_BASE_COST, abs=0.05)
+
+
+def test_handoff_leaves_settlement_to_the_job():
+    controller = AdmissionController(MemoryBuckets())
+    ticket = controller.admit("key:a", 4.0)
+    carried = ticket.handoff()
+    controller.refund(ticket)  # la petición HTTP ya no devuelve nada
+    assert _level(controller.buckets, "key:a") == pytest.approx(admission_module.ADMISSION_CLIENT_BURST - 4.0, abs=0.05)
+    controller.settle(Ticket(**carried), {"pages_read": 0})
+    assert _level(controller.buckets, "key:a") == pytest.approx(admission_module.ADMISSION_CLIENT_BURST - 1.0, abs=0.05)
+
+
+def test_rate_limited_when_client_bucket_is_empty():
+    controller = AdmissionController(MemoryBuckets())
+    controller.admit("ip:1.2.3.4", admission_module.ADMISSION_CLIENT_BURST)
+    with pytest.raises(RateLimited) as info:
+        controller.admit("ip:1.2.3.4", 1.0)
+    assert info.value.retry_after >= 1
+
+
+def test_client_id_hashes_the_api_key():
+    cid = client_id({"x-api-key": "secret"}, "1.2.3.4")
+    assert cid.startswith("key:") and "secret" not in cid
+    assert client_id({}, "1.2.3.4") == "ip:1.2.3.4"
+
+
+# ── cola justa ───────────────────────────────────────────────────────────────
+
+async def _serve_order(queue: FairQueue, requests):
+    order = []
+
+    async def run(client, cost, name):
+        async with queue.slot(Ticket(client, cost)):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    blocker = Ticket("blocker", 1.0)
+    await queue.acquire(blocker)  # todos esperan en cola antes del primer turno
+    tasks = []
+    for client, cost, name in requests:
+        tasks.append(asyncio.create_task(run(client, cost, name)))
+        await asyncio.sleep(0)
+    queue.release(0.0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_drr_interleaves_clients():
+    requests = [("a", 1.0, "a1"), ("a", 1.0, "a2"), ("a", 1.0, "a3"), ("b", 1.0, "b1"), ("b", 1.0, "b2")]
+    order = asyncio.run(_serve_order(FairQueue(slots=1, max_queued=10), requests))
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_drr_weights_turns_by_cost():
+    # Cada petición de "big" cuesta lo que cuatro de "small": pasan cuatro pequeñas por cada grande
+    requests = [("big", 8.0, f"B{i}") for i in range(2)] + [("small", 2.0, f"s{i}") for i in range(8)]
+    order = asyncio.run(_serve_order(FairQueue(slots=1, max_queued=10), requests))
+    assert order.index("B0") >= 3 and order.index("B1") - order.index("B0") >= 4
+
+
+def test_queue_full_is_rate_limited_unless_unbounded():
+    async def scenario():
+        queue = FairQueue(slots=1, max_queued=1)
+        await queue.acquire(Ticket("x", 1.0))
+        waiting = asyncio.create_task(queue.acquire(Ticket("a", 1.0)))
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimited):
+            await queue.acquire(Ticket("a", 1.0))
+        job = asyncio.create_task(queue.acquire(Ticket("a", 1.0), bounded=False))
+        await asyncio.sleep(0)
+        assert queue._waiting == 2
+        waiting.cancel()
+        job.cancel()
+        await asyncio.gather(waiting, job, return_exceptions=True)
+        assert queue._waiting == 0
+
+    asyncio.run(scenario())
+
+
+# ── liquidación en las respuestas de error ───────────────────────────────────
+
+def test_error_responses_refund_the_admission_charge(monkeypatch):
+    controller = AdmissionController(MemoryBuckets())
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "ADMISSION_ENABLED", True)
+    client = TestClient(main.app)
+    headers = {"X-API-Key": "refund-test"}
+    key = client_id({"x-api-key": "refund-test"}, None)
+    big = b"x" * (3 * admission_module.ADMISSION_BYTES_PER_TOKEN)
+
+    r = client.post("/analyze", files={"file": ("a.xls", big)}, data={"lang": "en"}, headers=headers)
+    assert r.status_code == 400
+    r = client.post("/analyze", data={"lang": "en"}, headers=headers)  # sin archivo: 422 de FastAPI
+    assert r.status_code == 422
+    full = admission_module.ADMISSION_CLIENT_BURST
+    # Cada error deja solo la base cobrada, no el coste por tamaño
+    assert _level(controller.buckets, key) == pytest.approx(full - 2 * admission_module.ADMISSION_BASE_COST, abs=0.1)
@@ -0,0 +1,73 @@
+# tests/test_cassette.py
+import asyncio
+import gzip
+
+import pytest
+
+from app.cassette import Cassette, CassetteMiss, _response
+
+
+class _FakeCompletions:
+    def __init__(self, replies):
+        self.replies = iter(replies)
+
+    async def create(self, **kwargs):
+        return _response(next(self.replies), {"prompt_tokens": 3, "completion_tokens": 2})
+
+
+class _FakeClient:
+    def __init__(self, replies):
+        self.chat = type("Chat", (), {"completions": _FakeCompletions(replies)})()
+
+
+def _call(client, text):
+    messages = [{"role": "user", "content": text}]
+    resp = asyncio.run(client.chat.completions.create(model="gpt-test", messages=messages))
+    return resp.choices[0].message.content
+
+
+def _record(path, prompts, replies):
+    session = Cassette(str(path), latency_scale=0)
+    client = session.recording_async(_FakeClient(replies))
+    for prompt in prompts:
+        _call(client, prompt)
+    session.close()
+
+
+def test_two_recording_sessions_replay_in_order(tmp_path):
+    path = tmp_path / "llm.jsonl.gz"
+    _record(path, ["uno", "dos"], ["r1", "r2"])
+    _record(path, ["tres", "uno"], ["r3", "r1 bis"])
+
+    replay = Cassette(str(path), latency_scale=0)
+    assert len(replay) == 4
+    client = replay.replay_async()
+    assert [_call(client, p) for p in ("uno", "dos", "tres", "uno", "uno")] == ["r1", "r2", "r3", "r1 bis", "r1 bis"]
+
+
+def test_session_left_open_does_not_hide_later_entries(tmp_path):
+    # Un proceso que no cierra el cassette (kill) no deja un miembro gzip sin terminar
+    path = tmp_path / "llm.jsonl.gz"
+    crashed = Cassette(str(path), latency_scale=0)
+    _call(crashed.recording_async(_FakeClient(["r1"])), "uno")
+    _record(path, ["dos"], ["r2"])
+
+    assert len(Cassette(str(path), latency_scale=0)) == 2
+    crashed.close()
+
+
+def test_corrupt_tail_keeps_entries_before_it(tmp_path):
+    path = tmp_path / "llm.jsonl.gz"
+    _record(path, ["uno"], ["r1"])
+    with open(path, "ab") as f:
+        f.write(gzip.compress(b'{"key": "x"}\n')[:12] + b"\x00garbage\xff" * 4)
+
+    replay = Cassette(str(path), latency_scale=0)
+    assert len(replay) == 1
+    assert _call(replay.replay_async(), "uno") == "r1"
+
+
+def test_unrecorded_prompt_is_a_miss(tmp_path):
+    replay = Cassette(str(tmp_path / "empty.jsonl.gz"), latency_scale=0)
+    with pytest.raises(CassetteMiss):
+        _call(replay.replay_async(), "nada")
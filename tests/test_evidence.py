@@ -0,0 +1,59 @@
+# tests/test_evidence.py
+import pytest
+
+from app.evidence import EvidenceIndex, verify_risks
+
+PAGES = [
+    {"page": 1, "text": "Die Planfeststellung für den Abschnitt Nord ist noch nicht abgeschlossen."},
+    {"page": 2, "text": "Der Baugrund im Tunnel weist wasserführende Schichten auf, die eine Vereisung erfordern."},
+    {"page": 3, "text": "Die Inbetriebnahme des Stellwerks hängt von der ETCS-Zulassung durch das EBA ab."},
+    {"page": 4, "text": "Hinweis: die Inbetriebnahme des Stellwerks hängt von der ETCS-Zulassung ab."},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return EvidenceIndex(PAGES)
+
+
+def test_locate_returns_page_and_character_offsets(index):
+    match = index.locate("weist wasserführende Schichten auf")
+    assert match["page"] == 2 and match["score"] == 1.0
+    assert PAGES[1]["text"][match["start"]:match["end"]] == "weist wasserführende Schichten auf"
+
+
+def test_locate_tolerates_an_inexact_quote(index):
+    # Una palabra omitida y otra cambiada: la cita sigue apuntando a la página 1
+    match = index.locate("Planfeststellung für Abschnitt Nord ist noch lange nicht abgeschlossen")
+    assert match["page"] == 1 and 0 < match["score"] < 1
+
+
+def test_locate_prefers_the_reported_page_among_equal_matches(index):
+    quote = "die Inbetriebnahme des Stellwerks hängt von der ETCS"
+    assert index.locate(quote)["page"] == 3
+    assert index.locate(quote, prefer_page=4)["page"] == 4
+
+
+@pytest.mark.parametrize("quote", ["Stellwerk ETCS", "völlig anderer Wortlaut ohne Treffer"])
+def test_locate_returns_none_without_a_usable_trigram(index, quote):
+    assert index.locate(quote) is None
+
+
+def test_locate_ignores_trigrams_that_cross_a_page_break(index):
+    # Solo "der baugrund im" está dentro de una página; los otros dos trigramas unen la 1 y la 2
+    match = index.locate("nicht abgeschlossen Der Baugrund im")
+    assert match["page"] == 2 and match["score"] == pytest.approx(1 / 3, abs=0.001)
+
+
+def test_verify_risks_corrects_pages_and_counts_outcomes(index):
+    data = {"intuitive_risks": [
+        {"risk": "a", "page": 3, "evidence": "Baugrund im Tunnel weist wasserführende Schichten"},
+        {"risk": "b", "page": 1, "evidence": "Planfeststellung für den Abschnitt Nord"},
+        {"risk": "c", "page": 2, "evidence": "Kosten"},
+        {"risk": "d", "page": 2, "evidence": "nichts davon steht im Dokument"},
+    ]}
+    summary = verify_risks(index, data, ("intuitive_risks",))
+    assert summary == {"page_corrected": 1, "verified": 1, "too_short": 1, "not_found": 1}
+    corrected = data["intuitive_risks"][0]
+    assert corrected["page"] == 2 and corrected["page_reported"] == 3
+    assert data["intuitive_risks"][3]["evidence_match"] == {"score": 0.0}
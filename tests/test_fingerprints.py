@@ -0,0 +1,198 @@
+# tests/test_fingerprints.py
+import asyncio
+import json
+import random
+import re
+
+import pytest
+
+from app import fingerprints, pipeline, risk_engine
+from app.cache import ResultCache
+from app.fingerprints import FingerprintIndex, fingerprint_pages, incremental_candidates, match_pages, plan_reuse
+
+LISTS = ("intuitive_risks", "counterintuitive_risks")
+WORDS = ("Gleis Weiche Brücke Tunnel Oberleitung Stellwerk Bauzeit Vergabe Nachtrag Sperrpause Baugrund "
+         "Frist Kosten Risiko Schnittstelle Inbetriebnahme Bahnsteig track bridge permit delay").split()
+
+
+def _page_text(seed: int, lines: int = 30) -> str:
+    rng = random.Random(seed)
+    return "\n".join(" ".join(rng.choice(WORDS) + str(rng.randint(0, 99)) for _ in range(12)) for _ in range(lines))
+
+
+def _pages(texts):
+    return [{"page": i + 1, "text": t} for i, t in enumerate(texts)]
+
+
+def _edit(text: str) -> str:
+    # Cambia una palabra: la página queda a pocos bits de distancia (casi idéntica)
+    words = text.split(" ")
+    words[5] = "Weichenheizung"
+    return " ".join(words)
+
+
+def test_match_pages_by_content_not_position():
+    v1 = [_page_text(i) for i in range(4)]
+    v2 = [v1[0], _page_text(99), v1[1], _edit(v1[2]), v1[3]]
+    matches = match_pages(fingerprint_pages(_pages(v2)), fingerprint_pages(_pages(v1)))
+    assert matches[1] == (1, True)
+    assert 2 not in matches  # página insertada
+    assert matches[3] == (2, True)
+    assert matches[4] == (3, False)  # editada: emparejada, pero no idéntica
+    assert matches[5] == (4, True)
+
+
+def test_match_pages_uses_each_old_page_once():
+    text = _page_text(1)
+    matches = match_pages(fingerprint_pages(_pages([text, text])), fingerprint_pages(_pages([text])))
+    assert list(matches.values()) == [(1, True)]
+
+
+def _reference_match(new, old, max_distance):
+    # Emparejamiento aproximado elemento a elemento (la versión previa a NumPy)
+    used, matches = set(), {}
+    for fp in new:
+        best, best_distance = None, max_distance + 1
+        for o in old:
+            distance = (fp["simhash"] ^ o["simhash"]).bit_count()
+            if o["page"] not in used and distance < best_distance:
+                best, best_distance = o["page"], distance
+        if best is not None:
+            used.add(best)
+            matches[fp["page"]] = (best, False)
+    return matches
+
+
+def test_match_pages_vectorized_equals_pairwise_loop(monkeypatch):
+    rng = random.Random(7)
+    base = [rng.getrandbits(64) for _ in range(40)]
+    old = [{"page": i + 1, "simhash": h, "digest": f"o{i}"} for i, h in enumerate(base)]
+    # Variantes a 0-6 bits de páginas previas (con repeticiones) y algunas sin relación
+    new = [{"page": i + 1, "digest": f"n{i}",
+            "simhash": (rng.choice(base) ^ sum(1 << rng.randrange(64) for _ in range(rng.randint(0, 6))))
+            if i % 5 else rng.getrandbits(64)}
+           for i in range(60)]
+    monkeypatch.setattr(fingerprints, "_MATCH_BLOCK_ROWS", 16)
+    assert match_pages(new, old, max_distance=4) == _reference_match(new, old, 4)
+
+
+def test_closest_ignores_documents_without_a_shared_page(tmp_path):
+    index = FingerprintIndex(str(tmp_path / "fp.sqlite3"))
+    v1 = [_page_text(i) for i in range(4)]
+    edited = fingerprint_pages(_pages([_edit(t) for t in v1]))
+    index.add("variant", "sha-edited", "edited.txt", edited, {})
+    index.add("variant", "sha-other", "other.txt", fingerprint_pages(_pages([_page_text(60)])), {})
+    assert index.closest("variant", "sha-new", fingerprint_pages(_pages(v1))) is None
+
+    index.add("variant", "sha-v1", "v1.txt", fingerprint_pages(_pages(v1)), {})
+    base = index.closest("variant", "sha-new", fingerprint_pages(_pages(v1 + [_page_text(61)])))
+    assert base["filename"] == "v1.txt" and base["overlap"] == 0.8
+    assert index.closest("variant", "sha-v1", fingerprint_pages(_pages(v1))) is None  # se excluye a sí mismo
+
+
+def _base(old_texts, new_texts, risks):
+    old, new = fingerprint_pages(_pages(old_texts)), fingerprint_pages(_pages(new_texts))
+    return {"matches": match_pages(new, old), "risks": risks, "overlap": 1.0, "filename": "v1.txt"}
+
+
+def test_plan_reuse_sends_new_and_near_identical_pages():
+    v1 = [_page_text(i) for i in range(4)]
+    v2 = [v1[0], v1[1], _edit(v1[2]), v1[3], _page_text(42)]
+    quote = " ".join(v1[2].split(" ")[20:30])
+    risks = {
+        "intuitive_risks": [
+            {"risk": "exacta", "page": 2, "evidence": "x"},
+            {"risk": "editada con cita", "page": 3, "evidence": quote},
+            {"risk": "editada sin cita", "page": 3, "evidence": "texto que ya no está"},
+        ],
+        "counterintuitive_risks": [],
+    }
+    reused, changed = plan_reuse(_base(v1, v2, risks), _pages(v2), LISTS)
+    assert [p["page"] for p in changed] == [3, 5]
+    assert [r["risk"] for r in reused["intuitive_risks"]] == ["exacta", "editada con cita"]
+    assert all(r["origin"] == "reused" for r in reused["intuitive_risks"])
+
+
+def test_plan_reuse_moves_pages_after_an_insertion():
+    v1 = [_page_text(i) for i in range(3)]
+    v2 = [_page_text(50), *v1]
+    risks = {"intuitive_risks": [{"risk": "r", "page": 3, "evidence": ""}], "counterintuitive_risks": []}
+    reused, changed = plan_reuse(_base(v1, v2, risks), _pages(v2), LISTS)
+    assert reused["intuitive_risks"][0]["page"] == 4
+    assert [p["page"] for p in changed] == [1]
+
+
+def test_incremental_candidates_interleave_and_drop_repeated_titles():
+    reused = {"intuitive_risks": [{"risk": "A"}, {"risk": "B"}, {"risk": "C"}], "counterintuitive_risks": []}
+    fresh = {"intuitive_risks": [{"risk": "x"}, {"risk": "b "}], "counterintuitive_risks": [{"risk": "y"}]}
+    candidates = incremental_candidates(reused, fresh, LISTS)
+    assert [r["risk"] for r in candidates["intuitive_risks"]] == ["A", "x", "B", "C"]
+    assert candidates["counterintuitive_risks"] == [{"risk": "y", "origin": "new"}]
+
+
+# ── revisión de punta a punta ────────────────────────────────────────────────
+
+@pytest.fixture
+def isolated(monkeypatch, tmp_path):
+    # Caché e índice propios: otro test con el mismo texto no debe dar un hit
+    monkeypatch.setattr(pipeline, "result_cache", ResultCache(db_path=str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(pipeline, "fingerprint_index", FingerprintIndex(str(tmp_path / "fp.sqlite3")))
+    monkeypatch.setattr(pipeline, "INCREMENTAL_ENABLED", True)
+
+
+def _fake_llm(calls):
+    async def fake_generate(text, context="", lang="es"):
+        pages = [int(p) for p in re.findall(r"\[Página (\d+)\]", text)]
+        calls.append(pages)
+        n = len(calls)
+        return {
+            name: [{"risk": f"call{n} {name} {i}", "justification": "j", "countermeasure": "c",
+                    "page": pages[i % len(pages)], "evidence": ""} for i in range(5)]
+            for name in LISTS
+        } | {"source": "openai"}
+
+    return fake_generate
+
+
+def test_revision_with_added_section_reaches_the_llm(monkeypatch, isolated):
+    calls, rankings = [], []
+    monkeypatch.setattr(pipeline, "agenerate_risks", _fake_llm(calls))
+
+    async def fake_rank(messages, **kwargs):
+        listing = json.loads(messages[1]["content"].split("Candidates:\n", 1)[1].split("\n\n")[0])
+        rankings.append(listing)
+        # El "modelo" prefiere los riesgos nuevos
+        return json.dumps({kind: [c["id"] for c in items if c["risk"].startswith("call2")] + [0]
+                           for kind, items in listing.items()})
+
+    monkeypatch.setattr(risk_engine, "_achat_completion", fake_rank)
+    v1 = [_page_text(i) for i in range(4)]
+    v2 = v1 + [_page_text(77)]
+
+    first = asyncio.run(pipeline.run_analysis("\n\n".join(v1).encode(), "v1.txt", lang="en", mode="single"))
+    assert first["_debug"]["pages_read"] == 4
+    second = asyncio.run(pipeline.run_analysis("\n\n".join(v2).encode(), "v2.txt", lang="en", mode="single"))
+
+    assert calls[1] == [5]  # solo la sección añadida va al LLM
+    incremental = second["_debug"]["incremental"]
+    assert incremental["pages_changed"] == [5]
+    assert incremental["risks_new"] > 0
+    assert len(rankings) == 1 and len(rankings[0]["intuitive_risks"]) == 10
+    assert all(len(second[name]) == 5 for name in LISTS)
+
+
+def test_identical_content_skips_the_llm(monkeypatch, isolated):
+    calls = []
+    monkeypatch.setattr(pipeline, "agenerate_risks", _fake_llm(calls))
+    v1 = [_page_text(i) for i in range(4)]
+
+    asyncio.run(pipeline.run_analysis("\n\n".join(v1).encode(), "v1.txt", lang="en", mode="single"))
+    # Mismo contenido con otro orden de páginas: otro hash, ninguna página cambiada
+    second = asyncio.run(pipeline.run_analysis("\n\n".join(v1[::-1]).encode(), "v1b.txt", lang="en", mode="single"))
+
+    assert len(calls) == 1
+    assert second["_debug"]["incremental"]["risks_reused"] == 10
+
+
+def test_fingerprint_module_exposes_no_gap_filling_merge():
+    assert not hasattr(fingerprints, "merge_incremental")
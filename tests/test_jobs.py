@@ -0,0 +1,176 @@
+# tests/test_jobs.py
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from app import admission as admission_module
+from app import jobs
+from app.admission import AdmissionController, MemoryBuckets
+from app.jobs import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "files"))
+
+
+def _enqueue(store, tmp_path, params=None, max_attempts=3):
+    upload = tmp_path / f"upload-{time.time_ns()}.txt"
+    upload.write_bytes(b"texto")
+    return store.create(str(upload), params or {"filename": "a.txt"}, max_attempts=max_attempts)
+
+
+def _expire(store, job_id):
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+def test_live_lease_of_another_process_is_not_requeued(store, tmp_path):
+    job_id = _enqueue(store, tmp_path)
+    assert store.claim_next(lease_s=60)["id"] == job_id
+    # Un segundo proceso arranca: el job sigue siendo del primero
+    assert store.requeue_expired() == (0, [])
+    assert store.get(job_id)["status"] == "running"
+
+
+def test_expired_lease_is_requeued_and_fences_the_old_worker(store, tmp_path):
+    job_id = _enqueue(store, tmp_path)
+    first = store.claim_next()
+    _expire(store, job_id)
+    assert store.requeue_expired()[0] == 1
+
+    second = store.claim_next()
+    assert second["attempts"] == first["attempts"] + 1
+    # El worker que perdió el lease ya no puede renovar ni escribir
+    assert not store.heartbeat(job_id, first["attempts"])
+    assert not store.complete(job_id, first["attempts"], {"stale": True})
+    assert store.complete(job_id, second["attempts"], {"ok": True})
+    assert store.get(job_id)["result"] == {"ok": True}
+
+
+def test_expired_lease_on_last_attempt_fails_and_refunds(store, tmp_path, monkeypatch):
+    controller = AdmissionController(MemoryBuckets())
+    monkeypatch.setattr(jobs, "admission", controller)
+    ticket = controller.admit("key:a", 5.0)
+    job_id = _enqueue(store, tmp_path, {"filename": "a.txt", "admission": ticket.handoff()}, max_attempts=1)
+    store.claim_next()
+    _expire(store, job_id)
+
+    jobs.maintain(store)
+
+    job = store.get(job_id)
+    assert job["status"] == "failed" and job["error"]["error_code"] == "lease_expired"
+    assert controller.buckets._state["key:a"][0] == pytest.approx(
+        admission_module.ADMISSION_CLIENT_BURST - admission_module.ADMISSION_BASE_COST, abs=0.05)
+
+
+def test_purge_removes_only_old_finished_jobs(store, tmp_path):
+    old, recent, queued = (_enqueue(store, tmp_path) for _ in range(3))
+    for job_id in (old, recent):
+        job = store.claim_next()
+        store.complete(job["id"], job["attempts"], {})
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - 3600, old))
+
+    assert store.purge_finished(retention_s=60) == 1
+    assert store.get(old) is None
+    assert store.get(recent)["status"] == "done" and store.get(queued)["status"] == "queued"
+
+
+def test_old_schema_gets_the_lease_column(tmp_path):
+    db = tmp_path / "old.sqlite3"
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT,"
+            " progress TEXT NOT NULL DEFAULT '{}', params TEXT NOT NULL, file_path TEXT, result TEXT,"
+            " error TEXT, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,"
+            " next_run_at REAL NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO jobs VALUES ('legacy', 'running', 'parse', '{}', '{}', NULL, NULL,"
+                     " NULL, 1, 3, 0, 0, 0)")
+    store = JobStore(str(db), str(tmp_path / "files"))
+    # Sin lease registrado, un 'running' de la versión anterior cuenta como vencido
+    assert store.requeue_expired()[0] == 1
+    assert store.get("legacy")["status"] == "queued"
+
+
+def test_lost_lease_abandons_the_attempt(store, tmp_path, monkeypatch):
+    job_id = _enqueue(store, tmp_path)
+    job = store.claim_next()
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_S", 0.01)
+    finished = []
+
+    async def slow_analysis(path, progress=None, **params):
+        _expire(store, job_id)
+        store.requeue_expired()
+        store.claim_next()  # otro worker se queda el job
+        await asyncio.sleep(1)
+        finished.append(True)
+        return {"_debug": {}}
+
+    monkeypatch.setattr(jobs, "run_analysis", slow_analysis)
+    asyncio.run(jobs.process_job(store, job))
+
+    assert not finished
+    current = store.get(job_id)
+    assert current["status"] == "running" and current["attempts"] == job["attempts"] + 1
+
+
+def test_pool_stop_releases_the_running_job(store, tmp_path, monkeypatch):
+    job_id = _enqueue(store, tmp_path)
+
+    async def scenario():
+        running = asyncio.Event()
+
+        async def hang(path, progress=None, **params):
+            running.set()
+            await asyncio.sleep(60)
+
+        monkeypatch.setattr(jobs, "run_analysis", hang)
+        pool = jobs.JobWorkerPool(store, workers=1)
+        pool.start()
+        await asyncio.wait_for(running.wait(), 5)
+        await pool.stop()
+
+    asyncio.run(scenario())
+    job = store.get(job_id)
+    assert job["status"] == "queued" and job["attempts"] == 0
+
+
+def test_progress_is_written_before_the_job_is_closed(store, tmp_path, monkeypatch):
+    job_id = _enqueue(store, tmp_path)
+    job = store.claim_next()
+    on_loop = []
+
+    def tracking(method):
+        def wrapper(*args, **kwargs):
+            on_loop.append(_in_event_loop())
+            return method(*args, **kwargs)
+        return wrapper
+
+    for name in ("set_progress", "complete"):
+        monkeypatch.setattr(store, name, tracking(getattr(store, name)))
+
+    async def analysis(path, progress=None, **params):
+        for stage in ("extracting", "extracted", "analyzing", "analyzed"):
+            progress(stage)
+            await asyncio.sleep(0)
+        return {"_debug": {}}
+
+    monkeypatch.setattr(jobs, "run_analysis", analysis)
+    asyncio.run(jobs.process_job(store, job))
+
+    done = store.get(job_id)
+    assert done["status"] == "done" and done["stage"] == "done"
+    assert "analyzed" in done["progress"]
+    assert on_loop and not any(on_loop)  # ninguna escritura bloquea el event loop
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
@@ -0,0 +1,69 @@
+# tests/test_json_repair.py
+import json
+
+import pytest
+
+from app.json_repair import repair_json, validate_risks
+
+KEYS = ["risk", "justification", "countermeasure", "page", "evidence"]
+
+
+def _item(title, page=1):
+    return {"risk": title, "justification": "j", "countermeasure": "c", "page": page, "evidence": "e"}
+
+
+def test_valid_json_needs_no_repairs():
+    assert repair_json('{"a": [1, 2]}') == ({"a": [1, 2]}, [])
+
+
+def test_code_fence_and_surrounding_text():
+    data, repairs = repair_json('```json\n{"a": 1}\n```')
+    assert data == {"a": 1} and repairs == ["code_fence"]
+    data, repairs = repair_json('Here you go: {"a": 1} hope it helps')
+    assert data == {"a": 1}
+    assert set(repairs) == {"leading_text", "trailing_text"}
+
+
+def test_trailing_commas():
+    data, repairs = repair_json('{"a": [1, 2, ], "b": {"c": 3,},}')
+    assert data == {"a": [1, 2], "b": {"c": 3}}
+    assert "trailing_comma" in repairs
+
+
+def test_commas_and_brackets_inside_strings_are_kept():
+    data, _ = repair_json('{"a": "x, ] }", "b": [1,],}')
+    assert data == {"a": "x, ] }", "b": [1]}
+
+
+def test_truncated_reply_drops_the_half_written_item():
+    full = json.dumps({"intuitive_risks": [_item("uno"), _item("dos")]})
+    data, repairs = repair_json(full[: full.index("dos") + 2])
+    assert "truncated" in repairs
+    assert [r["risk"] for r in data["intuitive_risks"]] == ["uno"]
+
+
+def test_truncated_inside_first_item_closes_what_is_open():
+    data, repairs = repair_json('{"intuitive_risks": [{"risk": "uno", "page": 3')
+    assert "truncated" in repairs
+    assert data["intuitive_risks"][0]["risk"] == "uno"
+
+
+@pytest.mark.parametrize("content", ["", "no json here", None])
+def test_unrecoverable_raises_value_error(content):
+    with pytest.raises(ValueError):
+        repair_json(content)
+
+
+def test_validate_risks_keeps_valid_and_reports_missing():
+    data = {"intuitive_risks": [_item("a"), {"risk": "sin campos"}, _item("", 2), _item("b", "S. 12")],
+            "counterintuitive_risks": [_item(str(i)) for i in range(5)]}
+    valid, problems = validate_risks(data, ("intuitive_risks", "counterintuitive_risks"), KEYS)
+    assert [r["risk"] for r in valid["intuitive_risks"]] == ["a", "b"]
+    assert valid["intuitive_risks"][1]["page"] == 12
+    assert problems == {"intuitive_risks": {"missing": 3, "invalid": [{"risk": "sin campos"}, _item("", 2)]}}
+
+
+def test_validate_risks_tolerates_non_dict_payloads():
+    valid, problems = validate_risks(["not", "a", "dict"], ("intuitive_risks",), KEYS, expected=2)
+    assert valid == {"intuitive_risks": []}
+    assert problems["intuitive_risks"]["missing"] == 2
@@ -0,0 +1,57 @@
+# tests/test_main.py
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.transport import LLMTransportError
+
+
+def _stream(**data):
+    client = TestClient(main.app)
+    return client.post("/analyze/stream", files={"file": ("plan.txt", "Sperrpause Gleis 3".encode())},
+                       data={"lang": "de", "no_cache": "false", **data})
+
+
+@pytest.mark.parametrize("error, status, error_code", [
+    (LLMTransportError("llm_unavailable", "LLM caído", retry_after=7), 503, "llm_unavailable"),
+    (RuntimeError("fallo inesperado"), 500, "internal_error"),
+])
+def test_stream_errors_before_the_stream_are_json(monkeypatch, error, status, error_code):
+    async def failing_translate(analysis_key, lang, report=None):
+        raise error
+
+    monkeypatch.setattr(main, "translate_cached", failing_translate)
+    monkeypatch.setattr(main, "cached_result", lambda key, no_cache, invalidate: (None, "miss"))
+    r = _stream()
+    assert r.status_code == status
+    assert r.headers["content-type"].startswith("application/json")
+    assert r.json()["error_code"] == error_code
+    if status == 503:
+        assert r.headers["retry-after"] == "7"
+
+
+
+def test_stream_verifies_each_risk_once(monkeypatch):
+    text = "Die Sperrpause für Gleis 3 ist zu kurz für den Weichentausch im Bahnhof Nord. " * 10
+
+    async def fake_stream(joined_text, context="", lang="es"):
+        risk = {"risk": "Sperrpause", "justification": "j", "countermeasure": "c", "page": 7,
+                "evidence": "Sperrpause für Gleis 3 ist zu kurz"}
+        yield {"event": "risk", "kind": "intuitive", "item": risk}
+        extra = {"risk": "Weiche", "justification": "j", "countermeasure": "c", "page": 1,
+                 "evidence": "Weichentausch im Bahnhof Nord"}
+        yield {"event": "result", "data": {"intuitive_risks": [risk, extra], "counterintuitive_risks": []}}
+
+    monkeypatch.setattr(main, "astream_risks", fake_stream)
+    monkeypatch.setattr(main, "EVIDENCE_CHECK", True)
+    monkeypatch.setattr(main, "cached_result", lambda key, no_cache, invalidate: (None, "bypass"))
+    client = TestClient(main.app)
+    r = client.post("/analyze/stream", files={"file": ("plan.txt", text.encode())},
+                    data={"lang": "de", "no_cache": "true"})
+    assert r.status_code == 200
+    done = json.loads(r.text.split("event: done\ndata: ", 1)[1].split("\n", 1)[0])
+    # La página corregida al emitir cuenta como corrección, no como verificada
+    assert done["_debug"]["evidence"] == {"page_corrected": 1, "verified": 1}
+    assert done["intuitive_risks"][0]["page_reported"] == 7
@@ -0,0 +1,146 @@
+# tests/test_metrics.py
+import asyncio
+import contextvars
+import re
+import time
+
+import pytest
+
+from app import metrics
+from app.metrics import Counter, Histogram, Registry, begin_request, current_request, stage
+
+
+def _lines(metric):
+    return {line.rsplit(" ", 1)[0]: line.rsplit(" ", 1)[1] for line in metric.render() if not line.startswith("#")}
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    h = Histogram("h", "ayuda", ("stage",), buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 1, 20):
+        h.observe(value, stage="llm")
+
+    lines = _lines(h)
+    # El límite superior de cada bucket es inclusivo (le = "menor o igual")
+    assert lines['h_bucket{stage="llm",le="0.1"}'] == "2"
+    assert lines['h_bucket{stage="llm",le="1"}'] == "4"
+    assert lines['h_bucket{stage="llm",le="10"}'] == "4"
+    assert lines['h_bucket{stage="llm",le="+Inf"}'] == "5"
+    assert lines['h_count{stage="llm"}'] == "5"
+    assert float(lines['h_sum{stage="llm"}']) == pytest.approx(21.65)
+
+
+def test_histogram_series_per_label_and_unsorted_buckets():
+    h = Histogram("h", "ayuda", ("stage",), buckets=(10, 1))
+    h.observe(5, stage="b")
+    h.observe(0.5, stage="a")
+    bucket_lines = [l for l in h.render() if "_bucket" in l]
+    assert bucket_lines[0].startswith('h_bucket{stage="a",le="1"}')
+    assert [l.split("le=")[1] for l in bucket_lines[:3]] == ['"1"} 1', '"10"} 1', '"+Inf"} 1']
+    assert _lines(h)['h_bucket{stage="b",le="1"}'] == "0"
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Peticiones.", ("path", "status"))
+    latency = registry.histogram("latency_seconds", "Latencia.", buckets=(1,))
+    requests.inc(path="/upload", status=200)
+    requests.inc(2, path='/a"b\\c\nd', status=500)
+    latency.observe(0.25)
+
+    text = registry.render()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert lines[:2] == [
+        "# HELP risk_radar_requests_total Peticiones.",
+        "# TYPE risk_radar_requests_total counter",
+    ]
+    assert 'risk_radar_requests_total{path="/upload",status="200"} 1' in lines
+    # Comillas, barras y saltos de línea escapados según el formato de texto
+    assert 'risk_radar_requests_total{path="/a\\"b\\\\c\\nd",status="500"} 2' in lines
+    assert "# TYPE risk_radar_latency_seconds histogram" in lines
+    assert 'risk_radar_latency_seconds_bucket{le="1"} 1' in lines
+    assert "risk_radar_latency_seconds_sum 0.25" in lines
+    assert "risk_radar_latency_seconds_count 1" in lines
+
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]\w*="([^"\\]|\\.)*",?)*\})? \S+$')
+    for line in lines:
+        assert line.startswith("# ") or sample.match(line), line
+
+
+def test_counter_values_by_label():
+    c = Counter("c", "ayuda", ("kind",))
+    c.inc(kind="prompt")
+    c.inc(3, kind="prompt")
+    assert c.value(kind="prompt") == 4 and c.value(kind="completion") == 0
+
+
+@stage("decorated")
+def _decorated_work():
+    time.sleep(0.01)
+    return "ok"
+
+
+def test_stage_as_context_manager_and_decorator():
+    def run():
+        begin_request()
+        with stage("manual"):
+            time.sleep(0.01)
+        assert _decorated_work() == "ok"
+        assert _decorated_work() == "ok"  # el decorador abre un temporizador nuevo por llamada
+        return current_request().summary()
+
+    before = metrics.STAGE_SECONDS._series.get(("decorated",), [None, 0.0, 0])[2]
+    summary = contextvars.copy_context().run(run)
+
+    assert set(summary["stages_s"]) == {"manual", "decorated"}
+    assert summary["stages_s"]["manual"] >= 0.01
+    assert summary["stages_s"]["decorated"] >= 0.02
+    assert metrics.STAGE_SECONDS._series[("decorated",)][2] == before + 2
+
+
+def test_stage_records_time_when_the_block_raises():
+    def run():
+        begin_request()
+        with pytest.raises(RuntimeError):
+            with stage("failing"):
+                raise RuntimeError("boom")
+        return current_request().stages
+
+    assert "failing" in contextvars.copy_context().run(run)
+
+
+def test_request_breakdown_is_isolated_per_context_and_shared_with_child_tasks():
+    async def request(name, n_children):
+        begin_request()
+
+        async def child():
+            with stage("llm"):
+                await asyncio.sleep(0.01)
+            metrics.record_llm_call({"prompt_tokens": 10, "completion_tokens": 2})
+
+        await asyncio.gather(*(child() for _ in range(n_children)))
+        with stage(name):
+            pass
+        return current_request().summary()
+
+    async def scenario():
+        return await asyncio.gather(request("a", 3), request("b", 1))
+
+    a, b = asyncio.run(scenario())
+    # Cada petición ve solo lo suyo; las tareas hijas suman en la que las lanzó
+    assert set(a["stages_s"]) == {"llm", "a"} and set(b["stages_s"]) == {"llm", "b"}
+    assert (a["llm_calls"], b["llm_calls"]) == (3, 1)
+    assert a["tokens"] == {"prompt": 30, "completion": 6}
+    assert b["tokens"] == {"prompt": 10, "completion": 2}
+
+
+def test_disabled_metrics_skip_timing(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+
+    def run():
+        begin_request()
+        with stage("off"):
+            pass
+        return current_request().stages
+
+    assert contextvars.copy_context().run(run) == {}
@@ -0,0 +1,20 @@
+# tests/test_parse_pool.py
+import asyncio
+
+from app import parsers
+from app.parse_pool import ParsePool
+
+
+def _pdf_workers():
+    return parsers.PDF_WORKERS
+
+
+def test_workers_extract_pdfs_sequentially(monkeypatch):
+    monkeypatch.setattr(parsers, "PDF_WORKERS", 8)
+    pool = ParsePool(workers=1, queue_depth=1, inline_max_bytes=0)
+    try:
+        assert asyncio.run(pool.run(_pdf_workers, size=1)) == 1
+    finally:
+        pool.shutdown()
+    # En el propio proceso (documento pequeño) se mantiene la configuración
+    assert asyncio.run(pool.run(_pdf_workers, size=0)) == 8
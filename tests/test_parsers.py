@@ -0,0 +1,175 @@
+# tests/test_parsers.py
+import random
+import re
+import zipfile
+from io import BytesIO
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, parsers
+from app.parsers import (
+    PDF_ENGINE_CHOICES,
+    extract_text_from_docx,
+    extract_text_from_pdf,
+    iter_docx_sections,
+    iter_txt_sections,
+)
+
+CORRUPT_PDFS = [b"esto no es un PDF", b"%PDF-1.4\n1 0 obj << /Type /Catalog", b""]
+
+
+@pytest.mark.parametrize("engine", PDF_ENGINE_CHOICES)
+@pytest.mark.parametrize("content", CORRUPT_PDFS)
+def test_corrupt_pdf_raises_value_error(engine, content):
+    with pytest.raises(ValueError, match="PDF"):
+        extract_text_from_pdf(content, engine=engine)
+
+
+def test_corrupt_pdf_is_a_422():
+    r = TestClient(main.app).post("/analyze", files={"file": ("plano.pdf", CORRUPT_PDFS[1])},
+                                  data={"lang": "en", "no_cache": "true"})
+    assert r.status_code == 422
+    assert r.json()["error_code"] == "unreadable_document"
+
+
+# ── DOCX (iterparse) ─────────────────────────────────────────────────────────
+
+_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+_STYLES = (f'<w:styles {_NS}><w:style w:type="paragraph" w:styleId="berschrift1">'
+           '<w:name w:val="heading 1"/></w:style></w:styles>')
+
+
+def _p(*runs, style=None):
+    ppr = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f"<w:p>{ppr}" + "".join(f"<w:r>{r}</w:r>" for r in runs) + "</w:p>"
+
+
+def _t(text):
+    return f'<w:t xml:space="preserve">{text}</w:t>'
+
+
+def _row(*cells):
+    return "<w:tr>" + "".join(f"<w:tc>{c}</w:tc>" for c in cells) + "</w:tr>"
+
+
+def _docx(body: str, styles: str = _STYLES, document: str = None) -> bytes:
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("word/document.xml", document or f"<w:document {_NS}><w:body>{body}</w:body></w:document>")
+        if styles:
+            zf.writestr("word/styles.xml", styles)
+    return buf.getvalue()
+
+
+def test_docx_headings_open_sections():
+    body = (_p(_t("Einleitung")) + _p(_t("Kapitel 1"), style="berschrift1") + _p(_t("Text A"))
+            + _p(_t("Kapitel 2"), style="Heading2") + _p(_t("Text B")))
+    sections = list(iter_docx_sections(_docx(body)))
+    assert [(s["page"], s["section"], s["text"]) for s in sections] == [
+        (1, None, "Einleitung"),
+        (2, "Kapitel 1", "Kapitel 1\nText A"),
+        (3, "Kapitel 2", "Kapitel 2\nText B"),
+    ]
+
+
+def test_docx_runs_tabs_and_breaks_join_in_one_paragraph():
+    body = _p(_t("Sperr"), _t("pause"), "<w:tab/>", _t("Gleis 3"), "<w:br/>", _t("Nacht"))
+    assert extract_text_from_docx(_docx(body)) == "Sperrpause\tGleis 3\nNacht"
+
+
+def test_docx_table_rows_and_nested_tables():
+    nested = "<w:tbl>" + _row(_p(_t("innen a")), _p(_t("innen b"))) + "</w:tbl>"
+    body = ("<w:tbl>" + _row(_p(_t("Risiko")), _p(_t("Maßnahme")))
+            + _row(_p(_t("Verzug")), _p(_t("Puffer")) + nested) + _row(_p(), _p()) + "</w:tbl>"
+            + _p(_t("Nach der Tabelle")))
+    assert extract_text_from_docx(_docx(body)).split("\n") == [
+        "Risiko | Maßnahme",
+        "Verzug | Puffer innen a | innen b",
+        "Nach der Tabelle",
+    ]
+
+
+def test_docx_long_sections_are_split():
+    body = "".join(_p(_t(f"Absatz {i} " + "x" * 40)) for i in range(6))
+    sections = list(iter_docx_sections(_docx(body), section_chars=100))
+    assert len(sections) == 3 and all(s["text"].count("\n") == 1 for s in sections)
+
+
+@pytest.mark.parametrize("docx", [
+    _docx("", document=f"<w:document {_NS}><w:body><w:p><w:r><w:t>offen"),  # XML mal formado
+    _docx(_p(_t("ok")), styles="<w:styles"),                                  # styles.xml roto
+    b"PK\x03\x04 no es un zip",
+], ids=["document_xml", "styles_xml", "zip"])
+def test_corrupt_docx_raises_value_error(docx):
+    with pytest.raises(ValueError, match="docx"):
+        list(iter_docx_sections(docx))
+
+
+def test_corrupt_docx_xml_is_a_422():
+    body = _docx("", document=f"<w:document {_NS}><w:body><w:p>")
+    r = TestClient(main.app).post("/analyze", files={"file": ("plan.docx", body)},
+                                  data={"lang": "en", "no_cache": "true"})
+    assert r.status_code == 422
+    assert r.json()["error_code"] == "unreadable_document"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  TXT
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _txt_whole(data: bytes, section_chars: int):
+    """Referencia: decodificar todo de una vez y cortar en líneas en blanco."""
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = data.decode("latin-1")
+    blocks = (b.strip() for b in re.split(r"\n\s*\n", text))
+    return list(parsers._group_sections((b for b in blocks if b), section_chars))
+
+
+class _CountingReader(BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 7, 64])
+def test_txt_chunks_match_whole_file_decoding(monkeypatch, chunk):
+    monkeypatch.setattr(parsers, "TXT_CHUNK_BYTES", chunk)
+    rng = random.Random(chunk)
+    pieces = ["Grundwasser", "Überführung", "señalización", "€", " ", "\n", "\n\n", "\r\n\r\n", "\n \t\n"]
+    for _ in range(30):
+        data = "".join(rng.choice(pieces) for _ in range(60)).encode("utf-8")
+        assert list(iter_txt_sections(data, section_chars=40)) == _txt_whole(data, 40)
+
+
+def test_txt_blank_line_and_multibyte_char_across_chunks(monkeypatch):
+    monkeypatch.setattr(parsers, "TXT_CHUNK_BYTES", 4)
+    data = "Aé\n\nÜber €\n  \nZ".encode("utf-8")
+    assert [s["text"] for s in iter_txt_sections(data, section_chars=1)] == ["Aé", "Über €", "Z"]
+
+
+def test_txt_invalid_utf8_late_in_file_falls_back_to_latin1(monkeypatch):
+    monkeypatch.setattr(parsers, "TXT_CHUNK_BYTES", 8)
+    data = "Präambel\n\n".encode("utf-8") + b"x" * 40 + b"\n\nStra\xdfe"
+    sections = list(iter_txt_sections(data, section_chars=1))
+    # Todo el archivo en latin-1, como al decodificarlo de una vez
+    assert sections == _txt_whole(data, 1)
+    assert sections[-1]["text"] == "Straße"
+
+
+def test_txt_is_read_in_bounded_chunks(monkeypatch, tmp_path):
+    monkeypatch.setattr(parsers, "TXT_CHUNK_BYTES", 1024)
+    reader = _CountingReader(("Absatz mit Text.\n\n" * 2000).encode("utf-8"))
+    sections = iter_txt_sections(reader, section_chars=100)
+    next(sections)
+    assert reader.reads and all(size == 1024 for size in reader.reads)
+
+    path = tmp_path / "plan.txt"
+    path.write_bytes(reader.getvalue())
+    assert list(iter_txt_sections(str(path), section_chars=100)) == _txt_whole(reader.getvalue(), 100)
@@ -0,0 +1,74 @@
+# tests/test_pipeline.py
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, pipeline
+from app.cache import ResultCache
+from app.pipeline import AnalysisError
+
+LISTS = ("intuitive_risks", "counterintuitive_risks")
+DOCUMENT = "Sperrpause Gleis 3 im Juni. Brücke über den Kanal ohne Baugenehmigung.\n\n" * 5
+
+
+@pytest.fixture
+def cached_document(monkeypatch, tmp_path):
+    """DOCUMENT ya analizado como .txt en inglés (el LLM es un doble)."""
+    calls = []
+
+    async def fake_generate(text, context="", lang="es"):
+        calls.append(lang)
+        return {name: [{"risk": f"{name} {i}", "justification": "j", "countermeasure": "c",
+                        "page": 1, "evidence": ""} for i in range(5)] for name in LISTS} | {"source": "openai"}
+
+    cache = ResultCache(db_path=str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(pipeline, "result_cache", cache)
+    monkeypatch.setattr(main, "result_cache", cache)
+    monkeypatch.setattr(pipeline, "agenerate_risks", fake_generate)
+    monkeypatch.setattr(pipeline, "INCREMENTAL_ENABLED", False)
+    monkeypatch.setattr(pipeline, "RISK_LIBRARY_ENABLED", False)
+    asyncio.run(pipeline.run_analysis(DOCUMENT.encode(), "a.txt", lang="en", mode="single"))
+    return calls
+
+
+def test_cached_bytes_with_unsupported_extension_are_rejected(cached_document):
+    hit = asyncio.run(pipeline.run_analysis(DOCUMENT.encode(), "A.TXT", lang="en", mode="single"))
+    assert hit["_debug"]["cache"].startswith("hit")
+    with pytest.raises(AnalysisError) as info:
+        asyncio.run(pipeline.run_analysis(DOCUMENT.encode(), "a.xls", lang="en", mode="single"))
+    assert info.value.error_code == "unsupported_format"
+
+
+def test_unsupported_lang_is_rejected_before_translating(cached_document):
+    with pytest.raises(AnalysisError) as info:
+        asyncio.run(pipeline.run_analysis(DOCUMENT.encode(), "a.txt", lang="fr", mode="single"))
+    assert info.value.error_code == "invalid_lang" and info.value.status_code == 400
+    assert cached_document == ["en"]
+
+
+@pytest.mark.parametrize("path", ["/analyze", "/analyze/stream"])
+@pytest.mark.parametrize("filename, lang, error_code", [("a.xls", "en", "unsupported_format"),
+                                                        ("a.txt", "fr", "invalid_lang")])
+def test_api_validates_before_the_cache(cached_document, path, filename, lang, error_code):
+    client = TestClient(main.app)
+    r = client.post(path, files={"file": (filename, DOCUMENT.encode())}, data={"lang": lang, "mode": "single"})
+    assert r.status_code == 400
+    assert r.json()["error_code"] == error_code
+
+
+def test_background_job_validates_lang_before_enqueueing(cached_document):
+    client = TestClient(main.app)
+    r = client.post("/analyze", files={"file": ("a.txt", DOCUMENT.encode())}, data={"lang": "fr", "background": "true"})
+    assert r.status_code == 400 and r.json()["error_code"] == "invalid_lang"
+
+
+def test_request_debug_does_not_leak_into_the_cache(cached_document):
+    first = asyncio.run(pipeline.run_analysis(DOCUMENT.encode(), "a.txt", lang="en", mode="single", invalidate=True))
+    first["_debug"]["upload_bytes"] = 123
+    first["intuitive_risks"][0]["risk"] = "cambiado por el llamador"
+
+    cache_key = first["_debug"]["cache_key"]
+    stored, _ = pipeline.result_cache.get(cache_key)
+    assert "memory" not in stored["_debug"] and "upload_bytes" not in stored["_debug"]
+    assert stored["intuitive_risks"][0]["risk"] == "intuitive_risks 0"
@@ -0,0 +1,77 @@
+# tests/test_portfolio.py
+import pytest
+
+from app.portfolio import THEME_NAMES, PortfolioStore, risk_theme
+
+
+def _theme(title, justification=""):
+    return THEME_NAMES[risk_theme({"risk": title, "justification": justification})]
+
+
+@pytest.mark.parametrize("title, theme", [
+    ("Terminverzug bei der Inbetriebnahme", "schedule"),
+    ("Baugrundrisiko im Tunnelabschnitt", "ground"),
+    ("Public objections delay the hearing", "schedule"),
+    ("Retraso en la licitación", "schedule"),
+    ("Lärmschutzwände fehlen", "environment"),
+])
+def test_risk_theme_matches_word_starts(title, theme):
+    assert _theme(title) == theme
+
+
+@pytest.mark.parametrize("title", [
+    "Scope was never determined",       # "termin"
+    "Background checks for staff",      # "ground"
+    "Cooperation with the neighbours",  # "operation"
+    "Federal republic guidelines",      # "public"
+])
+def test_risk_theme_ignores_stems_inside_words(title):
+    assert _theme(title) == "other"
+
+
+# ── segmentos y compactación ─────────────────────────────────────────────────
+
+def _record(key, file, risks, lang="en", created_at=0.0, pages=10, **extra):
+    return {"cache_key": key, "file_sha256": file, "filename": f"{file}.pdf", "lang": lang,
+            "created_at": created_at, "pages": pages,
+            "risks": {"intuitive_risks": risks, "counterintuitive_risks": []}, **extra}
+
+
+def _risks(*titles, countermeasure="Puffer einplanen"):
+    return [{"risk": t, "justification": "", "countermeasure": countermeasure, "page": 1} for t in titles]
+
+
+def test_repeated_analysis_replaces_the_previous_one(tmp_path):
+    store = PortfolioStore(str(tmp_path))
+    store.append([_record("k1", "doc", _risks("Kosten steigen", "Terminverzug"))])
+    store.append([_record("k2", "other", _risks("Kosten")), _record("k1", "doc", _risks("Tunnel"))])
+    store.append([_record("k3", "doc", _risks("Kosten"), translated_from="k1")])  # no cuenta
+
+    stats = store.stats()
+    assert stats["analyses"] == 2
+    assert stats["by_theme"]["cost"]["total"] == 1 and stats["by_theme"]["ground"]["total"] == 1
+    assert stats["by_theme"]["schedule"]["total"] == 0
+
+
+def test_compaction_keeps_the_same_stats(tmp_path):
+    batches = [[_record(f"k{i % 3}", f"doc{i % 2}", _risks(f"Kosten {i}", "Frist", countermeasure=f"cm {i % 2}"),
+                        lang="de" if i % 2 else "en", created_at=float(i))]
+               for i in range(7)]
+    plain = PortfolioStore(str(tmp_path / "plain"), max_segments=100)
+    compacted = PortfolioStore(str(tmp_path / "compacted"), max_segments=2)
+    for batch in batches:
+        plain.append(batch)
+        compacted.append(batch)
+
+    assert len(list((tmp_path / "compacted").glob("seg-*.npz"))) <= 2
+    assert compacted.stats() == plain.stats()
+    # Tras reabrir desde disco el resultado es el mismo
+    assert PortfolioStore(str(tmp_path / "compacted")).stats() == plain.stats()
+    assert plain.stats()["analyses"] == 3
+
+
+def test_importing_the_api_does_not_load_numpy():
+    # La misma comprobación que benchmarks/bench_startup.py: el arranque no paga numpy
+    from benchmarks.bench_startup import loaded_lazy_modules
+
+    assert loaded_lazy_modules() == []
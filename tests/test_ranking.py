@@ -0,0 +1,79 @@
+# tests/test_ranking.py
+import pytest
+
+from app.ranking import _marker_cost, bm25_scores, build_query, select_passages, split_passages, tokenize
+
+FILLER = "Das Wetter war freundlich und die Kantine bot Eintopf mit Brot an."
+RELEVANT = {
+    4: "Die Sperrpause reicht nicht: Verzug beim Stellwerk und Vertragsstrafe drohen.",
+    9: "Baugrund mit Altlasten und Grundwasser erhöht die Mehrkosten erheblich.",
+}
+
+
+def _document(n_pages=12, lines=12):
+    return [{"page": i + 1, "text": "\n".join([RELEVANT.get(i + 1, FILLER)] + [FILLER] * (lines - 1))}
+            for i in range(n_pages)]
+
+
+def _size(pages):
+    # Lo mismo que cuenta select_passages: texto + salto de línea + marcador de página
+    return sum(len(p["text"]) + 1 + _marker_cost(p["page"]) for p in pages)
+
+
+def test_tokenize_stems_and_drops_short_words_and_digits():
+    assert tokenize("Baugrundgutachten am Gleis 3, S-Bahn") == ["baugru", "gleis", "bahn"]
+
+
+def test_short_document_passes_through_unchanged():
+    pages = _document(n_pages=2, lines=2)
+    selected, info = select_passages(pages, "", max_chars=_size(pages))
+    assert selected is pages and info == {"selection": "all"}
+
+
+def test_empty_document_passes_through():
+    pages = [{"page": 1, "text": ""}, {"page": 2, "text": "   \n  "}]
+    assert select_passages(pages, "", max_chars=1) == (pages, {"selection": "all"})
+
+
+def test_top_passages_contain_the_relevant_pages():
+    pages = _document()
+    budget = _size(pages) // 3
+    selected, info = select_passages(pages, "", max_chars=budget)
+
+    assert info["selection"] == "ranked" and info["passages_selected"] < info["passages"]
+    assert _size(selected) <= budget
+    assert {4, 9} <= {p["page"] for p in selected}
+    assert selected[0]["page"] == 1  # el primer pasaje (portada, objeto) siempre entra
+    assert [p["page"] for p in selected] == sorted(p["page"] for p in selected)  # orden de documento
+
+
+def test_context_terms_raise_their_passages():
+    pages = _document()
+    pages[6]["text"] = "Der Bahnsteig in Kleinstadt wird verlängert.\n" + pages[6]["text"]
+    budget = _size([pages[0], pages[6]])  # portada + un pasaje
+    without, _ = select_passages(pages, "", max_chars=budget)
+    with_context, _ = select_passages(pages, "Verlängerung Bahnsteig Kleinstadt", max_chars=budget)
+    assert [p["page"] for p in without] == [1, 9]
+    assert [p["page"] for p in with_context] == [1, 7]
+
+
+def test_ties_keep_document_order_and_are_stable():
+    # Todas las páginas iguales: a igualdad de puntuación gana lo que aparece antes
+    pages = [{"page": i + 1, "text": "\n".join([FILLER] * 12)} for i in range(8)]
+    budget = _size(pages) // 3
+    first, _ = select_passages(pages, "", max_chars=budget)
+    second, _ = select_passages(pages, "", max_chars=budget)
+    assert first == second
+    assert [p["page"] for p in first] == list(range(1, len(first) + 1))
+
+
+def test_split_passages_cuts_huge_lines():
+    passages = split_passages([{"page": 3, "text": "x" * 2500}], passage_chars=1000)
+    assert [len(p["text"]) for p in passages] == [1000, 1000, 500]
+    assert all(p["page"] == 3 for p in passages)
+
+
+def test_bm25_prefers_passages_with_query_terms():
+    passages = [{"text": FILLER}, {"text": RELEVANT[4]}, {"text": FILLER + " " + FILLER}]
+    scores = bm25_scores(passages, build_query(""))
+    assert scores[1] > scores[0] and scores[0] == pytest.approx(scores[2], abs=1e-9) == 0
@@ -0,0 +1,264 @@
+# tests/test_risk_engine.py
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app import metrics, risk_engine
+
+
+def _risk(title, page=1):
+    return {"risk": title, "justification": f"j {title}", "countermeasure": f"c {title}",
+            "page": page, "evidence": f"e {title}"}
+
+
+def _window_reply(prefix):
+    return json.dumps({
+        "intuitive_risks": [_risk(f"{prefix} intuitive {i}") for i in range(5)],
+        "counterintuitive_risks": [_risk(f"{prefix} counter {i}") for i in range(5)],
+    })
+
+
+@pytest.mark.parametrize("content", ['[0, 1, 2]', '"0 1 2"', '42'])
+def test_parse_ranking_rejects_non_objects(content):
+    with pytest.raises(ValueError):
+        risk_engine._parse_ranking(content)
+
+
+def test_parse_ranking_drops_non_list_values():
+    ranked = risk_engine._parse_ranking('{"intuitive_risks": [3, 1], "counterintuitive_risks": 7}')
+    assert ranked == {"intuitive_risks": [3, 1]}
+
+
+@pytest.mark.parametrize("ranking_reply", ['[0, 1, 2]', '"ids"', '{"intuitive_risks": "0,1"}'])
+def test_chunked_falls_back_to_document_order_on_bad_ranking(monkeypatch, ranking_reply):
+    replies = iter([_window_reply("a"), _window_reply("b"), ranking_reply])
+
+    async def fake_completion(messages, **kwargs):
+        return next(replies)
+
+    monkeypatch.setattr(risk_engine, "_achat_completion", fake_completion)
+    monkeypatch.setattr(risk_engine, "split_into_windows", lambda pages: [pages[:1], pages[1:]])
+    pages = [{"page": 1, "text": "uno"}, {"page": 2, "text": "dos"}]
+
+    data = asyncio.run(risk_engine.agenerate_risks_chunked(pages, context="Bahn", lang="en"))
+
+    assert data["_chunks"] == 2
+    assert [r["risk"] for r in data["intuitive_risks"]] == [f"a intuitive {i}" for i in range(5)]
+    assert len(data["counterintuitive_risks"]) == 5
+
+
+def test_sync_entry_points_wrap_the_async_pipeline(monkeypatch):
+    replies = iter([json.dumps({"intuitive_risks": [_risk(f"i{i}") for i in range(5)],
+                                "counterintuitive_risks": [_risk(f"c{i}") for i in range(4)]}),
+                    json.dumps({"counterintuitive_risks": [_risk("reask")]})])
+
+    async def fake_completion(messages, **kwargs):
+        return next(replies)
+
+    monkeypatch.setattr(risk_engine, "_achat_completion", fake_completion)
+    data = risk_engine.generate_risks("texto", lang="en")
+    # El re-ask (solo existe en la versión async) también corre por la vía síncrona
+    assert data["counterintuitive_risks"][-1]["risk"] == "reask" and data["source"] == "openai"
+
+
+def _translation_source():
+    return {
+        "intuitive_risks": [_risk("Verzug ETCS", 3), _risk("Kosten", 4)],
+        "counterintuitive_risks": [],
+    }
+
+
+def test_translation_equal_to_original_is_not_missing():
+    source = _translation_source()
+    reply = json.dumps({"intuitive_risks": [
+        {"id": 0, "risk": "Verzug ETCS", "justification": "j Verzug ETCS", "countermeasure": "c Verzug ETCS"},
+        {"id": 1, "risk": "Cost", "justification": "j cost", "countermeasure": "c cost"},
+    ]})
+    out = risk_engine._merge_translation(source, reply)
+    assert "_translation_missing" not in out
+    assert out["intuitive_risks"][1]["risk"] == "Cost"
+    assert out["intuitive_risks"][1]["page"] == 4  # page/evidence se copian del original
+
+
+def test_translation_with_missing_or_empty_fields_is_counted():
+    source = _translation_source()
+    reply = json.dumps({"intuitive_risks": [
+        {"id": 0, "risk": "Delay", "justification": "", "countermeasure": "c"},
+    ]})
+    out = risk_engine._merge_translation(source, reply)
+    assert out["_translation_missing"] == 2  # id 0 con un campo vacío, id 1 ausente
+    assert out["intuitive_risks"][0]["risk"] == "Delay"
+    assert out["intuitive_risks"][0]["justification"] == "j Verzug ETCS"
+
+
+def test_translation_reply_that_is_not_an_object():
+    out = risk_engine._merge_translation(_translation_source(), "[1, 2]")
+    assert out["_translation_missing"] == 2
+
+
+# ── streaming ────────────────────────────────────────────────────────────────
+
+class _FakeStreamClient:
+    def __init__(self, text, pieces=9):
+        self.text, self.pieces = text, pieces
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        async def chunks():
+            step = -(-len(self.text) // self.pieces)
+            for i in range(0, len(self.text), step):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.text[i:i + step]))],
+                                      usage=None)
+        return chunks()
+
+
+class _DirectTransport:
+    async def acall(self, fn, hedge=True, **kwargs):
+        return await fn(None)
+
+
+def _stream_events(monkeypatch, reply, reask=None):
+    llm = SimpleNamespace(use_new_sdk=True,
+                          async_resources=lambda: (_FakeStreamClient(reply), asyncio.Semaphore(1)))
+    monkeypatch.setattr(risk_engine, "get_llm", lambda: llm)
+    monkeypatch.setattr(risk_engine, "llm_transport", _DirectTransport())
+    reasks = []
+
+    async def fake_reask(messages, **kwargs):
+        reasks.append(messages)
+        return reask
+
+    monkeypatch.setattr(risk_engine, "_achat_completion", fake_reask)
+
+    async def collect():
+        return [ev async for ev in risk_engine.astream_risks("texto", lang="en")]
+
+    return asyncio.run(collect()), reasks
+
+
+def test_stream_emits_only_valid_risks_and_at_most_five(monkeypatch):
+    intuitive = [_risk(f"i{i}") for i in range(7)]
+    del intuitive[2]["evidence"]
+    reply = json.dumps({"intuitive_risks": intuitive, "counterintuitive_risks": [_risk(f"c{i}") for i in range(5)]})
+
+    events, reasks = _stream_events(monkeypatch, reply)
+
+    streamed = [ev["item"]["risk"] for ev in events if ev["event"] == "risk" and ev["kind"] == "intuitive"]
+    assert streamed == ["i0", "i1", "i3", "i4", "i5"]
+    result = events[-1]["data"]
+    assert [r["risk"] for r in result["intuitive_risks"]] == streamed
+    assert len(result["counterintuitive_risks"]) == 5 and not reasks
+
+
+def test_stream_reask_fills_the_gap_and_is_emitted(monkeypatch):
+    counter = [_risk(f"c{i}") for i in range(5)]
+    counter[4]["page"] = "S. 9"
+    del counter[1]["justification"]
+    reply = json.dumps({"intuitive_risks": [_risk(f"i{i}") for i in range(5)], "counterintuitive_risks": counter})
+    reask = json.dumps({"counterintuitive_risks": [_risk("c0"), _risk("nuevo")]})
+
+    events, reasks = _stream_events(monkeypatch, reply, reask)
+
+    assert len(reasks) == 1
+    streamed = [ev["item"] for ev in events if ev["event"] == "risk" and ev["kind"] == "counterintuitive"]
+    assert [r["risk"] for r in streamed] == ["c0", "c2", "c3", "c4", "nuevo"]
+    assert streamed[3]["page"] == 9
+    assert events[-1]["data"]["counterintuitive_risks"] == streamed
+
+
+def test_slow_consumer_does_not_hold_the_llm_slot(monkeypatch):
+    reply = json.dumps({name: [_risk(f"{name}{i}") for i in range(5)] for name in risk_engine.RISK_LISTS})
+
+    async def scenario():
+        semaphore = asyncio.Semaphore(1)
+        llm = SimpleNamespace(use_new_sdk=True, async_resources=lambda: (_FakeStreamClient(reply), semaphore))
+        monkeypatch.setattr(risk_engine, "get_llm", lambda: llm)
+        monkeypatch.setattr(risk_engine, "llm_transport", _DirectTransport())
+        request = metrics.begin_request()
+
+        stream = risk_engine.astream_risks("texto", lang="en")
+        events = [await stream.__anext__()]
+        await asyncio.sleep(0.1)  # el cliente HTTP tarda en leer
+        # La API ya se leyó entera: el cupo está libre y el timer parado
+        assert not semaphore.locked()
+        events += [ev async for ev in stream]
+        return events, request.stages["llm"]
+
+    events, llm_seconds = asyncio.run(scenario())
+    assert events[-1]["event"] == "result" and len(events) == 11
+    assert llm_seconds < 0.1
+
+
+def test_stream_error_is_raised_to_the_consumer(monkeypatch):
+    class _BrokenClient(_FakeStreamClient):
+        async def _create(self, **kwargs):
+            async def chunks():
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='{"intuitive'))],
+                                      usage=None)
+                raise ConnectionError("stream cortado")
+            return chunks()
+
+    llm = SimpleNamespace(use_new_sdk=True, async_resources=lambda: (_BrokenClient(""), asyncio.Semaphore(1)))
+    monkeypatch.setattr(risk_engine, "get_llm", lambda: llm)
+    monkeypatch.setattr(risk_engine, "llm_transport", _DirectTransport())
+
+    async def collect():
+        return [ev async for ev in risk_engine.astream_risks("texto", lang="en")]
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(collect())
+
+
+# ── concurrencia del camino async ────────────────────────────────────────────
+
+class _CountingClient:
+    """Cliente falso que mide cuántas llamadas hay en vuelo a la vez."""
+
+    def __init__(self, reply):
+        self.reply, self.in_flight, self.peak, self.calls = reply, 0, 0, 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, timeout=None, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+
+
+@pytest.mark.parametrize("llm_slots, max_parallel, expected_peak", [(2, 8, 2), (8, 3, 3)])
+def test_chunked_calls_respect_the_llm_semaphore(monkeypatch, llm_slots, max_parallel, expected_peak):
+    client = _CountingClient(_window_reply("w"))
+    monkeypatch.setattr(risk_engine, "split_into_windows", lambda pages: [[p] for p in pages])
+    pages = [{"page": i + 1, "text": f"Seite {i}"} for i in range(10)]
+
+    async def scenario():
+        # Un semáforo por loop, como LLMClients.async_resources con LLM_MAX_CONCURRENCY
+        semaphore = asyncio.Semaphore(llm_slots)
+        llm = SimpleNamespace(use_new_sdk=True, async_resources=lambda: (client, semaphore))
+        monkeypatch.setattr(risk_engine, "get_llm", lambda: llm)
+        return await risk_engine.agenerate_risks_chunked(pages, lang="en", max_parallel=max_parallel)
+
+    data = asyncio.run(scenario())
+    assert data["_chunks"] == 10
+    assert client.calls == 11  # 10 ventanas + el ranking
+    assert client.peak == expected_peak
+
+
+def test_async_resources_are_per_loop_with_the_configured_cap(monkeypatch):
+    monkeypatch.setattr(risk_engine, "LLM_MAX_CONCURRENCY", 3)
+    llm = risk_engine.LLMClients()  # SDK viejo: sin cliente async, solo el semáforo
+
+    async def resources():
+        first, second = llm.async_resources(), llm.async_resources()
+        assert first is second
+        return first
+
+    client, semaphore = asyncio.run(resources())
+    assert client is None and semaphore._value == 3
+    assert asyncio.run(resources())[1] is not semaphore  # otro loop, otro semáforo
@@ -0,0 +1,89 @@
+# tests/test_risk_library.py
+import pytest
+
+from app import risk_library as risk_library_module
+from app.risk_library import RiskLibrary, _fts_query, library_record
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(risk_library_module, "PORTFOLIO_ENABLED", False)
+    return RiskLibrary(str(tmp_path / "library.sqlite3"))
+
+
+def _risk(title, justification="", page=1):
+    return {"risk": title, "justification": justification, "countermeasure": "Puffer einplanen",
+            "page": page, "evidence": ""}
+
+
+def _result(sha, lang, intuitive, counter=()):
+    return {"intuitive_risks": list(intuitive), "counterintuitive_risks": list(counter),
+            "_debug": {"file_sha256": sha, "filename": f"{sha}.pdf", "lang": lang, "pages_read": 3}}
+
+
+def _titles(found):
+    return [item["risk"] for item in found["items"]]
+
+
+def test_fts_query_quotes_words_and_prefixes_the_last():
+    assert _fts_query('Verzug "OR" stell') == '"verzug" "or" "stell"*'
+    assert _fts_query("  ") is None
+
+
+def test_submitted_analyses_are_searchable_after_flush(library):
+    library.submit(library_record("k1", "a1", _result("doc1", "de", [_risk("Verzögerung der Genehmigung")])))
+    library.submit(library_record("k2", "a2", _result("doc2", "en", [_risk("Approval delay")],
+                                                      [_risk("Genehmigung fehlt", page="S. 4")])))
+    assert library.flush() == 2
+
+    # Sin diacríticos y con la última palabra como prefijo
+    found = library.search("verzogerung genehm")
+    assert found["total"] == 1 and _titles(found) == ["Verzögerung der Genehmigung"]
+    assert found["items"][0]["file_sha256"] == "doc1" and "[" in found["items"][0]["snippet"]
+
+    assert library.search("genehmigung")["total"] == 2
+    assert _titles(library.search("genehmigung", kind="counterintuitive")) == ["Genehmigung fehlt"]
+    assert library.search("genehmigung", kind="counterintuitive")["items"][0]["page"] is None
+    assert library.search("genehmigung", lang="en", file_sha256="doc2")["total"] == 1
+
+
+def test_title_matches_rank_first(library):
+    library.submit(library_record("k1", "a1", _result("d", "en", [
+        _risk("Cost overrun", justification="Signalling delay pushes cost up"),
+        _risk("Signalling delay"),
+    ])))
+    library.flush()
+    assert _titles(library.search("signalling")) == ["Signalling delay", "Cost overrun"]
+
+
+def test_reanalysis_with_the_same_cache_key_replaces_the_old_risks(library):
+    library.submit(library_record("k1", "a1", _result("doc", "de", [_risk("Tunnel Vereisung")])))
+    library.flush()
+    library.submit(library_record("k1", "a1", _result("doc", "de", [_risk("Tunnel Wassereinbruch")])))
+    library.flush()
+
+    assert library.search("vereisung")["total"] == 0
+    assert _titles(library.search("tunnel")) == ["Tunnel Wassereinbruch"]
+
+
+def test_pending_queue_drops_the_oldest_when_full(library):
+    library.max_pending = 2
+    library.batch_size = 100  # el escritor no vacía la cola durante el test
+    for i in range(3):
+        library.submit(library_record(f"k{i}", f"a{i}", _result("doc", "en", [_risk(f"Risk number{i}")])))
+    library.flush()
+    assert _titles(library.search("number0")) == []
+    assert library.search("risk")["total"] == 2
+
+
+def test_like_fallback_without_fts(library):
+    library.submit(library_record("k1", "a1", _result("doc", "de", [_risk("Baugrund instabil")])))
+    library.flush()
+    library.fts = False
+    found = library.search("BAUGRUND inst")
+    assert found["total"] == 1 and found["items"][0]["snippet"] is None
+
+
+def test_empty_query_is_rejected(library):
+    with pytest.raises(ValueError):
+        library.search(" ,; ")
@@ -0,0 +1,89 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    async def scenario():
+        flight, runs = SingleFlight(), []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return {"ok": True}
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(3)))
+        assert len(runs) == 1
+        assert [shared for _, shared in results] == [False, True, True]
+        assert results[0][0] is results[1][0]
+        assert not flight.in_flight("k")
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_does_not_cancel_the_followers():
+    async def scenario():
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 42
+
+        leader = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == (42, True)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+
+
+def test_execution_is_cancelled_when_every_caller_leaves():
+    async def scenario():
+        flight, started, cancelled = SingleFlight(), asyncio.Event(), asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.create_task(flight.do("k", work)) for _ in range(2)]
+        await started.wait()
+        for task in callers:
+            task.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        # La clave ya está libre: una petición nueva no hereda la cancelación
+        assert not flight.in_flight("k")
+        assert await flight.do("k", lambda: asyncio.sleep(0, "fresh")) == ("fresh", False)
+
+    asyncio.run(scenario())
+
+
+def test_exceptions_reach_every_caller_and_are_not_cached():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def boom():
+            calls.append(1)
+            await asyncio.sleep(0)
+            raise RuntimeError("falla")
+
+        results = await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results) and len(calls) == 1
+        with pytest.raises(RuntimeError):
+            await flight.do("k", boom)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
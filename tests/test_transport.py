@@ -0,0 +1,245 @@
+# tests/test_transport.py
+import asyncio
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app import transport
+from app.transport import CircuitBreaker, LLMTransportError, Transport, backoff_delay, classify
+
+
+class _StatusError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(status_code=status, headers=headers or {})
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (asyncio.TimeoutError(), (True, "timeout")),
+    (APITimeoutError(), (True, "timeout")),
+    (APIConnectionError(), (True, "connection")),
+    (_StatusError(429), (True, "rate_limit")),
+    (_StatusError(503), (True, "server_error")),
+    (_StatusError(408), (True, "server_error")),
+    (_StatusError(400), (False, "client_error")),
+    (ValueError("json"), (False, "error")),
+])
+def test_classify(exc, expected):
+    assert classify(exc) == expected
+
+
+def test_backoff_is_full_jitter_capped_at_max(monkeypatch):
+    monkeypatch.setattr(transport.random, "uniform", lambda a, b: b)  # el extremo superior
+    assert backoff_delay(0, base_s=0.5, max_s=20) == 0.5
+    assert backoff_delay(3, base_s=0.5, max_s=20) == 4.0
+    assert backoff_delay(10, base_s=0.5, max_s=20) == 20
+    monkeypatch.setattr(transport.random, "uniform", lambda a, b: a)
+    assert backoff_delay(3, base_s=0.5, max_s=20) == 0
+
+
+def test_backoff_never_waits_less_than_retry_after(monkeypatch):
+    monkeypatch.setattr(transport.random, "uniform", lambda a, b: a)
+    assert backoff_delay(0, retry_after=7, base_s=0.5) == 7
+    monkeypatch.undo()
+    # Con jitter real: Retry-After más como mucho una base de holgura
+    assert all(7 <= backoff_delay(0, retry_after=7, base_s=0.5) <= 7.5 for _ in range(50))
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after": "12"}, 12.0),
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "mañana"}, None),
+    ({}, None),
+])
+def test_retry_after_header(headers, expected):
+    assert transport._retry_after_seconds(_StatusError(429, headers)) == expected
+
+
+def test_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    seconds = transport._retry_after_seconds(_StatusError(503, {"retry-after": format_datetime(when, usegmt=True)}))
+    assert 25 < seconds <= 30
+
+
+# ── reintentos ───────────────────────────────────────────────────────────────
+
+class _Flaky:
+    """Falla las primeras `failures` llamadas con `error` y luego responde."""
+
+    def __init__(self, failures, error):
+        self.failures, self.error, self.calls, self.timeouts = failures, error, 0, []
+
+    async def __call__(self, timeout):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    # Registra las esperas pedidas sin dormir de verdad
+    recorded = []
+
+    def fake_backoff(attempt, retry_after=None, **kwargs):
+        recorded.append((attempt, retry_after))
+        return 0.0
+
+    monkeypatch.setattr(transport, "backoff_delay", fake_backoff)
+    return recorded
+
+
+def test_retries_retryable_errors_then_succeeds(delays):
+    flaky = _Flaky(2, _StatusError(503))
+    t = Transport(max_retries=3, attempt_timeout=5, breaker=CircuitBreaker(failures=0))
+    assert asyncio.run(t.acall(flaky, hedge=False)) == "ok"
+    assert flaky.calls == 3 and delays == [(0, None), (1, None)]
+
+
+def test_retry_after_is_passed_to_the_backoff(delays):
+    flaky = _Flaky(1, _StatusError(429, {"retry-after": "3"}))
+    t = Transport(max_retries=3, breaker=CircuitBreaker(failures=0))
+    assert asyncio.run(t.acall(flaky, hedge=False)) == "ok"
+    assert delays == [(0, 3.0)]
+
+
+def test_exhausted_retries_raise_a_transport_error(delays):
+    flaky = _Flaky(10, _StatusError(429, {"retry-after": "4"}))
+    t = Transport(max_retries=2, breaker=CircuitBreaker(failures=0))
+    with pytest.raises(LLMTransportError) as info:
+        asyncio.run(t.acall(flaky, hedge=False))
+    assert flaky.calls == 3
+    assert info.value.error_code == "llm_rate_limited" and info.value.retry_after == 4.0
+
+
+def test_client_errors_are_not_retried(delays):
+    flaky = _Flaky(1, _StatusError(400))
+    t = Transport(max_retries=3)
+    with pytest.raises(_StatusError):
+        asyncio.run(t.acall(flaky, hedge=False))
+    assert flaky.calls == 1 and t.breaker.state == "closed"
+
+
+def test_attempt_timeout_counts_as_a_retryable_timeout(delays):
+    calls = []
+
+    async def slow(timeout):
+        calls.append(timeout)
+        await asyncio.sleep(1)
+
+    t = Transport(max_retries=1, attempt_timeout=0.01, breaker=CircuitBreaker(failures=0))
+    with pytest.raises(LLMTransportError) as info:
+        asyncio.run(t.acall(slow, hedge=False))
+    assert info.value.error_code == "llm_timeout" and len(calls) == 2
+
+
+# ── circuit breaker ──────────────────────────────────────────────────────────
+
+def test_breaker_opens_probes_and_closes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(transport.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failures=2, reset_s=30)
+
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(LLMTransportError) as info:
+        breaker.allow()
+    assert info.value.error_code == "llm_circuit_open" and info.value.retry_after == 30
+
+    now[0] += 30
+    breaker.allow()  # la única prueba de half_open
+    assert breaker.state == "half_open"
+    with pytest.raises(LLMTransportError):
+        breaker.allow()  # una segunda petición no pasa mientras la prueba está en vuelo
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def test_failed_probe_reopens_and_cancelled_probe_is_released(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(transport.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failures=1, reset_s=10)
+    breaker.record_failure()
+    now[0] = 10
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 20
+    breaker.allow()
+    breaker.release()  # prueba cancelada: otra petición puede probar
+    breaker.allow()
+    assert breaker.state == "half_open"
+
+
+def test_open_breaker_fails_fast_without_calling_upstream(delays):
+    flaky = _Flaky(10, _StatusError(500))
+    t = Transport(max_retries=5, breaker=CircuitBreaker(failures=2, reset_s=60))
+    with pytest.raises(LLMTransportError) as info:
+        asyncio.run(t.acall(flaky, hedge=False))
+    assert info.value.error_code == "llm_circuit_open" and flaky.calls == 2
+
+
+# ── hedging ──────────────────────────────────────────────────────────────────
+
+def _hedging_transport():
+    t = Transport(attempt_timeout=5, breaker=CircuitBreaker(failures=0))
+    for _ in range(transport.LLM_HEDGE_MIN_SAMPLES):
+        t.latencies.record(0.01)
+    return t
+
+
+def test_slow_primary_is_hedged_and_the_duplicate_wins(monkeypatch):
+    monkeypatch.setattr(transport, "LLM_HEDGE_MIN_DELAY_S", 0.02)
+    calls, cancelled = [], []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return f"call{len(calls)}"
+
+    t = _hedging_transport()
+    start = time.perf_counter()
+    assert asyncio.run(t.acall(attempt, hedge=True)) == "call2"
+    assert time.perf_counter() - start < 1
+    assert len(calls) == 2 and cancelled == [True]
+    assert calls[1] < calls[0]  # el duplicado solo tiene el tiempo que queda
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    monkeypatch.setattr(transport, "LLM_HEDGE_MIN_DELAY_S", 0.5)
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        return "fast"
+
+    assert asyncio.run(_hedging_transport().acall(attempt, hedge=True)) == "fast"
+    assert len(calls) == 1
+
+
+def test_no_hedging_without_enough_latency_samples():
+    t = Transport(breaker=CircuitBreaker(failures=0))
+    assert t.hedge_delay() is None
@@ -0,0 +1,120 @@
+# tests/test_uploads.py
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from app.uploads import InvalidForm, UploadTooLarge, memory_usage, receive_form
+
+BOUNDARY = "----riskradar"
+
+
+def _body(fields, filename="plan.pdf", content=b"%PDF-1.4 contenido"):
+    parts = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+             for k, v in fields.items()]
+    if filename is not None:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                     f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n")
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+class _Request:
+    """Lo mínimo de starlette.Request que usa receive_form; cuenta lo que se ha leído."""
+
+    def __init__(self, body: bytes, chunk: int = 7, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self.body, self.chunk, self.read = body, chunk, 0
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk):
+            self.read = i + self.chunk
+            yield self.body[i:i + self.chunk]
+
+
+def test_fields_in_memory_and_file_streamed_to_disk():
+    content = os.urandom(5000)
+    request = _Request(_body({"context": "Bahn: Strecke 4", "lang": "de"}, content=content))
+    form, upload = asyncio.run(receive_form(request, max_bytes=10_000))
+    with upload:
+        assert form == {"context": "Bahn: Strecke 4", "lang": "de"}
+        assert upload.filename == "plan.pdf" and upload.path.endswith(".pdf")
+        assert upload.size == len(content)
+        assert upload.sha256 == hashlib.sha256(content).hexdigest()
+        with open(upload.path, "rb") as f:
+            assert f.read() == content
+    assert not os.path.exists(upload.path)
+
+
+def test_oversized_file_stops_reading_early(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.uploads.UPLOAD_TMP_DIR", str(tmp_path))
+    request = _Request(_body({}, content=b"x" * 200_000), chunk=1024)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(receive_form(request, max_bytes=10_000))
+    assert request.read < 20_000
+    assert os.listdir(tmp_path) == []  # el temporal a medias se borra
+
+
+def test_oversized_body_without_file_part_is_rejected():
+    request = _Request(_body({"context": "x" * 200_000}, filename=None), chunk=4096)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(receive_form(request, max_bytes=1000))
+    assert request.read < len(request.body)
+
+
+def test_on_file_runs_before_the_content_is_read():
+    request = _Request(_body({"lang": "en"}, filename="a.xls", content=b"x" * 100_000), chunk=512)
+
+    def reject(name):
+        raise ValueError(name)
+
+    with pytest.raises(ValueError, match="a.xls"):
+        asyncio.run(receive_form(request, on_file=reject))
+    assert request.read < 2000
+
+
+def test_missing_file_part_returns_none():
+    form, upload = asyncio.run(receive_form(_Request(_body({"lang": "en"}, filename=None))))
+    assert form == {"lang": "en"} and upload is None
+
+
+@pytest.mark.parametrize("request_", [
+    _Request(b"lang=en", content_type="application/x-www-form-urlencoded"),
+    _Request(_body({"lang": "en"})[:-40]),  # cortado en mitad del archivo
+])
+def test_invalid_forms(request_):
+    with pytest.raises(InvalidForm):
+        asyncio.run(receive_form(request_))
+
+
+def test_chunked_upload_without_content_length_gets_413(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app import main
+
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 10_000)
+    body = _body({"lang": "en"}, filename="a.txt", content=b"x" * 100_000)
+
+    def chunks():
+        for i in range(0, len(body), 4096):
+            yield body[i:i + 4096]
+
+    r = TestClient(main.app).post("/analyze", content=chunks(),
+                                  headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert r.status_code == 413
+    assert r.json()["error_code"] == "file_too_large"
+
+
+def test_memory_usage_reports_what_the_request_added():
+    # Primera petición grande: sube el pico del proceso
+    first = memory_usage({"rss_mb": 100.0, "rss_peak_mb": 100.0}, {"rss_mb": 120.0, "rss_peak_mb": 400.0})
+    assert first["rss_delta_mb"] == 20.0 and first["rss_peak_growth_mb"] == 300.0
+    # La siguiente no hereda ese pico como propio
+    second = memory_usage({"rss_mb": 120.0, "rss_peak_mb": 400.0}, {"rss_mb": 118.5, "rss_peak_mb": 400.0})
+    assert second["rss_delta_mb"] == -1.5 and second["rss_peak_growth_mb"] == 0.0
+    assert second["process_rss_peak_mb"] == 400.0
+
+
+def test_memory_usage_without_proc():
+    usage = memory_usage({"rss_peak_mb": 50.0}, {"rss_peak_mb": 50.0})
+    assert usage["rss_delta_mb"] is None and usage["rss_peak_growth_mb"] == 0.0
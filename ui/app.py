@@ -28,6 +28,11 @@ lang_code = LANGUAGES[lang]
 # ==========================
 BASE_URL = os.environ.get("API_URL", "https://ai-risk-radar-1-0-bwdu.onrender.com/")
 API_URL = f"{BASE_URL.rstrip('/')}/analyze"
+STREAM_URL = f"{BASE_URL.rstrip('/')}/analyze/stream"
+USE_STREAM = os.environ.get("API_STREAM", "1") != "0"
+# Key propia de la UI: la API le aplica la cuota de ADMISSION_QUOTAS en lugar de la de una sola IP
+API_KEY = os.environ.get("API_KEY", "")
+API_HEADERS = {"X-API-Key": API_KEY} if API_KEY else {}
 
 # ==========================
 # 📂 Configuración de Google Sheets
@@ -88,23 +93,89 @@ if not st.session_state["authorized"]:
 # ==========================
 # 🔄 Función para mostrar riesgos
 # ==========================
+def render_risk(row, icon, lang_code):
+    """Renderiza un riesgo (dict o fila de DataFrame) en un expansor"""
+    with st.expander(f"{icon} {row.get('risk', 'Riesgo sin título')}"):
+        if row.get("page") or row.get("evidence"):
+            st.markdown("**📄 Fuente del riesgo:**")
+        if row.get("page"):
+            st.markdown(f"• **Página:** {row['page']}")
+        if row.get("evidence"):
+            snippet = row["evidence"][:500]
+            st.markdown(f"• **Fragmento del texto:**\n\n> {snippet}{'...' if len(row['evidence']) > 500 else ''}")
+        st.markdown(f"**{t['columns']['justification'][lang_code]}**")
+        st.write(row.get("justification", ""))
+        st.markdown(f"**{t['columns']['countermeasure'][lang_code]}**")
+        st.write(row.get("countermeasure", ""))
+
+
 def render_risks(df, title, icon, lang_code):
     """Renderiza lista de riesgos con expansores y validaciones seguras"""
     if not df.empty:
         st.subheader(f"{icon} {title}")
     for _, row in df.iterrows():
-        with st.expander(f"{icon} {row.get('risk', 'Riesgo sin título')}"):
-            if row.get("page") or row.get("evidence"):
-                st.markdown("**📄 Fuente del riesgo:**")
-            if row.get("page"):
-                st.markdown(f"• **Página:** {row['page']}")
-            if row.get("evidence"):
-                snippet = row["evidence"][:500]
-                st.markdown(f"• **Fragmento del texto:**\n\n> {snippet}{'...' if len(row['evidence']) > 500 else ''}")
-            st.markdown(f"**{t['columns']['justification'][lang_code]}**")
-            st.write(row.get("justification", ""))
-            st.markdown(f"**{t['columns']['countermeasure'][lang_code]}**")
-            st.write(row.get("countermeasure", ""))
+        render_risk(row, icon, lang_code)
+
+
+def iter_sse(response):
+    """Itera eventos Server-Sent Events → (event, data_dict)"""
+    event, data_lines = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if event and data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def show_debug(result):
+    # 🔍 Info debug
+    dbg = result.get("_debug")
+    if dbg:
+        st.caption(f"DEBUG · chars={dbg.get('chars')} · file={dbg.get('filename')} · cache={dbg.get('cache')}")
+
+    if result.get("source") == "modo simulado (mock)":
+        st.info(t["mock_notice"][lang_code])
+
+
+def analyze_streaming(files, data):
+    """Pinta cada riesgo en cuanto llega del endpoint /analyze/stream"""
+    sections = {
+        "intuitive": (st.container(), t["intuitive_risks"][lang_code], "🔸"),
+        "counterintuitive": (st.container(), t["counterintuitive_risks"][lang_code], "🔹"),
+    }
+    started = set()
+    status = st.empty()
+    status.info(t["analyzing"][lang_code])
+
+    with requests.post(STREAM_URL, files=files, data=data, headers=API_HEADERS, stream=True, timeout=(10, 120)) as r:
+        if r.status_code != 200:
+            # errores de entrada llegan como JSON normal antes de abrir el stream
+            try:
+                msg = r.json().get("message", r.text)
+            except ValueError:
+                msg = r.text
+            st.error(f"{t['error']['default'][lang_code]}: {msg}")
+            return
+        for event, payload in iter_sse(r):
+            if event == "risk":
+                container, title, icon = sections.get(payload.get("kind"), sections["intuitive"])
+                with container:
+                    if payload.get("kind") not in started:
+                        st.subheader(f"{icon} {title}")
+                        started.add(payload.get("kind"))
+                    render_risk(payload.get("item", {}), icon, lang_code)
+            elif event == "done":
+                status.success(t["analysis_done"][lang_code])
+                show_debug(payload)
+            elif event == "error":
+                status.empty()
+                st.error(f"{t['error']['default'][lang_code]}: {payload.get('message')}")
 
 # ==========================
 # 🚀 Aplicación principal
@@ -120,14 +191,16 @@ if st.session_state["authorized"]:
         if not uploaded_file:
             st.warning(t["no_file_warning"][lang_code])
         else:
-            with st.spinner(t["analyzing"][lang_code]):
-                files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                data = {"context": context, "lang": lang_code}
-                try:
-                    r = requests.post(API_URL, files=files, data=data, timeout=120)
-                    r.raise_for_status()  # lanza error si no es 200
-
-                    result = r.json()
+            files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+            data = {"context": context, "lang": lang_code}
+            try:
+                if USE_STREAM:
+                    analyze_streaming(files, data)
+                else:
+                    with st.spinner(t["analyzing"][lang_code]):
+                        r = requests.post(API_URL, files=files, data=data, headers=API_HEADERS, timeout=120)
+                        r.raise_for_status()  # lanza error si no es 200
+                        result = r.json()
                     st.success(t["analysis_done"][lang_code])
 
                     # 🟠 Riesgos intuitivos
@@ -138,15 +211,9 @@ if st.session_state["authorized"]:
                     df2 = pd.DataFrame(result.get("counterintuitive_risks", []))
                     render_risks(df2, t["counterintuitive_risks"][lang_code], "🔹", lang_code)
 
-                    # 🔍 Info debug
-                    dbg = result.get("_debug")
-                    if dbg:
-                        st.caption(f"DEBUG · chars={dbg.get('chars')} · file={dbg.get('filename')}")
-
-                    if result.get("source") == "modo simulado (mock)":
-                        st.info(t["mock_notice"][lang_code])
+                    show_debug(result)
 
-                except requests.exceptions.RequestException as e:
-                    st.error(t["error"]["network"][lang_code] + f": {e}")
-                except Exception as e:
-                    st.error(f"{t['error']['default'][lang_code]}: {e}")
+            except requests.exceptions.RequestException as e:
+                st.error(t["error"]["network"][lang_code] + f": {e}")
+            except Exception as e:
+                st.error(f"{t['error']['default'][lang_code]}: {e}")